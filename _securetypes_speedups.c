@@ -0,0 +1,1386 @@
+/*
+ * Optional C accelerator for securetypes.
+ *
+ * This implements the type dispatch of securetypes._securehash_encode, the
+ * keyed hashing and wrapping done by a hash backend's wrap(key), and the
+ * SecureKey wrapper type, so that a securedict operation costs one C call
+ * plus the dict probe.  Tuple keys are encoded here too, from the keyed
+ * digests of their elements; other objects go through the Python encoder.
+ * securetypes.py falls back to its pure-Python implementation when this
+ * module isn't compiled, and the two must produce identical encodings.
+ */
+
+#include <Python.h>
+#include <structmember.h>
+
+/* Python 2's str is Python 3's bytes, and Python 3 has no int type apart
+   from long. */
+#if PY_MAJOR_VERSION >= 3
+#define IS_PY3 1
+#define PyString_CheckExact PyBytes_CheckExact
+#define PyString_Check PyBytes_Check
+#define PyString_AS_STRING PyBytes_AS_STRING
+#define PyString_GET_SIZE PyBytes_GET_SIZE
+#define PyString_FromString PyBytes_FromString
+#define PyString_FromStringAndSize PyBytes_FromStringAndSize
+#define PyString_InternFromString PyUnicode_InternFromString
+#define PyInt_CheckExact(op) 0
+#define PyInt_FromLong PyLong_FromLong
+#define PyInt_FromSsize_t PyLong_FromSsize_t
+#define TEXT_LENGTH PyUnicode_GET_LENGTH
+#define HASH_FORMAT "n"
+#else
+#define IS_PY3 0
+#define TEXT_LENGTH PyUnicode_GET_SIZE
+#define HASH_FORMAT "l"
+typedef long Py_hash_t;
+#endif
+
+#if PY_VERSION_HEX >= 0x03090000
+#define GC_IS_TRACKED PyObject_GC_IsTracked
+#else
+#define GC_IS_TRACKED _PyObject_GC_IS_TRACKED
+#endif
+
+static PyObject *tag_number;      /* "\x00" */
+static PyObject *tag_str;         /* "\x01" */
+static PyObject *tag_unicode;     /* "\x02" */
+static PyObject *tag_none;        /* "\x03" */
+static PyObject *tag_tuple;       /* "\x04" */
+static PyObject *tag_big;         /* "\x06" */
+static PyObject *tag_float;       /* "\x07" */
+
+/* Text keys longer than this many characters are hashed by
+   update_long_text, as securetypes._LONG_TEXT */
+#define LONG_TEXT 1024
+/* The size of the pieces that update_long_text encodes long text in */
+#define TEXT_CHUNK 8192
+static PyObject *empty_str;
+static PyObject *str_copy;
+static PyObject *str_update;
+static PyObject *str_digest;
+static PyObject *one;
+
+
+/* The payload of every nan, as securetypes._NAN */
+static const char nan_payload[8] = {0, 0, 0, 0, 0, 0, '\xf8', '\x7f'};
+
+
+/*
+ * Return a new reference to v in 8 little-endian bytes.
+ */
+static PyObject *
+pack_word(unsigned PY_LONG_LONG v)
+{
+	char buf[8];
+	int i;
+
+	for (i = 0; i < 8; i++) {
+		buf[i] = (char)(v & 0xff);
+		v >>= 8;
+	}
+	return PyString_FromStringAndSize(buf, 8);
+}
+
+
+/*
+ * Return a new reference to an int or long in hex, like '%#x' % obj, as a
+ * str (Python 2) or bytes (Python 3).
+ */
+static PyObject *
+hex_digits(PyObject *obj)
+{
+#if IS_PY3
+	PyObject *text, *digits;
+
+	text = PyNumber_ToBase(obj, 16);
+	if (text == NULL)
+		return NULL;
+	digits = PyUnicode_AsASCIIString(text);
+	Py_DECREF(text);
+	return digits;
+#else
+	return PyNumber_ToBase(obj, 16);
+#endif
+}
+
+
+/*
+ * Encode an int or long the way securetypes._encodeInteger does: in 8
+ * little-endian bytes if it fits in an int64, or in hex under tag_big if
+ * it doesn't.  Returns a new reference to the payload.
+ */
+static PyObject *
+encode_integer(PyObject *obj, PyObject **tag)
+{
+	PY_LONG_LONG v;
+
+#if !IS_PY3
+	if (PyInt_CheckExact(obj)) {
+		*tag = tag_number;
+		return pack_word((unsigned PY_LONG_LONG)PyInt_AS_LONG(obj));
+	}
+#endif
+	v = PyLong_AsLongLong(obj);
+	if (v == -1 && PyErr_Occurred()) {
+		if (!PyErr_ExceptionMatches(PyExc_OverflowError))
+			return NULL;
+		PyErr_Clear();
+		*tag = tag_big;
+		return hex_digits(obj);
+	}
+	*tag = tag_number;
+	return pack_word((unsigned PY_LONG_LONG)v);
+}
+
+
+/*
+ * Encode a float the way securetypes._encodeFloat does: a float that is
+ * == to an integer is encoded as that integer, and any other float in its
+ * 8 little-endian IEEE 754 bytes under tag_float.  Returns a new reference
+ * to the payload.
+ */
+static PyObject *
+encode_float(PyObject *obj, PyObject **tag)
+{
+	double d = PyFloat_AS_DOUBLE(obj);
+	union {
+		double d;
+		unsigned PY_LONG_LONG word;
+	} bits;
+
+	if (Py_IS_NAN(d)) {
+		*tag = tag_float;
+		return PyString_FromStringAndSize(nan_payload, 8);
+	}
+	if (!Py_IS_INFINITY(d) && floor(d) == d) {
+		PyObject *integer, *payload;
+
+		/* -2**63 <= d < 2**63, which are exact as doubles */
+		if (d >= -9223372036854775808.0 && d < 9223372036854775808.0) {
+			*tag = tag_number;
+			return pack_word((unsigned PY_LONG_LONG)(PY_LONG_LONG)d);
+		}
+		integer = PyLong_FromDouble(d);
+		if (integer == NULL)
+			return NULL;
+		*tag = tag_big;
+		payload = hex_digits(integer);
+		Py_DECREF(integer);
+		return payload;
+	}
+	*tag = tag_float;
+	bits.d = d;
+	return pack_word(bits.word);
+}
+
+
+/*
+ * Return 1 if unicode (Python 2) or str (Python 3) object obj is all ascii,
+ * or 0 if it isn't.  On Python 3, obj must be ready.
+ */
+static int
+text_is_ascii(PyObject *obj)
+{
+#if IS_PY3
+	return PyUnicode_IS_ASCII(obj);
+#else
+	const Py_UNICODE *p = PyUnicode_AS_UNICODE(obj);
+	Py_ssize_t i, n = PyUnicode_GET_SIZE(obj);
+	Py_UCS4 bits = 0;
+
+	for (i = 0; i < n; i++)
+		bits |= (Py_UCS4)p[i];
+	return bits < 0x80;
+#endif
+}
+
+
+/*
+ * Return a new reference to the payload of a unicode (Python 2) or str
+ * (Python 3) object, and set *tag to tag_str if it is all ascii, or to
+ * tag_unicode if it isn't.
+ */
+static PyObject *
+encode_text(PyObject *obj, PyObject **tag)
+{
+#if IS_PY3
+	/* Python 3 strings know whether they are ascii, and keep their ascii
+	   characters as bytes already. */
+	if (PyUnicode_READY(obj) == -1)
+		return NULL;
+	if (PyUnicode_IS_ASCII(obj)) {
+		*tag = tag_str;
+		return PyBytes_FromStringAndSize(
+			(const char *)PyUnicode_DATA(obj), PyUnicode_GET_LENGTH(obj));
+	}
+	*tag = tag_unicode;
+	/* Lone surrogates encode the way Python 2 encodes them */
+	return PyUnicode_AsEncodedString(obj, "utf-8", "surrogatepass");
+#else
+	/* Scan for non-ascii characters instead of trying the ascii codec,
+	   which raises and clears an exception for every non-ascii key. */
+	if (text_is_ascii(obj)) {
+		*tag = tag_str;
+		return PyUnicode_AsASCIIString(obj);
+	}
+	*tag = tag_unicode;
+	return PyUnicode_AsUTF8String(obj);
+#endif
+}
+
+
+/*
+ * Call h.update(data), and release data.  Returns 0, or -1 with an
+ * exception set.
+ */
+static int
+update_with(PyObject *h, PyObject *data)
+{
+	PyObject *r;
+
+	if (data == NULL)
+		return -1;
+	r = PyObject_CallMethodObjArgs(h, str_update, data, NULL);
+	Py_DECREF(data);
+	if (r == NULL)
+		return -1;
+	Py_DECREF(r);
+	return 0;
+}
+
+
+/*
+ * Update hash object h with the payload that encode_text would return for
+ * obj, without building all of it at once: ascii text on Python 3 is
+ * hashed straight from the string's own buffer, and anything else is
+ * encoded TEXT_CHUNK characters at a time.  This mirrors
+ * securetypes._hashLongText.  On Python 3, obj must be ready.  Returns 0,
+ * or -1 with an exception set.
+ */
+static int
+update_long_text(PyObject *h, PyObject *obj)
+{
+	Py_ssize_t start, stop, n = TEXT_LENGTH(obj);
+#if IS_PY3
+	PyObject *chunk;
+
+	if (PyUnicode_IS_ASCII(obj))
+		/* update() is done with the buffer when it returns */
+		return update_with(h, PyMemoryView_FromMemory(
+			(char *)PyUnicode_DATA(obj), n, PyBUF_READ));
+	for (start = 0; start < n; start = stop) {
+		stop = start + TEXT_CHUNK < n ? start + TEXT_CHUNK : n;
+		chunk = PyUnicode_Substring(obj, start, stop);
+		if (chunk == NULL)
+			return -1;
+		/* Lone surrogates encode the way Python 2 encodes them */
+		if (update_with(h, PyUnicode_AsEncodedString(
+			chunk, "utf-8", "surrogatepass")) == -1) {
+			Py_DECREF(chunk);
+			return -1;
+		}
+		Py_DECREF(chunk);
+	}
+#else
+	const Py_UNICODE *p = PyUnicode_AS_UNICODE(obj);
+
+	for (start = 0; start < n; start = stop) {
+		stop = start + TEXT_CHUNK < n ? start + TEXT_CHUNK : n;
+		/* Python 2 encodes a surrogate pair as the one character it
+		   stands for, so don't split a pair. */
+		if (stop < n && p[stop - 1] >= 0xd800 && p[stop - 1] <= 0xdbff)
+			stop++;
+		if (update_with(h, PyUnicode_EncodeUTF8(
+			p + start, stop - start, NULL)) == -1)
+			return -1;
+	}
+#endif
+	return 0;
+}
+
+
+/*
+ * Encode obj into a tag (borrowed reference) and payload (new reference).
+ * Returns 0 on success, 1 if obj is not one of the built-in types handled
+ * here, or -1 with an exception set.  The most common key types are
+ * tested first.
+ */
+static int
+encode_builtin(PyObject *obj, PyObject **tag, PyObject **payload)
+{
+	if (PyUnicode_CheckExact(obj)) {
+		*payload = encode_text(obj, tag);
+	}
+	else if (PyString_CheckExact(obj)) {
+		*tag = tag_str;
+		Py_INCREF(obj);
+		*payload = obj;
+	}
+	else if (PyLong_CheckExact(obj) || PyInt_CheckExact(obj)) {
+		*payload = encode_integer(obj, tag);
+	}
+	else if (PyBool_Check(obj)) {
+		*tag = tag_number;
+		*payload = pack_word(obj == Py_True);
+	}
+	else if (PyFloat_CheckExact(obj)) {
+		*payload = encode_float(obj, tag);
+	}
+	else if (obj == Py_None) {
+		*tag = tag_none;
+		Py_INCREF(empty_str);
+		*payload = empty_str;
+	}
+	else {
+		return 1;
+	}
+	return *payload == NULL ? -1 : 0;
+}
+
+
+/*
+ * Like encode_builtin, but falls back to calling the Python encoder for
+ * other types.  The tag is a new reference.
+ */
+static int
+encode(PyObject *obj, PyObject *fallback, PyObject **tag, PyObject **payload)
+{
+	PyObject *result;
+	int r;
+
+	r = encode_builtin(obj, tag, payload);
+	if (r == 0)
+		Py_INCREF(*tag);
+	if (r != 1)
+		return r;
+
+	result = PyObject_CallFunctionObjArgs(fallback, obj, NULL);
+	if (result == NULL)
+		return -1;
+	if (!PyTuple_Check(result) || PyTuple_GET_SIZE(result) != 2) {
+		PyErr_SetString(PyExc_TypeError,
+			"encoder must return a (tag, payload) tuple");
+		Py_DECREF(result);
+		return -1;
+	}
+	*tag = PyTuple_GET_ITEM(result, 0);
+	*payload = PyTuple_GET_ITEM(result, 1);
+	Py_INCREF(*tag);
+	Py_INCREF(*payload);
+	Py_DECREF(result);
+	return 0;
+}
+
+
+static PyObject *
+speedups_encode(PyObject *self, PyObject *obj)
+{
+	PyObject *tag, *payload, *result;
+	int r;
+
+	r = encode_builtin(obj, &tag, &payload);
+	if (r == 1) {
+		PyErr_Format(PyExc_TypeError,
+			"Don't know how to securely hash a %s object",
+			Py_TYPE(obj)->tp_name);
+		return NULL;
+	}
+	if (r == -1)
+		return NULL;
+	result = PyTuple_Pack(2, tag, payload);
+	Py_DECREF(payload);
+	return result;
+}
+
+
+/*
+ * SecureKey: the key wrapper that a securedict stores for each key.  It
+ * holds the key and a machine word taken from the key's keyed digest, and
+ * its hash is that word, so hashing a wrapper never rehashes the key.
+ */
+
+typedef struct {
+	PyObject_HEAD
+	PyObject *key;
+	Py_hash_t hash;
+} SecureKey;
+
+static PyTypeObject SecureKeyType;
+/* A SecureKey for a tuple or an object with __securehash__, which could
+   refer back to the securedict that holds it.  It takes part in garbage
+   collection; wrappers of atomic keys don't need to. */
+static PyTypeObject SecureContainerKeyType;
+
+#define SecureKey_Check(op) (Py_TYPE(op) == &SecureKeyType || \
+	Py_TYPE(op) == &SecureContainerKeyType)
+
+
+static PyObject *
+SecureKey_create(PyObject *key, Py_hash_t hash)
+{
+	SecureKey *self;
+	int container;
+
+	container = !(PyString_CheckExact(key) || PyUnicode_CheckExact(key) ||
+		PyInt_CheckExact(key) || PyLong_CheckExact(key) ||
+		PyFloat_CheckExact(key) || PyBool_Check(key) || key == Py_None);
+	if (container)
+		self = PyObject_GC_New(SecureKey, &SecureContainerKeyType);
+	else
+		self = PyObject_New(SecureKey, &SecureKeyType);
+	if (self == NULL)
+		return NULL;
+	Py_INCREF(key);
+	self->key = key;
+	/* -1 is reserved for errors */
+	self->hash = hash == -1 ? -2 : hash;
+	if (container)
+		PyObject_GC_Track(self);
+	return (PyObject *)self;
+}
+
+
+static PyObject *
+SecureKey_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+	PyObject *key;
+	Py_hash_t hash;
+
+	if (!PyArg_ParseTuple(args, "O" HASH_FORMAT ":SecureKey", &key, &hash))
+		return NULL;
+	return SecureKey_create(key, hash);
+}
+
+
+static void
+SecureKey_dealloc(SecureKey *self)
+{
+	Py_DECREF(self->key);
+	PyObject_Del(self);
+}
+
+
+static void
+SecureContainerKey_dealloc(SecureKey *self)
+{
+	PyObject_GC_UnTrack(self);
+	Py_DECREF(self->key);
+	PyObject_GC_Del(self);
+}
+
+
+/* Like a tuple, a SecureContainerKey is immutable, so it has no tp_clear;
+   the collector breaks cycles through it elsewhere. */
+static int
+SecureContainerKey_traverse(SecureKey *self, visitproc visit, void *arg)
+{
+	Py_VISIT(self->key);
+	return 0;
+}
+
+
+static Py_hash_t
+SecureKey_hash(SecureKey *self)
+{
+	return self->hash;
+}
+
+
+static PyObject *
+SecureKey_richcompare(PyObject *a, PyObject *b, int op)
+{
+	SecureKey *x, *y;
+	int eq;
+
+	if ((op != Py_EQ && op != Py_NE) ||
+		!SecureKey_Check(a) || !SecureKey_Check(b)) {
+		Py_INCREF(Py_NotImplemented);
+		return Py_NotImplemented;
+	}
+	x = (SecureKey *)a;
+	y = (SecureKey *)b;
+	if (x->hash != y->hash)
+		eq = 0;
+	else if (x->key == y->key)
+		eq = 1;
+	else {
+		eq = PyObject_RichCompareBool(x->key, y->key, Py_EQ);
+		if (eq == -1)
+			return NULL;
+	}
+	if (op == Py_NE)
+		eq = !eq;
+	if (eq)
+		Py_RETURN_TRUE;
+	Py_RETURN_FALSE;
+}
+
+
+static PyObject *
+SecureKey_repr(SecureKey *self)
+{
+#if IS_PY3
+	return PyUnicode_FromFormat("_securedictmarker(%R)", self->key);
+#else
+	PyObject *keyrepr, *result;
+
+	keyrepr = PyObject_Repr(self->key);
+	if (keyrepr == NULL)
+		return NULL;
+	result = PyString_FromFormat("_securedictmarker(%s)",
+		PyString_AS_STRING(keyrepr));
+	Py_DECREF(keyrepr);
+	return result;
+#endif
+}
+
+
+static PyMemberDef SecureKey_members[] = {
+	{"key", T_OBJECT, offsetof(SecureKey, key), READONLY,
+		"The original key."},
+	{NULL}
+};
+
+
+static PyTypeObject SecureKeyType = {
+	PyVarObject_HEAD_INIT(NULL, 0)
+	"_securetypes_speedups.SecureKey",        /* tp_name */
+	sizeof(SecureKey),                        /* tp_basicsize */
+	0,                                        /* tp_itemsize */
+	(destructor)SecureKey_dealloc,            /* tp_dealloc */
+	0,                                        /* tp_print */
+	0,                                        /* tp_getattr */
+	0,                                        /* tp_setattr */
+	0,                                        /* tp_compare */
+	(reprfunc)SecureKey_repr,                 /* tp_repr */
+	0,                                        /* tp_as_number */
+	0,                                        /* tp_as_sequence */
+	0,                                        /* tp_as_mapping */
+	(hashfunc)SecureKey_hash,                 /* tp_hash */
+	0,                                        /* tp_call */
+	0,                                        /* tp_str */
+	0,                                        /* tp_getattro */
+	0,                                        /* tp_setattro */
+	0,                                        /* tp_as_buffer */
+	Py_TPFLAGS_DEFAULT,                       /* tp_flags */
+	"SecureKey(key, hash)\n\n"
+	"The key wrapper that a securedict stores for each key.",
+	0,                                        /* tp_traverse */
+	0,                                        /* tp_clear */
+	SecureKey_richcompare,                    /* tp_richcompare */
+	0,                                        /* tp_weaklistoffset */
+	0,                                        /* tp_iter */
+	0,                                        /* tp_iternext */
+	0,                                        /* tp_methods */
+	SecureKey_members,                        /* tp_members */
+	0,                                        /* tp_getset */
+	0,                                        /* tp_base */
+	0,                                        /* tp_dict */
+	0,                                        /* tp_descr_get */
+	0,                                        /* tp_descr_set */
+	0,                                        /* tp_dictoffset */
+	0,                                        /* tp_init */
+	0,                                        /* tp_alloc */
+	SecureKey_new,                            /* tp_new */
+};
+
+
+static PyTypeObject SecureContainerKeyType = {
+	PyVarObject_HEAD_INIT(NULL, 0)
+	"_securetypes_speedups.SecureContainerKey", /* tp_name */
+	sizeof(SecureKey),                        /* tp_basicsize */
+	0,                                        /* tp_itemsize */
+	(destructor)SecureContainerKey_dealloc,   /* tp_dealloc */
+	0,                                        /* tp_print */
+	0,                                        /* tp_getattr */
+	0,                                        /* tp_setattr */
+	0,                                        /* tp_compare */
+	0,                                        /* tp_repr */
+	0,                                        /* tp_as_number */
+	0,                                        /* tp_as_sequence */
+	0,                                        /* tp_as_mapping */
+	0,                                        /* tp_hash */
+	0,                                        /* tp_call */
+	0,                                        /* tp_str */
+	0,                                        /* tp_getattro */
+	0,                                        /* tp_setattro */
+	0,                                        /* tp_as_buffer */
+	Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC,  /* tp_flags */
+	"The key wrapper that a securedict stores for a tuple key or a key\n"
+	"with __securehash__.",
+	(traverseproc)SecureContainerKey_traverse, /* tp_traverse */
+	0,                                        /* tp_clear */
+	0,                                        /* tp_richcompare */
+	0,                                        /* tp_weaklistoffset */
+	0,                                        /* tp_iter */
+	0,                                        /* tp_iternext */
+	0,                                        /* tp_methods */
+	0,                                        /* tp_members */
+	0,                                        /* tp_getset */
+	&SecureKeyType,                           /* tp_base */
+	0,                                        /* tp_dict */
+	0,                                        /* tp_descr_get */
+	0,                                        /* tp_descr_set */
+	0,                                        /* tp_dictoffset */
+	0,                                        /* tp_init */
+	0,                                        /* tp_alloc */
+	0,                                        /* tp_new */
+	PyObject_GC_Del,                          /* tp_free */
+};
+
+
+/* KeyWrapper: a hash backend's wrap(key), implemented in C */
+
+typedef struct {
+	PyObject_HEAD
+	PyObject *prefixes;
+	PyObject *fallback;
+	/* The DigestCache's entries dict and _admit method, or NULL */
+	PyObject *entries;
+	PyObject *admit;
+	Py_ssize_t max_key_length;
+	/* The backend's max_key_length, or -1 for no limit */
+	Py_ssize_t length_limit;
+	/* The fallback refers to its KeyWrapper weakly, to avoid a cycle */
+	PyObject *weakreflist;
+} KeyWrapper;
+
+
+static int
+KeyWrapper_init(KeyWrapper *self, PyObject *args, PyObject *kwds)
+{
+	PyObject *prefixes, *fallback, *cache = Py_None, *limit = Py_None;
+	PyObject *entries = NULL, *admit = NULL, *maxLength = NULL;
+	Py_ssize_t max_key_length = 0, length_limit = -1;
+
+	if (!PyArg_ParseTuple(args, "OO|OO:KeyWrapper",
+		&prefixes, &fallback, &cache, &limit))
+		return -1;
+	if (!PyDict_Check(prefixes)) {
+		PyErr_SetString(PyExc_TypeError, "prefixes must be a dict");
+		return -1;
+	}
+	if (limit != Py_None) {
+		length_limit = PyNumber_AsSsize_t(limit, PyExc_OverflowError);
+		if (length_limit == -1 && PyErr_Occurred())
+			return -1;
+		if (length_limit < 0) {
+			PyErr_SetString(PyExc_ValueError,
+				"max_key_length must be None or at least 0");
+			return -1;
+		}
+	}
+	if (cache != Py_None) {
+		entries = PyObject_GetAttrString(cache, "_entries");
+		admit = PyObject_GetAttrString(cache, "_admit");
+		maxLength = PyObject_GetAttrString(cache, "max_key_length");
+		if (entries == NULL || admit == NULL || maxLength == NULL)
+			goto error;
+		if (!PyDict_Check(entries)) {
+			PyErr_SetString(PyExc_TypeError,
+				"cache._entries must be a dict");
+			goto error;
+		}
+		max_key_length = PyNumber_AsSsize_t(maxLength, PyExc_OverflowError);
+		if (max_key_length == -1 && PyErr_Occurred())
+			goto error;
+		Py_DECREF(maxLength);
+	}
+	Py_INCREF(prefixes);
+	Py_INCREF(fallback);
+	Py_XDECREF(self->prefixes);
+	Py_XDECREF(self->fallback);
+	Py_XDECREF(self->entries);
+	Py_XDECREF(self->admit);
+	self->prefixes = prefixes;
+	self->fallback = fallback;
+	self->entries = entries;
+	self->admit = admit;
+	self->max_key_length = max_key_length;
+	self->length_limit = length_limit;
+	return 0;
+
+error:
+	Py_XDECREF(entries);
+	Py_XDECREF(admit);
+	Py_XDECREF(maxLength);
+	return -1;
+}
+
+
+static int
+KeyWrapper_traverse(KeyWrapper *self, visitproc visit, void *arg)
+{
+	Py_VISIT(self->prefixes);
+	Py_VISIT(self->fallback);
+	Py_VISIT(self->entries);
+	Py_VISIT(self->admit);
+	return 0;
+}
+
+
+static int
+KeyWrapper_clear(KeyWrapper *self)
+{
+	Py_CLEAR(self->prefixes);
+	Py_CLEAR(self->fallback);
+	Py_CLEAR(self->entries);
+	Py_CLEAR(self->admit);
+	return 0;
+}
+
+
+static void
+KeyWrapper_dealloc(KeyWrapper *self)
+{
+	PyObject_GC_UnTrack(self);
+	if (self->weakreflist != NULL)
+		PyObject_ClearWeakRefs((PyObject *)self);
+	KeyWrapper_clear(self);
+	Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+
+static PyObject *keyed_digest(KeyWrapper *self, PyObject *key);
+
+
+/* Return a new reference to the payload for a tuple: the concatenated
+   keyed digests of its elements. */
+static PyObject *
+tuple_payload(KeyWrapper *self, PyObject *tuple)
+{
+	PyObject *digests, *digest, *payload = NULL;
+	Py_ssize_t i, n, size = 0;
+	char *p;
+
+	if (Py_EnterRecursiveCall(" while securely hashing a tuple"))
+		return NULL;
+	n = PyTuple_GET_SIZE(tuple);
+	digests = PyList_New(n);
+	if (digests == NULL)
+		goto done;
+	for (i = 0; i < n; i++) {
+		digest = keyed_digest(self, PyTuple_GET_ITEM(tuple, i));
+		if (digest == NULL)
+			goto done;
+		PyList_SET_ITEM(digests, i, digest);
+		if (!PyString_Check(digest)) {
+			PyErr_SetString(PyExc_TypeError, "digest must be bytes");
+			goto done;
+		}
+		size += PyString_GET_SIZE(digest);
+	}
+	payload = PyString_FromStringAndSize(NULL, size);
+	if (payload == NULL)
+		goto done;
+	p = PyString_AS_STRING(payload);
+	for (i = 0; i < n; i++) {
+		digest = PyList_GET_ITEM(digests, i);
+		memcpy(p, PyString_AS_STRING(digest), PyString_GET_SIZE(digest));
+		p += PyString_GET_SIZE(digest);
+	}
+
+done:
+	Py_XDECREF(digests);
+	Py_LeaveRecursiveCall();
+	return payload;
+}
+
+
+/* Return a new reference to the keyed digest of key, computed without
+   the digest cache. */
+static PyObject *
+uncached_digest(KeyWrapper *self, PyObject *key)
+{
+	PyObject *tag, *payload = NULL, *state, *h, *r, *digest = NULL;
+
+	if (PyTuple_CheckExact(key)) {
+		payload = tuple_payload(self, key);
+		if (payload == NULL)
+			return NULL;
+		tag = tag_tuple;
+		Py_INCREF(tag);
+	}
+	else if (PyUnicode_CheckExact(key) &&
+#if IS_PY3
+		PyUnicode_READY(key) == 0 &&
+#endif
+		TEXT_LENGTH(key) > LONG_TEXT) {
+		/* Hashed by update_long_text below, with no payload */
+		tag = text_is_ascii(key) ? tag_str : tag_unicode;
+		Py_INCREF(tag);
+	}
+	else if (encode(key, self->fallback, &tag, &payload) == -1)
+		return NULL;
+
+	/* The prefixes dict fills itself in with __missing__ */
+	state = PyDict_GetItem(self->prefixes, tag);
+	if (state != NULL)
+		Py_INCREF(state);
+	else
+		state = PyObject_GetItem(self->prefixes, tag);
+	Py_DECREF(tag);
+	if (state == NULL)
+		goto done;
+
+	h = PyObject_CallMethodObjArgs(state, str_copy, NULL);
+	Py_DECREF(state);
+	if (h == NULL)
+		goto done;
+	if (payload == NULL) {
+		if (update_long_text(h, key) == 0)
+			digest = PyObject_CallMethodObjArgs(h, str_digest, NULL);
+	}
+	else {
+		r = PyObject_CallMethodObjArgs(h, str_update, payload, NULL);
+		if (r != NULL) {
+			Py_DECREF(r);
+			digest = PyObject_CallMethodObjArgs(h, str_digest, NULL);
+		}
+	}
+	Py_DECREF(h);
+
+done:
+	Py_XDECREF(payload);
+	return digest;
+}
+
+
+/* Return a new reference to the keyed digest of key, looking it up in and
+   admitting it to the digest cache if there is one and the key is short
+   enough.  This mirrors _HashBackend._cachedDigest. */
+static PyObject *
+keyed_digest(KeyWrapper *self, PyObject *key)
+{
+	PyObject *entry, *count, *digest, *r;
+	Py_ssize_t length;
+
+	if (self->prefixes == NULL) {
+		PyErr_SetString(PyExc_ValueError, "KeyWrapper is not initialized");
+		return NULL;
+	}
+	if (self->entries == NULL && self->length_limit < 0)
+		return uncached_digest(self, key);
+	if (PyString_CheckExact(key))
+		length = PyString_GET_SIZE(key);
+	else if (PyUnicode_CheckExact(key)) {
+#if IS_PY3
+		if (PyUnicode_READY(key) == -1)
+			return NULL;
+#endif
+		length = TEXT_LENGTH(key);
+	}
+	else
+		return uncached_digest(self, key);
+	if (self->length_limit >= 0 && length > self->length_limit) {
+		PyErr_Format(PyExc_ValueError, "key of length %zd is longer than "
+			"the hash backend's max_key_length of %zd",
+			length, self->length_limit);
+		return NULL;
+	}
+	if (self->entries == NULL || length > self->max_key_length)
+		return uncached_digest(self, key);
+
+	/* An entry is a [digest, hits] list; see DigestCache. */
+	entry = PyDict_GetItem(self->entries, key);
+	if (entry != NULL && PyList_CheckExact(entry) &&
+		PyList_GET_SIZE(entry) == 2) {
+		count = PyNumber_Add(PyList_GET_ITEM(entry, 1), one);
+		if (count == NULL)
+			return NULL;
+		digest = PyList_GET_ITEM(entry, 0);
+		Py_INCREF(digest);
+		/* Steals count, and releases the old count */
+		PyList_SetItem(entry, 1, count);
+		return digest;
+	}
+
+	digest = uncached_digest(self, key);
+	if (digest == NULL)
+		return NULL;
+	r = PyObject_CallFunctionObjArgs(self->admit, key, digest, NULL);
+	if (r == NULL) {
+		Py_DECREF(digest);
+		return NULL;
+	}
+	Py_DECREF(r);
+	return digest;
+}
+
+
+/* Return a new reference to the SecureKey for key. */
+static PyObject *
+wrap_key(KeyWrapper *self, PyObject *key)
+{
+	PyObject *digest;
+	Py_hash_t hash;
+
+	digest = keyed_digest(self, key);
+	if (digest == NULL)
+		return NULL;
+	if (!PyString_Check(digest) ||
+		PyString_GET_SIZE(digest) < (Py_ssize_t)sizeof(Py_hash_t)) {
+		PyErr_SetString(PyExc_ValueError, "digest is too short");
+		Py_DECREF(digest);
+		return NULL;
+	}
+	memcpy(&hash, PyString_AS_STRING(digest), sizeof(Py_hash_t));
+	Py_DECREF(digest);
+	return SecureKey_create(key, hash);
+}
+
+
+static PyObject *
+KeyWrapper_call(KeyWrapper *self, PyObject *args, PyObject *kwds)
+{
+	PyObject *key;
+
+	if (!PyArg_UnpackTuple(args, "KeyWrapper", 1, 1, &key))
+		return NULL;
+	return wrap_key(self, key);
+}
+
+
+static PyObject *
+KeyWrapper_wrap_many(KeyWrapper *self, PyObject *keys)
+{
+	PyObject *it, *key, *wrapper, *result;
+
+	it = PyObject_GetIter(keys);
+	if (it == NULL)
+		return NULL;
+	result = PyList_New(0);
+	if (result == NULL)
+		goto error;
+	while ((key = PyIter_Next(it)) != NULL) {
+		wrapper = wrap_key(self, key);
+		Py_DECREF(key);
+		if (wrapper == NULL)
+			goto error;
+		if (PyList_Append(result, wrapper) == -1) {
+			Py_DECREF(wrapper);
+			goto error;
+		}
+		Py_DECREF(wrapper);
+	}
+	if (PyErr_Occurred())
+		goto error;
+	Py_DECREF(it);
+	return result;
+
+error:
+	Py_DECREF(it);
+	Py_XDECREF(result);
+	return NULL;
+}
+
+
+static PyObject *
+KeyWrapper_wrap_items(KeyWrapper *self, PyObject *items)
+{
+	PyObject *it, *item, *fast, *wrapper, *pair, *result;
+	Py_ssize_t i = 0;
+
+	it = PyObject_GetIter(items);
+	if (it == NULL)
+		return NULL;
+	result = PyList_New(0);
+	if (result == NULL)
+		goto error;
+	while ((item = PyIter_Next(it)) != NULL) {
+		fast = PySequence_Fast(item, "");
+		Py_DECREF(item);
+		if (fast == NULL) {
+			if (PyErr_ExceptionMatches(PyExc_TypeError))
+				PyErr_Format(PyExc_TypeError,
+					"cannot convert update sequence element #%zd "
+					"to a sequence", i);
+			goto error;
+		}
+		if (PySequence_Fast_GET_SIZE(fast) != 2) {
+			PyErr_Format(PyExc_ValueError,
+				"update sequence element #%zd has length %zd; "
+				"2 is required", i, PySequence_Fast_GET_SIZE(fast));
+			Py_DECREF(fast);
+			goto error;
+		}
+		wrapper = wrap_key(self, PySequence_Fast_GET_ITEM(fast, 0));
+		if (wrapper == NULL) {
+			Py_DECREF(fast);
+			goto error;
+		}
+		pair = PyTuple_Pack(2, wrapper, PySequence_Fast_GET_ITEM(fast, 1));
+		Py_DECREF(wrapper);
+		Py_DECREF(fast);
+		if (pair == NULL)
+			goto error;
+		if (PyList_Append(result, pair) == -1) {
+			Py_DECREF(pair);
+			goto error;
+		}
+		Py_DECREF(pair);
+		i++;
+	}
+	if (PyErr_Occurred())
+		goto error;
+	Py_DECREF(it);
+	return result;
+
+error:
+	Py_DECREF(it);
+	Py_XDECREF(result);
+	return NULL;
+}
+
+
+static PyObject *
+KeyWrapper_digest(KeyWrapper *self, PyObject *key)
+{
+	return keyed_digest(self, key);
+}
+
+
+static PyMethodDef KeyWrapper_methods[] = {
+	{"digest", (PyCFunction)KeyWrapper_digest, METH_O,
+		"Return the keyed digest of a key."},
+	{"wrap_many", (PyCFunction)KeyWrapper_wrap_many, METH_O,
+		"Return a list of the key wrappers for an iterable of keys."},
+	{"wrap_items", (PyCFunction)KeyWrapper_wrap_items, METH_O,
+		"Return a list of (wrapper, value) pairs for an iterable of\n"
+		"(key, value) pairs."},
+	{NULL}
+};
+
+
+static PyTypeObject KeyWrapperType = {
+	PyVarObject_HEAD_INIT(NULL, 0)
+	"_securetypes_speedups.KeyWrapper",       /* tp_name */
+	sizeof(KeyWrapper),                       /* tp_basicsize */
+	0,                                        /* tp_itemsize */
+	(destructor)KeyWrapper_dealloc,           /* tp_dealloc */
+	0,                                        /* tp_print */
+	0,                                        /* tp_getattr */
+	0,                                        /* tp_setattr */
+	0,                                        /* tp_compare */
+	0,                                        /* tp_repr */
+	0,                                        /* tp_as_number */
+	0,                                        /* tp_as_sequence */
+	0,                                        /* tp_as_mapping */
+	0,                                        /* tp_hash */
+	(ternaryfunc)KeyWrapper_call,             /* tp_call */
+	0,                                        /* tp_str */
+	0,                                        /* tp_getattro */
+	0,                                        /* tp_setattro */
+	0,                                        /* tp_as_buffer */
+	Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC,  /* tp_flags */
+	"KeyWrapper(prefixes, fallback, cache=None, max_key_length=None)\n\n"
+	"Callable that returns the securedict key wrapper for a key.",
+	(traverseproc)KeyWrapper_traverse,        /* tp_traverse */
+	(inquiry)KeyWrapper_clear,                /* tp_clear */
+	0,                                        /* tp_richcompare */
+	offsetof(KeyWrapper, weakreflist),        /* tp_weaklistoffset */
+	0,                                        /* tp_iter */
+	0,                                        /* tp_iternext */
+	KeyWrapper_methods,                       /* tp_methods */
+	0,                                        /* tp_members */
+	0,                                        /* tp_getset */
+	0,                                        /* tp_base */
+	0,                                        /* tp_dict */
+	0,                                        /* tp_descr_get */
+	0,                                        /* tp_descr_set */
+	0,                                        /* tp_dictoffset */
+	(initproc)KeyWrapper_init,                /* tp_init */
+	0,                                        /* tp_alloc */
+	PyType_GenericNew,                        /* tp_new */
+};
+
+
+/* KeyIter: iterates over a securedict's keys or (key, value) pairs,
+   unwrapping each key wrapper, without going through the dict's own
+   iterators.  Like a dict iterator, it raises RuntimeError if the dict
+   changes size during iteration, or if it finds more keys than the dict
+   had (because keys were replaced without changing its size). */
+
+typedef struct {
+	PyObject_HEAD
+	PyDictObject *dict;      /* NULL when exhausted */
+	Py_ssize_t used;
+	Py_ssize_t pos;
+	Py_ssize_t len;
+	PyObject *result;        /* reusable (key, value) tuple, for items */
+	int items;
+} KeyIter;
+
+static PyTypeObject KeyIterType;
+
+
+static PyObject *
+keyiter_new(PyObject *dict, int items)
+{
+	KeyIter *self;
+
+	if (!PyDict_Check(dict)) {
+		PyErr_SetString(PyExc_TypeError, "expected a dict");
+		return NULL;
+	}
+	self = PyObject_GC_New(KeyIter, &KeyIterType);
+	if (self == NULL)
+		return NULL;
+	Py_INCREF(dict);
+	self->dict = (PyDictObject *)dict;
+	self->used = self->dict->ma_used;
+	self->pos = 0;
+	self->len = self->used;
+	self->items = items;
+	self->result = NULL;
+	if (items) {
+		self->result = PyTuple_Pack(2, Py_None, Py_None);
+		if (self->result == NULL) {
+			Py_DECREF(self);
+			return NULL;
+		}
+	}
+	PyObject_GC_Track(self);
+	return (PyObject *)self;
+}
+
+
+static PyObject *
+speedups_iter_keys(PyObject *module, PyObject *dict)
+{
+	return keyiter_new(dict, 0);
+}
+
+
+static PyObject *
+speedups_iter_items(PyObject *module, PyObject *dict)
+{
+	return keyiter_new(dict, 1);
+}
+
+
+static int
+KeyIter_traverse(KeyIter *self, visitproc visit, void *arg)
+{
+	Py_VISIT(self->dict);
+	Py_VISIT(self->result);
+	return 0;
+}
+
+
+static void
+KeyIter_dealloc(KeyIter *self)
+{
+	PyObject_GC_UnTrack(self);
+	Py_XDECREF(self->dict);
+	Py_XDECREF(self->result);
+	PyObject_GC_Del(self);
+}
+
+
+static PyObject *
+KeyIter_next(KeyIter *self)
+{
+	PyObject *wrapper, *value, *key, *result, *old;
+
+	if (self->dict == NULL)
+		return NULL;
+	if (self->used != self->dict->ma_used) {
+		PyErr_SetString(PyExc_RuntimeError,
+			"dictionary changed size during iteration");
+		/* Make this state sticky */
+		self->used = -1;
+		return NULL;
+	}
+	if (!PyDict_Next((PyObject *)self->dict, &self->pos, &wrapper, &value)) {
+		Py_CLEAR(self->dict);
+		return NULL;
+	}
+	if (self->len == 0) {
+		PyErr_SetString(PyExc_RuntimeError,
+			"dictionary keys changed during iteration");
+		self->used = -1;
+		return NULL;
+	}
+	self->len--;
+
+	if (SecureKey_Check(wrapper)) {
+		key = ((SecureKey *)wrapper)->key;
+		Py_INCREF(key);
+	}
+	else {
+		/* Someone dict.__setitem__ed something else into the securedict */
+		key = PyObject_GetAttrString(wrapper, "key");
+		if (key == NULL)
+			return NULL;
+	}
+	if (!self->items)
+		return key;
+
+	Py_INCREF(value);
+	result = self->result;
+	if (Py_REFCNT(result) == 1) {
+		/* Nobody kept the last pair, so reuse it, like dict iterators do */
+		Py_INCREF(result);
+		old = PyTuple_GET_ITEM(result, 0);
+		PyTuple_SET_ITEM(result, 0, key);
+		Py_DECREF(old);
+		old = PyTuple_GET_ITEM(result, 1);
+		PyTuple_SET_ITEM(result, 1, value);
+		Py_DECREF(old);
+		/* The GC untracks a tuple that holds only untracked objects, like
+		   the first (None, None), so track it again now that it may hold
+		   containers (see bpo-42536). */
+		if (!GC_IS_TRACKED(result))
+			PyObject_GC_Track(result);
+	}
+	else {
+		result = PyTuple_New(2);
+		if (result == NULL) {
+			Py_DECREF(key);
+			Py_DECREF(value);
+			return NULL;
+		}
+		PyTuple_SET_ITEM(result, 0, key);
+		PyTuple_SET_ITEM(result, 1, value);
+	}
+	return result;
+}
+
+
+static PyObject *
+KeyIter_length_hint(KeyIter *self)
+{
+	Py_ssize_t len = 0;
+
+	if (self->dict != NULL && self->used == self->dict->ma_used)
+		len = self->len;
+	return PyInt_FromSsize_t(len);
+}
+
+
+static PyMethodDef KeyIter_methods[] = {
+	{"__length_hint__", (PyCFunction)KeyIter_length_hint, METH_NOARGS,
+		"Private method returning an estimate of len(list(it))."},
+	{NULL}
+};
+
+
+static PyTypeObject KeyIterType = {
+	PyVarObject_HEAD_INIT(NULL, 0)
+	"_securetypes_speedups.KeyIter",          /* tp_name */
+	sizeof(KeyIter),                          /* tp_basicsize */
+	0,                                        /* tp_itemsize */
+	(destructor)KeyIter_dealloc,              /* tp_dealloc */
+	0,                                        /* tp_print */
+	0,                                        /* tp_getattr */
+	0,                                        /* tp_setattr */
+	0,                                        /* tp_compare */
+	0,                                        /* tp_repr */
+	0,                                        /* tp_as_number */
+	0,                                        /* tp_as_sequence */
+	0,                                        /* tp_as_mapping */
+	0,                                        /* tp_hash */
+	0,                                        /* tp_call */
+	0,                                        /* tp_str */
+	0,                                        /* tp_getattro */
+	0,                                        /* tp_setattro */
+	0,                                        /* tp_as_buffer */
+	Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC,  /* tp_flags */
+	0,                                        /* tp_doc */
+	(traverseproc)KeyIter_traverse,           /* tp_traverse */
+	0,                                        /* tp_clear */
+	0,                                        /* tp_richcompare */
+	0,                                        /* tp_weaklistoffset */
+	PyObject_SelfIter,                        /* tp_iter */
+	(iternextfunc)KeyIter_next,               /* tp_iternext */
+	KeyIter_methods,                          /* tp_methods */
+};
+
+
+static PyMethodDef speedups_methods[] = {
+	{"encode", (PyCFunction)speedups_encode, METH_O,
+		"Return the (tag, payload) encoding of a built-in key."},
+	{"iter_keys", (PyCFunction)speedups_iter_keys, METH_O,
+		"Return an iterator over the keys in a securedict, given as\n"
+		"a dict of key wrappers."},
+	{"iter_items", (PyCFunction)speedups_iter_items, METH_O,
+		"Return an iterator over the (key, value) pairs in a securedict,\n"
+		"given as a dict of key wrappers."},
+	{NULL}
+};
+
+
+#if IS_PY3
+static struct PyModuleDef speedups_module = {
+	PyModuleDef_HEAD_INIT,
+	"_securetypes_speedups",
+	"Optional C accelerator for securetypes.",
+	-1,
+	speedups_methods,
+};
+#endif
+
+
+static PyObject *
+init_module(void)
+{
+	PyObject *m;
+
+	if (PyType_Ready(&SecureKeyType) < 0)
+		return NULL;
+	if (PyType_Ready(&SecureContainerKeyType) < 0)
+		return NULL;
+	if (PyType_Ready(&KeyWrapperType) < 0)
+		return NULL;
+	if (PyType_Ready(&KeyIterType) < 0)
+		return NULL;
+
+	tag_number = PyString_FromStringAndSize("\x00", 1);
+	tag_str = PyString_FromStringAndSize("\x01", 1);
+	tag_unicode = PyString_FromStringAndSize("\x02", 1);
+	tag_none = PyString_FromStringAndSize("\x03", 1);
+	tag_tuple = PyString_FromStringAndSize("\x04", 1);
+	tag_big = PyString_FromStringAndSize("\x06", 1);
+	tag_float = PyString_FromStringAndSize("\x07", 1);
+	empty_str = PyString_FromStringAndSize("", 0);
+	str_copy = PyString_InternFromString("copy");
+	str_update = PyString_InternFromString("update");
+	str_digest = PyString_InternFromString("digest");
+	one = PyInt_FromLong(1);
+	if (!one || !tag_number || !tag_str || !tag_unicode || !tag_none ||
+		!tag_tuple || !tag_big || !tag_float || !empty_str || !str_copy ||
+		!str_update || !str_digest)
+		return NULL;
+
+#if IS_PY3
+	m = PyModule_Create(&speedups_module);
+#else
+	m = Py_InitModule3("_securetypes_speedups", speedups_methods,
+		"Optional C accelerator for securetypes.");
+#endif
+	if (m == NULL)
+		return NULL;
+
+	Py_INCREF(&SecureKeyType);
+	PyModule_AddObject(m, "SecureKey", (PyObject *)&SecureKeyType);
+	Py_INCREF(&KeyWrapperType);
+	PyModule_AddObject(m, "KeyWrapper", (PyObject *)&KeyWrapperType);
+	return m;
+}
+
+
+#if IS_PY3
+PyMODINIT_FUNC
+PyInit__securetypes_speedups(void)
+{
+	return init_module();
+}
+#else
+PyMODINIT_FUNC
+init_securetypes_speedups(void)
+{
+	init_module();
+}
+#endif
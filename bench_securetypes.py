@@ -0,0 +1,822 @@
+"""
+Benchmarks for securetypes.
+
+Print the micro-benchmarks with:
+
+	python bench_securetypes.py
+
+Compare securedict to dict across operations, key types, and sizes, and
+write the results as JSON (to track regressions between releases) with:
+
+	python bench_securetypes.py --json [--sizes 10,1000,100000] [--output FILE]
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+import pickle
+import timeit
+import tempfile
+import threading
+import platform
+import optparse
+
+try:
+	import simplejson as json
+except ImportError:
+	import json
+
+import securetypes
+from collections import OrderedDict
+
+from securetypes import (
+	securedict, secureordereddict, secureset, securecache,
+	concurrentsecuredict, frozensecuredict, Sha1Backend, DigestCache)
+
+try:
+	import cPickle
+except ImportError:
+	# Python 3's pickle uses its C implementation by itself
+	cPickle = pickle
+
+if sys.version_info[0] >= 3:
+	xrange = range
+
+
+def _makeDict(backend, keys):
+	d = securedict()
+	d.set_hash_backend(backend)
+	for k in keys:
+		d[k] = k
+	return d
+
+
+def _perCall(func, number):
+	"""
+	Return the best per-call time of C{func}, in nanoseconds.
+	"""
+	return min(timeit.Timer(func).repeat(3, number)) / number * 1e9
+
+
+def benchLookupLayouts(number=100000):
+	"""
+	Compare the per-digest and per-lookup cost of L{Sha1Backend} layout 1
+	(secret hashed again for every key) and layout 2 (secret absorbed once
+	into prefix states) for short str and int keys.
+	"""
+	results = []
+	for keyType, keys in [
+		('str', ['id', 'type', 'user', 'name']),
+		('int', [1, 22, 333, 4444]),
+	]:
+		for layout in (1, 2):
+			backend = Sha1Backend(layout=layout)
+			d = _makeDict(backend, keys)
+			k = keys[2]
+			digestNs = _perCall(lambda: backend.digest(k), number)
+			lookupNs = _perCall(lambda: d[k], number)
+			results.append((keyType, layout, digestNs, lookupNs))
+	return results
+
+
+def _implementations():
+	"""
+	Return a list of C{(name, backend)} for the default backend with and (if
+	it is compiled) without the C{_securetypes_speedups} extension.
+	"""
+	speedups = securetypes._speedups
+	securetypes._speedups = None
+	try:
+		implementations = [('python', securetypes._makeDefaultBackend())]
+	finally:
+		securetypes._speedups = speedups
+	if speedups is not None:
+		implementations.append(('c', securetypes._makeDefaultBackend()))
+	return implementations
+
+
+def benchSpeedups(number=100000):
+	"""
+	Compare the per-operation cost of securedict with and without the
+	C{_securetypes_speedups} extension.
+	"""
+	results = []
+	for implementation, backend in _implementations():
+		d = _makeDict(backend, ['id', 'type', 'user', 'name'])
+		results.append((implementation, 'getitem',
+			_perCall(lambda: d['user'], number)))
+		results.append((implementation, 'contains',
+			_perCall(lambda: 'user' in d, number)))
+		results.append((implementation, 'setitem',
+			_perCall(lambda: d.__setitem__('user', 1), number)))
+	return results
+
+
+class _CountingBackend(object):
+	"""
+	Wrap a hash backend to count how many keys it wraps one at a time.
+	"""
+	def __init__(self, backend):
+		self._wrap = backend.wrap
+		self.digest = backend.digest
+		self.wrap_many = backend.wrap_many
+		self.wrap_items = backend.wrap_items
+		self.iter_keys = backend.iter_keys
+		self.iter_items = backend.iter_items
+		self.wrapped = 0
+
+
+	def wrap(self, key):
+		self.wrapped += 1
+		return self._wrap(key)
+
+
+
+def benchSingleKey(number=100000):
+	"""
+	Return C{(operation, hashes, ns)} for single-key operations on a
+	securedict: how many keys each one hashes, and how long it takes.
+	"""
+	results = []
+	d = securedict({'user': 1, 'id': 2})
+	counting = securedict({'user': 1, 'id': 2})
+	backend = _CountingBackend(counting.get_hash_backend())
+	counting._backend = backend
+	for operation, stmt in [
+		("d[k]", lambda d: d['user']),
+		("d.get(k)", lambda d: d.get('user')),
+		("d.setdefault(k, v)", lambda d: d.setdefault('user', 1)),
+		("d.pop(k, None)", lambda d: d.pop('missing', None)),
+		("d[k] = v", lambda d: d.__setitem__('user', 1)),
+	]:
+		backend.wrapped = 0
+		stmt(counting)
+		results.append((operation, backend.wrapped,
+			_perCall(lambda: stmt(d), number)))
+	return results
+
+
+def benchDigestCache(number=100000):
+	"""
+	Compare looking up a short str key in a securedict with and without a
+	L{DigestCache} on its backend.
+	"""
+	results = []
+	for implementation, backend in _implementations():
+		d = _makeDict(backend, ['id', 'type', 'user', 'name'])
+		results.append((implementation, 'uncached',
+			_perCall(lambda: d['user'], number)))
+		backend.set_digest_cache(DigestCache())
+		results.append((implementation, 'cached',
+			_perCall(lambda: d['user'], number)))
+	return results
+
+
+class _Point(object):
+	def __init__(self, x, y):
+		self.x = x
+		self.y = y
+
+
+	def __eq__(self, other):
+		return (self.x, self.y) == (other.x, other.y)
+
+
+	def __hash__(self):
+		return hash((self.x, self.y))
+
+
+	def __securehash__(self):
+		return (self.x, self.y)
+
+
+def benchCompositeKeys(number=100000):
+	"""
+	Compare looking up tuple keys and a key with C{__securehash__} in a
+	securedict and in a dict.
+	"""
+	point = _Point(3, 4)
+	keys = [
+		('pair', ('user', 42)),
+		('nested', ((('user', 42), 'a'), 'b')),
+		('object', point)]
+	results = []
+	for name, key in keys:
+		d = {key: None}
+		results.append(('dict', name, _perCall(lambda: d[key], number)))
+	for implementation, backend in _implementations():
+		for name, key in keys:
+			d = _makeDict(backend, [key])
+			results.append((implementation, name,
+				_perCall(lambda: d[key], number)))
+	return results
+
+
+def benchSets(size=10000, number=10):
+	"""
+	Compare deduplicating C{size} str keys with a securedict of C{None}s and
+	with a secureset, and taking the union and intersection of two
+	securesets, against a C{set}.
+	"""
+	keys = ['key%d' % (i,) for i in xrange(size)]
+	others = ['key%d' % (i,) for i in xrange(size // 2, size + size // 2)]
+	results = []
+	for name, build in [
+	('set', set), ('securedict', securedict.fromkeys), ('secureset', secureset)]:
+		results.append((name, 'build',
+			_perCall(lambda: build(keys), number) / size))
+	for name, build in [('set', set), ('secureset', secureset)]:
+		a = build(keys)
+		b = build(others)
+		results.append((name, 'a | b', _perCall(lambda: a | b, number) / size))
+		results.append((name, 'a & b', _perCall(lambda: a & b, number) / size))
+	return results
+
+
+def benchLRU(size=1000, number=100000):
+	"""
+	Time one step of an LRU cache of C{size} str keys (look up a key, move it
+	to the end, insert a new key, and evict the oldest) with
+	C{OrderedDict}, with L{secureordereddict}, and with L{securecache}.
+	"""
+	results = []
+	for name, cls in [
+	('OrderedDict', OrderedDict), ('secure', secureordereddict)]:
+		d = cls(('key%d' % (i,), i) for i in xrange(size))
+		keys = ['key%d' % (i,) for i in xrange(size, size + number * 3)]
+		it = iter(keys)
+		if cls is OrderedDict:
+			# Python 2.7's OrderedDict has no move_to_end
+			def step():
+				k = next(iter(d))
+				d[k] = d.pop(k)
+				d[next(it)] = None
+				d.popitem(last=False)
+		else:
+			def step():
+				k = next(iter(d))
+				d[k]
+				d.move_to_end(k)
+				d[next(it)] = None
+				d.popitem(last=False)
+		results.append((name, _perCall(step, number)))
+	cache = securecache(size)
+	for i in xrange(size):
+		cache.put('key%d' % (i,), i)
+	it = iter(['key%d' % (i,) for i in xrange(size, size + number * 3)])
+	def step():
+		cache.get('key0')
+		cache.put(next(it), None)
+	results.append(('securecache', _perCall(step, number)))
+	return results
+
+
+class _LockedSecureDict(object):
+	"""
+	A securedict behind one global lock, to compare with
+	L{concurrentsecuredict}.
+	"""
+	def __init__(self, *args):
+		self._d = securedict(*args)
+		self._lock = threading.Lock()
+
+
+	def get(self, key):
+		with self._lock:
+			return self._d.get(key)
+
+
+	def __setitem__(self, key, value):
+		with self._lock:
+			self._d[key] = value
+
+
+	def get_or_insert(self, key, factory):
+		with self._lock:
+			d = self._d
+			if key not in d:
+				d[key] = factory()
+			return d[key]
+
+
+
+def benchConcurrent(size=10000, operations=100000, threadCounts=(1, 2, 4, 8),
+factoryDelay=None):
+	"""
+	Time C{operations} operations on a shared mapping of C{size} str keys
+	(8 C{get}s, a C{d[k] = v}, and a C{get_or_insert} of a new key in every
+	10), split between each number of threads in C{threadCounts}, with a
+	securedict behind one lock and with L{concurrentsecuredict}.  If
+	C{factoryDelay} is not C{None}, the C{get_or_insert} factory sleeps
+	that long, like a factory that does I/O.  Returns the wall-clock time
+	per operation.
+	"""
+	keys = ['key%d' % (i,) for i in xrange(size)]
+	if factoryDelay is None:
+		factory = int
+	else:
+		factory = lambda: time.sleep(factoryDelay)
+	results = []
+	for name, cls in [
+	('locked', _LockedSecureDict), ('concurrent', concurrentsecuredict)]:
+		for threadCount in threadCounts:
+			perThread = operations // threadCount
+
+			def work(offset):
+				get = d.get
+				getOrInsert = d.get_or_insert
+				for i in xrange(offset, offset + perThread // 10):
+					k = keys[i % size]
+					get(k)
+					get(keys[(i + 1) % size])
+					get(keys[(i + 2) % size])
+					get(keys[(i + 3) % size])
+					get(keys[(i + 4) % size])
+					get(keys[(i + 5) % size])
+					get(keys[(i + 6) % size])
+					get(keys[(i + 7) % size])
+					d[k] = i
+					getOrInsert(i, factory)
+
+			best = None
+			for attempt in xrange(3):
+				d = cls((k, 0) for k in keys)
+				threads = [threading.Thread(target=work, args=(n * perThread,))
+					for n in xrange(threadCount)]
+				start = time.time()
+				for t in threads:
+					t.start()
+				for t in threads:
+					t.join()
+				elapsed = time.time() - start
+				if best is None or elapsed < best:
+					best = elapsed
+			results.append((name, threadCount,
+				best / (perThread // 10 * 10 * threadCount) * 1e9))
+	return results
+
+
+def benchFrozen(size=100000, number=100000):
+	"""
+	Compare looking up a str key in a securedict of C{size} str keys and in
+	a L{frozensecuredict} of the same keys C{mmap}ed from a file.  Returns
+	the per-lookup times, and the per-key time to build the frozen buffer.
+	"""
+	items = [('key%d' % (i,), i) for i in xrange(size)]
+	d = securedict(items)
+	start = time.time()
+	buf = frozensecuredict.build(items, b'bench secret')
+	buildNs = (time.time() - start) / size * 1e9
+	f = tempfile.NamedTemporaryFile()
+	f.write(buf)
+	f.flush()
+	frozen = frozensecuredict.open(f.name, b'bench secret')
+	try:
+		return [
+			('securedict', _perCall(lambda: d['key500'], number)),
+			('frozen', _perCall(lambda: frozen['key500'], number)),
+			('frozen miss', _perCall(lambda: frozen.get('nokey'), number)),
+		], buildNs
+	finally:
+		frozen.close()
+		f.close()
+
+
+def benchBulkUpdate(size=10000, number=10):
+	"""
+	Compare inserting C{size} str keys one at a time with C{d[k] = v} to
+	inserting them with the batched C{update}.  Returns per-key costs.
+	"""
+	results = []
+	items = [(str(i), i) for i in xrange(size)]
+	for implementation, backend in _implementations():
+		def loop():
+			d = securedict()
+			d.set_hash_backend(backend)
+			for k, v in items:
+				d[k] = v
+
+		def bulk():
+			d = securedict()
+			d.set_hash_backend(backend)
+			d.update(items)
+
+		results.append((implementation, 'loop',
+			_perCall(loop, number) / size))
+		results.append((implementation, 'update',
+			_perCall(bulk, number) / size))
+	return results
+
+
+def benchFromkeys(size=10000, number=10):
+	"""
+	Compare building a securedict from C{size} str keys with a
+	C{d[k] = value} loop, with C{fromkeys}, and with C{fromkeys} of another
+	securedict (which reuses its key wrappers).  Returns per-key costs.
+	"""
+	results = []
+	keys = [str(i) for i in xrange(size)]
+	for implementation, backend in _implementations():
+		class benchdict(securedict):
+			hash_backend = backend
+
+		def loop():
+			d = benchdict()
+			for k in keys:
+				d[k] = None
+
+		source = benchdict.fromkeys(keys)
+		results.append((implementation, 'loop',
+			_perCall(loop, number) / size))
+		results.append((implementation, 'fromkeys',
+			_perCall(lambda: benchdict.fromkeys(keys), number) / size))
+		results.append((implementation, 'securedict',
+			_perCall(lambda: benchdict.fromkeys(source), number) / size))
+	return results
+
+
+def benchCopy(size=10**6):
+	"""
+	Compare copying a C{size}-entry securedict with C{copy()}, which reuses
+	the key wrappers, to rebuilding it from its items, which rehashes every
+	key.  Returns total seconds for each.
+	"""
+	results = []
+	for implementation, backend in _implementations():
+		d = securedict()
+		d.set_hash_backend(backend)
+		d.update((str(i), i) for i in xrange(size))
+
+		def rehash():
+			c = securedict()
+			c.set_hash_backend(backend)
+			c.update(d.items())
+
+		results.append((implementation, 'rehash',
+			min(timeit.Timer(rehash).repeat(3, 1))))
+		results.append((implementation, 'copy',
+			min(timeit.Timer(d.copy).repeat(3, 1))))
+	return results
+
+
+def benchSerialization(size=10**6):
+	"""
+	Time writing and reading a C{size}-entry securedict of str keys and int
+	values with C{dumps}/C{loads} and with C{cPickle} (protocol 2), and
+	return the total seconds for each and the size of the output.
+	"""
+	d = securedict((str(i), i) for i in xrange(size))
+	results = []
+	for name, dumps, loads in [
+		('dumps', securedict.dumps, securedict.loads),
+		('cPickle', lambda d: cPickle.dumps(d, 2), cPickle.loads),
+	]:
+		dumped = dumps(d)
+		results.append((name,
+			min(timeit.Timer(lambda: dumps(d)).repeat(3, 1)),
+			min(timeit.Timer(lambda: loads(dumped)).repeat(3, 1)),
+			len(dumped)))
+	return results
+
+
+def benchEquality(size=100000, number=3):
+	"""
+	Compare C{==} between two equal C{size}-key securedicts that use the
+	same hash backend, between a securedict and an equal dict, and between
+	two equal dicts.  Returns per-key costs.
+	"""
+	items = [(str(i), i) for i in xrange(size)]
+	a = securedict(items)
+	b = securedict(items)
+	plain = dict(items)
+	plainCopy = dict(items)
+	return [
+		('securedict', _perCall(lambda: a == b, number) / size),
+		('dict', _perCall(lambda: a == plain, number) / size),
+		('dict only', _perCall(lambda: plain == plainCopy, number) / size),
+	]
+
+
+def benchJSON(objects=10000, number=5):
+	"""
+	Compare decoding a JSON array of small objects with
+	C{JSONDecoder(object_pairs_hook=securedict)} to decoding it with
+	C{securejson.loads}.  Returns per-object costs.
+	"""
+	import json
+	import securejson
+
+	doc = json.dumps([
+		{"id": i, "type": "user", "name": "user%d" % (i,), "tags": []}
+		for i in xrange(objects)])
+	hookDecoder = json.JSONDecoder(object_pairs_hook=securedict)
+	return [
+		('hook', _perCall(lambda: hookDecoder.decode(doc), number) / objects),
+		('securejson',
+			_perCall(lambda: securejson.loads(doc), number) / objects),
+	]
+
+
+def wrapperSizes():
+	"""
+	Return the bytes used by each key wrapper (not counting the key itself),
+	for the old 3-tuple wrapper and the current Python and C wrappers.
+	"""
+	sizes = [('3-tuple', sys.getsizeof(('_securedictmarker', 'x' * 20, 1)) +
+		sys.getsizeof('x' * 20))]
+	speedups = securetypes._speedups
+	securetypes._speedups = None
+	try:
+		w = Sha1Backend().wrap(1)
+	finally:
+		securetypes._speedups = speedups
+	sizes.append(('python', sys.getsizeof(w) + sys.getsizeof(w[0])))
+	if speedups is not None:
+		sizes.append(('c', sys.getsizeof(Sha1Backend().wrap(1))))
+	return sizes
+
+
+# Make keys of each supported type.  bool and NoneType have only two and one
+# distinct keys, so their dicts never get bigger than that.
+_keyMakers = {
+	'str': lambda size: ['key%d' % (i,) for i in xrange(size)],
+	'unicode': lambda size: [u'key%d' % (i,) for i in xrange(size)],
+	'int': lambda size: range(size),
+	'long': lambda size: [2**64 + i for i in xrange(size)],
+	'float': lambda size: [i + 0.5 for i in xrange(size)],
+	'bool': lambda size: [False, True][:size],
+	'NoneType': lambda size: [None][:size],
+}
+
+KEY_TYPES = ['str', 'unicode', 'int', 'long', 'float', 'bool', 'NoneType']
+
+DEFAULT_SIZES = [10, 1000, 100000]
+
+# Each operation is (name, prepare, run): prepare(cls, keys, d) returns the
+# argument for run, and isn't timed; run(arg, keys) does the operation once
+# for every key (or once for the whole dict).  d is a cls with every key.
+OPERATIONS = [
+	('get', lambda cls, keys, d: d,
+		lambda d, keys: list(map(d.__getitem__, keys))),
+	('set', lambda cls, keys, d: cls(),
+		lambda d, keys: list(map(d.__setitem__, keys, keys))),
+	('contains', lambda cls, keys, d: d,
+		lambda d, keys: list(map(d.__contains__, keys))),
+	('delete', lambda cls, keys, d: d.copy(),
+		lambda d, keys: list(map(d.__delitem__, keys))),
+	('iterate', lambda cls, keys, d: d,
+		lambda d, keys: list(d)),
+	('copy', lambda cls, keys, d: d,
+		lambda d, keys: d.copy()),
+	('update', lambda cls, keys, d: (cls(), zip(keys, keys)),
+		lambda arg, keys: arg[0].update(arg[1])),
+	('repr', lambda cls, keys, d: d,
+		lambda d, keys: repr(d)),
+]
+
+# Operations timed on the colliding workload, which is quadratic for dict
+COLLIDING_OPERATIONS = ['get', 'set', 'contains']
+
+
+def collidingKeys(size):
+	"""
+	Return C{size} ints that all have the same C{hash()}, like the
+	C{hash(2**64)} examples in the README.
+	"""
+	try:
+		modulus = sys.hash_info.modulus
+	except AttributeError:
+		# Python < 3.2
+		modulus = (sys.maxsize + 1) * 2 - 1
+	return [1 + n * modulus for n in xrange(size)]
+
+
+def _timePerKey(prepare, run, keys, minKeys=100000, repeat=3):
+	"""
+	Return the best per-key time of C{run}, in nanoseconds.  C{run} is
+	called enough times to process at least C{minKeys} keys, each time
+	with a fresh argument from C{prepare}.
+	"""
+	number = max(1, minKeys // max(1, len(keys)))
+	timer = timeit.default_timer
+	best = None
+	for i in xrange(repeat):
+		total = 0.0
+		for j in xrange(number):
+			arg = prepare()
+			start = timer()
+			run(arg, keys)
+			total += timer() - start
+		if best is None or total < best:
+			best = total
+	return best / number / max(1, len(keys)) * 1e9
+
+
+def _benchContainers(workload, keyType, keys, operations):
+	results = []
+	for cls in (dict, securedict):
+		d = cls(zip(keys, keys))
+		for name, prepare, run in OPERATIONS:
+			if name not in operations:
+				continue
+			ns = _timePerKey(lambda: prepare(cls, keys, d), run, keys)
+			results.append({
+				'workload': workload,
+				'key_type': keyType,
+				'size': len(keys),
+				'container': cls.__name__,
+				'operation': name,
+				'ns_per_key': round(ns, 1),
+			})
+	return results
+
+
+def runSuite(keyTypes=KEY_TYPES, sizes=DEFAULT_SIZES,
+collidingSizes=(100, 1000)):
+	"""
+	Time every operation in L{OPERATIONS} on C{dict} and C{securedict}, for
+	every key type in C{keyTypes} and every size in C{sizes}, and time
+	L{COLLIDING_OPERATIONS} on dicts of L{collidingKeys}.  Returns a
+	JSON-serializable C{dict} of the results and the environment they were
+	measured in.
+	"""
+	results = []
+	for keyType in keyTypes:
+		seen = set()
+		for size in sizes:
+			keys = _keyMakers[keyType](size)
+			if len(keys) in seen:
+				# bool and NoneType don't get any bigger
+				continue
+			seen.add(len(keys))
+			results.extend(_benchContainers(
+				'uniform', keyType, keys, [op[0] for op in OPERATIONS]))
+	for size in collidingSizes:
+		results.extend(_benchContainers(
+			'colliding', 'int', collidingKeys(size), COLLIDING_OPERATIONS))
+	return {
+		'securetypes_version': securetypes.__version__,
+		'python_version': platform.python_version(),
+		'python_implementation': platform.python_implementation(),
+		'speedups': securetypes._speedups is not None,
+		'hash_backend': repr(securetypes.default_hash_backend()),
+		'time': time.time(),
+		'results': results,
+	}
+
+
+def _commaList(option, opt, value, parser, convert):
+	setattr(parser.values, option.dest, [convert(v) for v in value.split(',')])
+
+
+def main(args=None):
+	parser = optparse.OptionParser(usage="%prog [options]")
+	parser.add_option('--json', action='store_true',
+		help="compare securedict to dict and write the results as JSON "
+		"instead of printing the micro-benchmarks")
+	parser.add_option('--sizes', type='string', action='callback',
+		callback=_commaList, callback_args=(int,), default=DEFAULT_SIZES,
+		help="comma-separated dict sizes (default: %s)" % (
+			','.join(map(str, DEFAULT_SIZES)),))
+	parser.add_option('--colliding-sizes', type='string', action='callback',
+		callback=_commaList, callback_args=(int,), default=[100, 1000],
+		dest='collidingSizes',
+		help="comma-separated sizes for the colliding-keys workload "
+		"(default: 100,1000)")
+	parser.add_option('--key-types', type='string', action='callback',
+		callback=_commaList, callback_args=(str,), default=KEY_TYPES,
+		dest='keyTypes', help="comma-separated key types (default: %s)" % (
+			','.join(KEY_TYPES),))
+	parser.add_option('--output', '-o', help="write JSON to this file "
+		"instead of stdout")
+	options, args = parser.parse_args(args)
+	if args:
+		parser.error("unexpected arguments: %r" % (args,))
+	for keyType in options.keyTypes:
+		if keyType not in _keyMakers:
+			parser.error("unknown key type %r" % (keyType,))
+
+	if options.json:
+		report = runSuite(options.keyTypes, options.sizes,
+			options.collidingSizes)
+		if options.output:
+			f = open(options.output, 'w')
+			try:
+				json.dump(report, f, indent=1, sort_keys=True)
+			finally:
+				f.close()
+		else:
+			json.dump(report, sys.stdout, indent=1, sort_keys=True)
+			sys.stdout.write('\n')
+	else:
+		printMicroBenchmarks()
+
+
+def printMicroBenchmarks():
+	print("Lookup cost by Sha1Backend layout")
+	print("%-6s %-8s %-10s %s" % ("keys", "layout", "ns/digest", "ns/lookup"))
+	for keyType, layout, digestNs, lookupNs in benchLookupLayouts():
+		print("%-6s %-8d %-10.0f %.0f" % (keyType, layout, digestNs, lookupNs))
+
+	print()
+	print("Cost by implementation (default backend, str keys)")
+	print("%-8s %-10s %s" % ("impl", "operation", "ns/op"))
+	for implementation, operation, ns in benchSpeedups():
+		print("%-8s %-10s %.0f" % (implementation, operation, ns))
+
+	print()
+	print("Single-key operations (default backend)")
+	print("%-20s %-8s %s" % ("operation", "hashes", "ns/op"))
+	for operation, hashes, ns in benchSingleKey():
+		print("%-20s %-8d %.0f" % (operation, hashes, ns))
+
+	print()
+	print("Lookup cost with a digest cache (default backend, str keys)")
+	print("%-8s %-10s %s" % ("impl", "cache", "ns/lookup"))
+	for implementation, cache, ns in benchDigestCache():
+		print("%-8s %-10s %.0f" % (implementation, cache, ns))
+
+	print()
+	print("Lookup cost of composite keys (default backend)")
+	print("%-8s %-10s %s" % ("impl", "key", "ns/lookup"))
+	for implementation, key, ns in benchCompositeKeys():
+		print("%-8s %-10s %.0f" % (implementation, key, ns))
+
+	print()
+	print("Sets of 10000 str keys")
+	print("%-12s %-8s %s" % ("type", "op", "ns/key"))
+	for setType, operation, ns in benchSets():
+		print("%-12s %-8s %.0f" % (setType, operation, ns))
+
+	print()
+	print("One step of a 1000-key LRU cache")
+	print("%-12s %s" % ("type", "ns/step"))
+	for name, ns in benchLRU():
+		print("%-12s %.0f" % (name, ns))
+
+	print()
+	print("100000 operations on a shared 10000-key mapping, split between threads")
+	print("%-12s %-8s %s" % ("type", "threads", "ns/op"))
+	for name, threadCount, ns in benchConcurrent():
+		print("%-12s %-8d %.0f" % (name, threadCount, ns))
+
+	print()
+	print("The same, with a get_or_insert factory that sleeps for 100us")
+	print("%-12s %-8s %s" % ("type", "threads", "ns/op"))
+	for name, threadCount, ns in benchConcurrent(
+	operations=20000, factoryDelay=0.0001):
+		print("%-12s %-8d %.0f" % (name, threadCount, ns))
+
+	print()
+	lookups, buildNs = benchFrozen()
+	print("Lookups in 100000 str keys (building the frozen buffer: %.0f ns/key)" % (
+		buildNs,))
+	print("%-12s %s" % ("type", "ns/lookup"))
+	for name, ns in lookups:
+		print("%-12s %.0f" % (name, ns))
+
+	print()
+	print("Inserting 10000 str keys")
+	print("%-8s %-10s %s" % ("impl", "method", "ns/key"))
+	for implementation, method, ns in benchBulkUpdate():
+		print("%-8s %-10s %.0f" % (implementation, method, ns))
+
+	print()
+	print("Building a securedict from 10000 str keys")
+	print("%-8s %-10s %s" % ("impl", "method", "ns/key"))
+	for implementation, method, ns in benchFromkeys():
+		print("%-8s %-10s %.0f" % (implementation, method, ns))
+
+	print()
+	print("Copying a securedict with 10**6 str keys")
+	print("%-8s %-10s %s" % ("impl", "method", "seconds"))
+	for implementation, method, seconds in benchCopy():
+		print("%-8s %-10s %.3f" % (implementation, method, seconds))
+
+	print()
+	print("Serializing a securedict with 10**6 str keys")
+	print("%-8s %-10s %-10s %s" % ("format", "write (s)", "read (s)", "bytes"))
+	for name, write, read, size in benchSerialization():
+		print("%-8s %-10.3f %-10.3f %d" % (name, write, read, size))
+
+	print()
+	print("Comparing two equal 100000-key dicts with ==")
+	print("%-12s %s" % ("other side", "ns/key"))
+	for other, ns in benchEquality():
+		print("%-12s %.0f" % (other, ns))
+
+	print()
+	print("Decoding a JSON array of 10000 4-key objects")
+	print("%-12s %s" % ("decoder", "ns/object"))
+	for decoder, ns in benchJSON():
+		print("%-12s %.0f" % (decoder, ns))
+
+	print()
+	print("Key wrapper size")
+	for wrapper, size in wrapperSizes():
+		print("%-8s %d bytes" % (wrapper, size))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,213 @@
+"""
+A JSON decoder that creates securedicts for JSON objects, and enforces
+limits on the shape of its input.
+
+	from securejson import loads
+
+	loads('{"b": ["bee", {}]}', max_depth=32)
+	# returns securedict({u'b': [u'bee', securedict({})]})
+
+The stdlib/simplejson scanner does the parsing; each JSON object's key/value
+pairs go straight into a batched securedict ingest (every key hashed in one
+pass and inserted with one dict.update), instead of through securedict's
+general-purpose __init__ and update.
+"""
+
+import re
+import sys
+import codecs
+from operator import itemgetter
+
+_PY3 = sys.version_info[0] >= 3
+
+if _PY3:
+	imap = map
+	xrange = range
+else:
+	from itertools import imap
+
+try:
+	import simplejson as json
+except ImportError:
+	import json
+
+from securetypes import securedict
+
+# The default limit on how deeply arrays and objects may be nested.
+DEFAULT_MAX_DEPTH = 512
+
+# A string, or a run of opening or closing brackets
+_NESTING_TOKEN = re.compile(
+	r'"[^"\\]*(?:\\.[^"\\]*)*"|[\[{]+|[\]}]+', re.DOTALL)
+_WHITESPACE = re.compile(r'\s*')
+_first = itemgetter(0)
+_newSecureDict = securedict.__new__
+_dictUpdate = dict.update
+
+
+class LimitExceeded(ValueError):
+	"""
+	The JSON document exceeds one of the decoder's limits.
+	"""
+
+
+
+def _checkDepth(s, maxDepth, pos=0):
+	"""
+	Raise L{LimitExceeded} if the JSON document that starts at C{pos} in
+	C{s} nests arrays and objects more than C{maxDepth} deep.
+
+	This is one pass over the document's strings and runs of brackets,
+	which stops where the document's outermost brackets close, so it takes
+	linear time and doesn't look at any documents that follow.  Malformed
+	bracketing is left for the JSON scanner to report.
+	"""
+	pos = _WHITESPACE.match(s, pos).end()
+	if s[pos:pos + 1] not in ('[', '{'):
+		return
+	depth = 0
+	for match in _NESTING_TOKEN.finditer(s, pos):
+		token = match.group()
+		first = token[0]
+		if first in '[{':
+			depth += len(token)
+			if depth > maxDepth:
+				raise LimitExceeded(
+					"JSON nested more than %d deep" % (maxDepth,))
+		elif first != '"':
+			depth -= len(token)
+			if depth <= 0:
+				return
+
+
+
+class SecureJSONDecoder(json.JSONDecoder):
+	"""
+	A C{JSONDecoder} that decodes JSON objects to C{securedict}s (or to
+	instances of C{object_class}, a securedict subclass).
+
+	C{max_depth} limits how deeply arrays and objects may be nested,
+	C{max_object_keys} limits the number of keys in each object, and
+	C{max_key_length} limits the length of each key.  C{None} means no
+	limit.  Exceeding a limit raises L{LimitExceeded}.
+
+	Other keyword arguments are passed to C{JSONDecoder}.
+	"""
+	def __init__(self, max_depth=DEFAULT_MAX_DEPTH, max_object_keys=None,
+	max_key_length=None, object_class=securedict, **kwargs):
+		self.max_depth = max_depth
+		self.max_object_keys = max_object_keys
+		self.max_key_length = max_key_length
+		self.object_class = object_class
+		# If object_class doesn't customize construction or insertion, skip
+		# securedict's general-purpose __init__/update and insert the wrapped
+		# pairs directly.
+		self._bulk = (
+			object_class.__new__ == securedict.__new__ and
+			object_class.__init__ == securedict.__init__ and
+			object_class.__setitem__ == securedict.__setitem__)
+		json.JSONDecoder.__init__(
+			self, object_pairs_hook=self._makeObject, **kwargs)
+
+
+	def _makeObject(self, pairs):
+		if self.max_object_keys is not None and \
+		len(pairs) > self.max_object_keys:
+			raise LimitExceeded("JSON object has %d keys; the limit is %d" % (
+				len(pairs), self.max_object_keys))
+		if self.max_key_length is not None and pairs:
+			longest = max(imap(len, imap(_first, pairs)))
+			if longest > self.max_key_length:
+				raise LimitExceeded("JSON object has a key of length %d; "
+					"the limit is %d" % (longest, self.max_key_length))
+		if self._bulk:
+			obj = _newSecureDict(self.object_class)
+			_dictUpdate(obj, obj._backend.wrap_items(pairs))
+		else:
+			obj = self.object_class(pairs)
+		return obj
+
+
+	def raw_decode(self, s, *args, **kwargs):
+		# JSONDecoder.decode calls this too, so the depth is checked once,
+		# before the recursive scanner sees the document.
+		if self.max_depth is not None:
+			start = args[0] if args else kwargs.get('idx', 0)
+			_checkDepth(s, self.max_depth, start)
+		return json.JSONDecoder.raw_decode(self, s, *args, **kwargs)
+
+
+
+def loads(s, **kwargs):
+	"""
+	Decode JSON document C{s}.  Keyword arguments are passed to
+	L{SecureJSONDecoder}.
+	"""
+	return SecureJSONDecoder(**kwargs).decode(s)
+
+
+def load(fp, **kwargs):
+	"""
+	Decode the JSON document in file-like object C{fp}.  Keyword arguments
+	are passed to L{SecureJSONDecoder}.
+	"""
+	return loads(fp.read(), **kwargs)
+
+
+def iterload(fp, chunk_size=65536, **kwargs):
+	"""
+	Incrementally decode a stream of JSON documents (for example,
+	newline-delimited JSON) from file-like object C{fp}, yielding each
+	document as soon as it has been read.  Documents may be separated by
+	any amount of whitespace.
+
+	C{fp} is read C{chunk_size} bytes (or characters, if it is a text stream)
+	at a time; bytes are decoded as UTF-8.  A document that doesn't fit in
+	what has been read so far is retried after reading twice as much, so a
+	large document is decoded in linear time.  Keyword arguments are passed
+	to L{SecureJSONDecoder}.
+	"""
+	decoder = SecureJSONDecoder(**kwargs)
+	utf8 = codecs.getincrementaldecoder('utf-8')()
+	def read(size):
+		"""
+		Return the next text from C{fp}, and whether it was at its end.
+		"""
+		data = fp.read(size)
+		if _PY3 and isinstance(data, bytes):
+			return utf8.decode(data, not data), not data
+		return data, not data
+
+	buf = ''
+	pos = 0
+	eof = False
+	while True:
+		pos = _WHITESPACE.match(buf, pos).end()
+		if pos == len(buf):
+			if eof:
+				return
+			buf, eof = read(chunk_size)
+			pos = 0
+			continue
+		try:
+			obj, end = decoder.raw_decode(buf, pos)
+		except LimitExceeded:
+			raise
+		except ValueError:
+			if eof:
+				raise
+			end = None
+		# A document that ends exactly at the end of what we've read may be
+		# a number that continues in the next chunk.
+		if end is None or (end == len(buf) and not eof):
+			data, eof = read(max(len(buf) - pos, chunk_size))
+			buf = buf[pos:] + data
+			pos = 0
+			continue
+		pos = end
+		yield obj
+
+
+__all__ = [
+	'LimitExceeded', 'SecureJSONDecoder', 'loads', 'load',
+	'iterload', 'DEFAULT_MAX_DEPTH']
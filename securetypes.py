@@ -1,7 +1,42 @@
 __version__ = '11.12.28'
 
-from types import NoneType
+import re
+import sys
+import marshal
 from os import urandom
+from sys import maxsize
+from mmap import mmap, ACCESS_READ
+from struct import Struct, error as StructError
+from time import time
+from weakref import ref, WeakKeyDictionary
+from threading import Lock, Event
+from operator import itemgetter, attrgetter
+from functools import partial
+from itertools import islice, tee, count, repeat
+
+_PY3 = sys.version_info[0] >= 3
+
+if _PY3:
+	from copyreg import __newobj__
+	imap, izip, ifilter = map, zip, filter
+	unicode = str
+	long = int
+	xrange = range
+else:
+	from copy_reg import __newobj__
+	from itertools import imap, izip, ifilter
+	from operator import isNumberType
+
+NoneType = type(None)
+
+try:
+	from collections.abc import KeysView, ItemsView, ValuesView
+except ImportError:
+	try:
+		from collections import KeysView, ItemsView, ValuesView
+	except ImportError:
+		# Python < 2.6 doesn't have the collections ABCs
+		KeysView = ItemsView = ValuesView = None
 
 try:
 	from hashlib import sha1
@@ -9,47 +44,263 @@ except ImportError:
 	# Python < 2.5 doesn't have hashlib
 	from sha import sha as sha1
 
+try:
+	from hashlib import blake2b
+except ImportError:
+	# Python < 3.6 doesn't have blake2b in hashlib
+	try:
+		from pyblake2 import blake2b
+	except ImportError:
+		blake2b = None
 
-def _securehash_hasher(obj):
-	t = type(obj)
-	if t == str:
-		h = sha1('\x01') # str or an ascii'able unicode
-		h.update(obj)
-	elif t in (int, long):
-		h = sha1('\x00') # "number"
-		h.update(str(obj))
-	elif t == unicode:
+try:
+	from time import perf_counter as _clock
+except ImportError:
+	# Python < 3.3
+	_clock = time
+
+try:
+	from time import monotonic as _monotonic
+except ImportError:
+	# Python < 3.3
+	_monotonic = time
+
+try:
+	import _securetypes_speedups as _speedups
+except ImportError:
+	# The optional C accelerator isn't compiled; everything works without
+	# it, just more slowly.
+	_speedups = None
+
+
+# Numbers that are == to an integer (ints, longs, bools, and floats like
+# 1.0) are encoded as that integer, in 8 little-endian bytes if it fits in
+# an int64, or in hex otherwise (which, unlike decimal, takes linear time
+# to format).  Other floats (including inf) are encoded as their 8
+# little-endian IEEE 754 bytes, and every nan as the same bytes.
+_packInt64 = Struct('<q').pack
+_packDouble = Struct('<d').pack
+_NAN = b'\x00\x00\x00\x00\x00\x00\xf8\x7f'
+
+
+def _encodeBytes(obj):
+	return b'\x01', obj # ascii text or bytes
+
+
+def _encodeInteger(obj):
+	try:
+		return b'\x00', _packInt64(obj) # integral number
+	except StructError:
+		return b'\x06', b'%#x' % (obj,) # integral number outside int64
+
+
+def _encodeFloat(obj):
+	if obj.is_integer():
+		return _encodeInteger(int(obj))
+	elif obj == obj:
+		return b'\x07', _packDouble(obj) # non-integral number
+	else:
+		return b'\x07', _NAN
+
+
+def _encodeNone(obj):
+	return b'\x03', b'' # NoneType
+
+
+# Text keys longer than this many characters are hashed by _hashLongText,
+# _TEXT_CHUNK characters at a time.
+_LONG_TEXT = 1024
+_TEXT_CHUNK = 8192
+_NON_ASCII = re.compile('[^\\x00-\\x7f]')
+
+try:
+	_isAscii = unicode.isascii
+except AttributeError:
+	# Python < 3.7
+	def _isAscii(text):
+		return _NON_ASCII.search(text) is None
+
+	def _encodeText(obj):
+		# Without str.isascii, trying the ascii encoding is quicker than
+		# scanning for non-ascii characters first.
 		try:
-			ascii = obj.encode('ascii')
-			h = sha1('\x01') # str or an ascii'able unicode
-			h.update(ascii)
+			return b'\x01', obj.encode('ascii') # ascii text or bytes
 		except UnicodeEncodeError:
-			h = sha1('\x02') # non-ascii'able unicode
-			h.update(obj.encode('utf-8'))
-	elif t == bool:
-		h = sha1('\x00') # "number"
-		if obj:
-			h.update("1")
-		else:
-			h.update("0")
-	elif t == float:
-		h = sha1('\x00') # "number"
-		rep = repr(obj)
-		if rep in ("-0.0", "nan"):
-			h.update("0")
-		elif rep == "inf":
-			h.update("314159")
-		elif rep == "-inf":
-			h.update("-271828")
-		elif rep.endswith(".0"):
-			h.update(rep[:-2])
-		else:
-			h.update(rep)
-	elif t == NoneType:
-		h = sha1('\x03') # NoneType
+			return b'\x02', obj.encode('utf-8', _SURROGATES) # non-ascii text
+else:
+	def _encodeText(obj):
+		if _isAscii(obj):
+			return b'\x01', obj.encode('ascii') # ascii text or bytes
+		return b'\x02', obj.encode('utf-8', _SURROGATES) # non-ascii text
+
+
+def _textTag(text):
+	return (b'\x02', b'\x01')[_isAscii(text)]
+
+
+def _hashLongText(h, text):
+	"""
+	Update hash object C{h} with the payload of C{text}, without holding all
+	of its encoded bytes at once.  Together with C{_textTag}, which finds
+	out whether C{text} is ascii without raising and catching an exception,
+	this hashes C{text} exactly like C{_encodeText(text)}.
+	"""
+	start = 0
+	end = len(text)
+	while start < end:
+		stop = start + _TEXT_CHUNK
+		# Python 2 encodes a surrogate pair as the one character it stands
+		# for, so don't split a pair.
+		if not _PY3 and u'\ud800' <= text[stop - 1:stop] <= u'\udbff':
+			stop += 1
+		h.update(text[start:stop].encode('utf-8', _SURROGATES))
+		start = stop
+
+
+# Python 3 refuses to encode lone surrogates unless asked to; Python 2
+# encodes them the same way without being asked.
+_SURROGATES = ('strict', 'surrogatepass')[_PY3]
+
+# The encoder for each built-in key type, which returns the C{(tag,
+# payload)} for a key of exactly that type.  Tuples, and objects hashed by
+# their __securehash__ or a registered encoder, are encoded from digests,
+# so they aren't in here.
+_encoders = {
+	unicode: _encodeText,
+	bytes: _encodeBytes,
+	int: _encodeInteger,
+	long: _encodeInteger,
+	bool: _encodeInteger,
+	float: _encodeFloat,
+	NoneType: _encodeNone,
+}
+
+# Encoders registered with register_encoder, by type
+_registeredEncoders = {}
+
+
+def _securehash_encode(obj, backend=None):
+	"""
+	Return a C{(tag, payload)} tuple of C{bytes} that canonically encodes
+	C{obj}.  Keys that are C{==} to each other get the same encoding.  So do
+	equal C{bytes} and ascii text (Python 2's C{str} and C{unicode}), which
+	are C{==} only on Python 2.
+
+	A tuple is encoded as the concatenated digests of its elements, and any
+	other object by the digest of what its registered encoder or its
+	C{__securehash__()} returns.  The digests are C{backend}'s, or unkeyed
+	sha1 digests if C{backend} is C{None}.  Every digest of a backend has
+	the same size, so the encoding is unambiguous, and an element nested N
+	deep is hashed once, not N times.
+	"""
+	encode = _encoders.get(type(obj))
+	if encode is not None:
+		return encode(obj)
+	elif backend is not None:
+		if type(obj) is tuple:
+			return b'\x04', b''.join(map(backend._keyDigest, obj))
+		return backend._encodeObject(obj)
+	elif type(obj) is tuple:
+		return b'\x04', b''.join(map(_securehash, obj))
+	else:
+		return _encodeSecureHash(obj, _securehash)
+
+
+def _encodeSecureHash(obj, digest):
+	"""
+	Encode C{obj}, which isn't one of the built-in key types, by the
+	C{digest} of what its registered encoder or its C{__securehash__()}
+	returns.
+	"""
+	securehash = _registeredEncoders.get(type(obj))
+	if securehash is None:
+		securehash = getattr(obj.__class__, '__securehash__', None)
+		if securehash is None:
+			raise TypeError("Don't know how to securely hash a %r object" % (
+				type(obj),))
+	return b'\x05', digest(securehash(obj))
+
+
+def register_encoder(cls, encoder):
+	"""
+	Make securedicts (and every other secure type) accept keys of exact type
+	C{cls}, hashed by the key that C{encoder(obj)} returns, as if C{cls} had
+	C{encoder} as its C{__securehash__}.  This is for types you can't add a
+	C{__securehash__} to, like C{datetime.date} or C{uuid.UUID}:
+
+		register_encoder(UUID, attrgetter('bytes'))
+
+	C{encoder} must return a supported key, and must return C{==} keys for
+	objects that are C{==}.  A registered encoder takes precedence over
+	C{__securehash__}, and the encoder for a type shouldn't be changed while
+	objects of that type are keys anywhere.  C{register_encoder(cls, None)}
+	unregisters C{cls}'s encoder.
+
+	The built-in key types and C{tuple} can't be given an encoder.
+	"""
+	if cls in _encoders or cls is tuple:
+		raise ValueError("%r is a built-in key type; its encoding can't be "
+			"changed" % (cls,))
+	if encoder is None:
+		_registeredEncoders.pop(cls, None)
 	else:
-		raise TypeError("Don't know how to securely hash a %r object" % (t,))
+		_registeredEncoders[cls] = encoder
+
+
+def _forgetEncoding(encodings, key, r):
+	entry = encodings.get(key)
+	if entry is not None and entry[0] is r:
+		del encodings[key]
+
+
+def _encodeRemembered(obj, encodings, digest):
+	"""
+	Encode C{obj} by its C{__securehash__} and C{digest}, reusing the
+	encoding in C{encodings} from the last time if C{obj} is still alive.
+	Objects that can't be weakly referenced aren't remembered.
+	"""
+	key = id(obj)
+	entry = encodings.get(key)
+	if entry is not None and entry[0]() is obj:
+		return entry[1]
+	encoding = _encodeSecureHash(obj, digest)
+	try:
+		r = ref(obj, lambda r: _forgetEncoding(encodings, key, r))
+	except TypeError:
+		return encoding
+	encodings[key] = (r, encoding)
+	return encoding
+
+
 
+class _WrapperFallback(object):
+	"""
+	The fallback encoder of a C{_speedups.KeyWrapper}, for keys that aren't
+	of a built-in type.  It encodes them with the wrapper's own digests,
+	like L{_HashBackend._encodeObject}, through a weak reference, so that
+	the wrapper (and the backend that holds it) isn't in a reference cycle.
+	The wrapper is alive whenever it calls this.
+	"""
+	__slots__ = ('wrapper', 'encodings')
+
+	def __init__(self, encodings):
+		self.wrapper = None
+		self.encodings = encodings
+
+
+	def __call__(self, obj):
+		return _encodeRemembered(obj, self.encodings, self.wrapper().digest)
+
+
+
+def _securehash_hasher(obj, backend=None):
+	if type(obj) is unicode and len(obj) > _LONG_TEXT:
+		h = sha1(_textTag(obj))
+		_hashLongText(h, obj)
+		return h
+	tag, payload = _securehash_encode(obj, backend)
+	h = sha1(tag)
+	h.update(payload)
 	return h
 
 
@@ -85,7 +336,7 @@ def is_dict_update_broken():
 
 
 # This value should never be sent or displayed to *anyone*
-_securetypes_SECRET = urandom(160/8)
+_securetypes_SECRET = urandom(20)
 
 # If you see "_securedictmarker" show up in your dict, you probably dict()ed a
 # securedict in CPython.  Don't dict() securedicts for security reasons, but
@@ -93,27 +344,610 @@ _securetypes_SECRET = urandom(160/8)
 # http://bugs.python.org/issue10240
 _securedictmarker = "_securedictmarker"
 
+
+class _SecureKey(tuple):
+	"""
+	The key wrapper that a securedict stores for each key, when the
+	C{_securetypes_speedups} extension is unavailable: a C{(word, key)}
+	tuple, where C{word} is the C{hash()} of the key's keyed digest.
+
+	Because this is a plain tuple underneath, hashing and comparing it
+	happens entirely in C: the tuple's hash mixes the secret-derived C{word}
+	into the key's hash, and two wrappers are equal only if their words are
+	equal and their keys are equal.
+	"""
+	__slots__ = ()
+
+	key = property(itemgetter(1))
+
+	def __repr__(self):
+		return '%s(%r)' % (_securedictmarker, self[1])
+
+
+_unwrap = itemgetter(1)
+_unwrapKey = attrgetter('key')
+
+
+class _PrefixStates(dict):
+	"""
+	Maps each type tag to a hasher that has already absorbed the secret and
+	the tag.  Callers must C{.copy()} a state before updating it.
+	"""
+	__slots__ = ('_base',)
+
+	def __init__(self, base):
+		self._base = base
+
+
+	def __missing__(self, tag):
+		h = self._base.copy()
+		h.update(tag)
+		self[tag] = h
+		return h
+
+
+
+class DigestCache(object):
+	"""
+	A bounded cache of keyed digests for short C{str} and C{unicode} keys,
+	for programs that look up the same few keys (field names like C{"id"}
+	and C{"type"}) over and over.  Install it on a hash backend with
+	C{backend.set_digest_cache(cache)}; installing it on
+	C{default_hash_backend()} makes it process-wide.
+
+	Only keys of at most C{max_key_length} characters are admitted, and at
+	most C{max_entries} of them are kept, so an adversary who controls the
+	keys can't use the cache to exhaust memory, and a lookup in it costs at
+	most C{max_entries} comparisons even if every cached key collides.  When
+	the cache is full, a CLOCK sweep evicts a key that hasn't been hit since
+	the sweep last passed it.
+
+	Keys that are C{==} have the same digest, so entries are keyed by the key
+	itself; C{'id'} and C{u'id'} share an entry.  Digests depend on the
+	backend's secret, so a cache can be installed on only one backend at a
+	time.
+
+	C{hits} and C{misses} count lookups of admissible keys.  Under
+	concurrent use they are approximate.
+	"""
+	def __init__(self, max_entries=256, max_key_length=32):
+		if max_entries < 1:
+			raise ValueError("max_entries must be at least 1, "
+				"got %r" % (max_entries,))
+		self.max_entries = max_entries
+		self.max_key_length = max_key_length
+		# key -> [digest, hits since the CLOCK hand last passed]
+		self._entries = {}
+		# The keys in CLOCK order
+		self._ring = []
+		self._hand = 0
+		self._hits = 0
+		self.misses = 0
+		self._lock = Lock()
+		# A weak reference to the backend the cache is installed on
+		self._owner = None
+
+
+	def _admit(self, key, digest):
+		"""
+		Record a miss for C{key}, and cache its C{digest}, evicting another
+		key if the cache is full.
+		"""
+		with self._lock:
+			self.misses += 1
+			entries = self._entries
+			if key in entries:
+				return
+			ring = self._ring
+			if len(ring) < self.max_entries:
+				ring.append(key)
+			else:
+				hand = self._hand
+				while True:
+					entry = entries[ring[hand]]
+					if not entry[1]:
+						break
+					# Give it a second chance
+					self._hits += entry[1]
+					entry[1] = 0
+					hand = (hand + 1) % len(ring)
+				del entries[ring[hand]]
+				ring[hand] = key
+				self._hand = (hand + 1) % len(ring)
+			entries[key] = [digest, 0]
+
+
+	@property
+	def hits(self):
+		return self._hits + sum(entry[1] for entry in self._entries.values())
+
+
+	def clear(self):
+		"""
+		Remove every entry and reset the counters.
+		"""
+		with self._lock:
+			self._entries.clear()
+			del self._ring[:]
+			self._hand = 0
+			self._hits = 0
+			self.misses = 0
+
+
+	def __len__(self):
+		return len(self._entries)
+
+
+	def __repr__(self):
+		return '<%s %d/%d entries, %d hits, %d misses>' % (
+			self.__class__.__name__, len(self), self.max_entries,
+			self.hits, self.misses)
+
+
+
+# Every hash backend, so that enable_stats can instrument them all
+_backends = WeakKeyDictionary()
+
+# The _Stats being collected, or None if instrumentation is disabled
+_stats = None
+
+
+class _HashBackend(object):
+	"""
+	Base class for hash backends.  A subclass must call C{_setPrefixes}
+	(or, if it has no prefix states, define C{_unprefixedDigest} and call
+	C{_installDigest}) from its C{__init__}.
+
+	A backend provides:
+
+	C{digest(key)}: the keyed digest of C{key}.
+
+	C{wrap(key)}: the key wrapper that a securedict stores for C{key}.  The
+	original key is available as C{.key} on the wrapper.
+
+	C{wrap_many(keys)}: a list of the key wrappers for an iterable of keys.
+
+	C{wrap_items(items)}: a list of C{(wrapper, value)} pairs for an iterable
+	of C{(key, value)} pairs.
+
+	C{iter_keys(d)}: an iterator over the keys in securedict C{d}.
+
+	C{iter_items(d)}: an iterator over the C{(key, value)} pairs in
+	securedict C{d}.
+
+	C{unwrap(wrapper)}: the key that C{wrapper} wraps.
+
+	C{set_digest_cache(cache)}: look up short keys' digests in
+	L{DigestCache} C{cache} (or in no cache, if C{None}).
+
+	When the C{_securetypes_speedups} extension is available, all of these
+	except C{set_digest_cache} are implemented in C.  While instrumentation
+	is enabled (see L{enable_stats}), C{digest} and the wrapping methods are
+	replaced by versions that count and time the keys they hash; the
+	backend's own nested hashing (of tuple elements, for example) goes
+	through C{_keyDigest} and isn't counted separately.
+
+	A backend made with the process-wide secret (C{secret=None}) is retired
+	by L{rotate_secret}, which sets its C{_successor} to a backend made by
+	C{_renewed} with the new secret.  A retired backend keeps working.
+
+	A backend remembers the encoding of each live object that it hashed by
+	its C{__securehash__}, so an object used as a key in many securedicts
+	has its C{__securehash__} called only once.
+
+	If C{max_key_length} isn't C{None}, hashing a C{bytes} or text key (on
+	its own or in a tuple) longer than that raises C{ValueError} before any
+	of it is hashed, so that huge untrusted keys can't be used to burn CPU.
+	"""
+	_prefixes = None
+	_speedups = None
+	digest_cache = None
+	max_key_length = None
+	_objectEncodings = None
+	_processSecret = False
+	_successor = None
+	_plainDigest = False
+	unwrap = staticmethod(_unwrap)
+
+	def _setPrefixes(self, prefixes):
+		self._prefixes = prefixes
+		# Keep wrapping keys the same way even if _speedups is swapped out
+		# later, because Python and C key wrappers are never equal.
+		self._speedups = _speedups
+		self._installDigest()
+
+
+	def _installDigest(self):
+		"""
+		Install the C{digest} and wrapping methods for the current prefix
+		states and digest cache, in C if possible, and instrument them if
+		instrumentation is enabled.
+		"""
+		_backends[self] = None
+		# Drop the methods installed last time, and the instrumented ones
+		for name in ('digest', '_keyDigest', 'wrap', 'wrap_many', 'wrap_items'):
+			self.__dict__.pop(name, None)
+		if self._prefixes is not None and self._speedups is not None:
+			if self._objectEncodings is None:
+				self._objectEncodings = {}
+			fallback = _WrapperFallback(self._objectEncodings)
+			wrapper = self._speedups.KeyWrapper(
+				self._prefixes, fallback, self.digest_cache,
+				self.max_key_length)
+			fallback.wrapper = ref(wrapper)
+			self.wrap = wrapper
+			self.digest = self._keyDigest = wrapper.digest
+			self.wrap_many = wrapper.wrap_many
+			self.wrap_items = wrapper.wrap_items
+			self.iter_keys = self._speedups.iter_keys
+			self.iter_items = self._speedups.iter_items
+			self.unwrap = _unwrapKey
+		else:
+			# Whether _keyDigest can skip the length limit and the cache
+			self._plainDigest = self.max_key_length is None and \
+				self.digest_cache is None and self._prefixes is not None
+		if _stats is not None:
+			_stats._instrumentBackend(self)
+
+
+	def _setMaxKeyLength(self, maxKeyLength):
+		if maxKeyLength is not None and maxKeyLength < 0:
+			raise ValueError("max_key_length must be None or at least 0, "
+				"got %r" % (maxKeyLength,))
+		self.max_key_length = maxKeyLength
+
+
+	def set_digest_cache(self, cache):
+		if cache is not None and cache is not self.digest_cache:
+			owner = cache._owner and cache._owner()
+			if owner is not None:
+				raise ValueError("this DigestCache is already installed on "
+					"another hash backend")
+			cache._owner = ref(self)
+		if self.digest_cache is not None and self.digest_cache is not cache:
+			self.digest_cache._owner = None
+		self.digest_cache = cache
+		self._installDigest()
+
+
+	def _encodeObject(self, obj):
+		"""
+		Encode C{obj} by its C{__securehash__}, reusing the encoding from
+		the last time if C{obj} is still alive.  Like its C{hash()}, an
+		object's C{__securehash__()} must not change while it is a key.
+		Objects that can't be weakly referenced aren't remembered.
+		"""
+		encodings = self._objectEncodings
+		if encodings is None:
+			encodings = self._objectEncodings = {}
+		return _encodeRemembered(obj, encodings, self._keyDigest)
+
+
+	def _keyDigest(self, obj):
+		# This is one method for every backend, instead of one picked for
+		# the backend's settings and stored on it, because a bound method
+		# stored on the backend would make it refer to itself.  The common
+		# case is inlined from _uncachedDigest.
+		if not self._plainDigest or \
+		type(obj) is unicode and len(obj) > _LONG_TEXT:
+			return self._fullDigest(obj)
+		tag, payload = _securehash_encode(obj, self)
+		h = self._prefixes[tag].copy()
+		h.update(payload)
+		return h.digest()
+
+	digest = _keyDigest
+
+
+	def _fullDigest(self, obj):
+		maxKeyLength = self.max_key_length
+		if maxKeyLength is not None and type(obj) in (bytes, unicode) and \
+		len(obj) > maxKeyLength:
+			raise ValueError("key of length %d is longer than the hash "
+				"backend's max_key_length of %d" % (len(obj), maxKeyLength))
+		if self.digest_cache is not None:
+			return self._cachedDigest(obj)
+		return self._uncachedDigest(obj)
+
+
+	def _uncachedDigest(self, obj):
+		prefixes = self._prefixes
+		if prefixes is None:
+			return self._unprefixedDigest(obj)
+		if type(obj) is unicode and len(obj) > _LONG_TEXT:
+			h = prefixes[_textTag(obj)].copy()
+			_hashLongText(h, obj)
+			return h.digest()
+		tag, payload = _securehash_encode(obj, self)
+		h = prefixes[tag].copy()
+		h.update(payload)
+		return h.digest()
+
+
+	def _cachedDigest(self, obj):
+		cache = self.digest_cache
+		if type(obj) in (bytes, unicode) and len(obj) <= cache.max_key_length:
+			entry = cache._entries.get(obj)
+			if entry is not None:
+				entry[1] += 1
+				return entry[0]
+			digest = self._uncachedDigest(obj)
+			cache._admit(obj, digest)
+			return digest
+		return self._uncachedDigest(obj)
+
+
+	def wrap(self, key):
+		return _SecureKey((hash(self._keyDigest(key)), key))
+
+
+	def wrap_many(self, keys):
+		digest = self._keyDigest
+		return [_SecureKey((hash(digest(k)), k)) for k in keys]
+
+
+	def wrap_items(self, items):
+		digest = self._keyDigest
+		return [(_SecureKey((hash(digest(k)), k)), v) for k, v in items]
+
+
+	def __reduce__(self):
+		raise TypeError("hash backends can't be pickled, because they hold "
+			"the secret")
+
+
+	def iter_keys(self, d):
+		return imap(_unwrap, dict.__iter__(d))
+
+
+	def iter_items(self, d):
+		# A dict's keys and values come out in the same order
+		return izip(imap(_unwrap, dict.__iter__(d)), _dictitervalues(d))
+
+
+
+class Sha1Backend(_HashBackend):
+	"""
+	A hash backend based on sha1.  It is slower than L{Blake2bBackend} but
+	available everywhere.
+
+	C{layout} selects how the secret is mixed in:
+
+	1.	sha1(tag + key + secret), the digest used by securetypes before
+		hash backends were pluggable.  The secret is hashed again for every
+		key.
+
+	2.	sha1(secret + tag + key), the default.  The secret and each type tag
+		are absorbed into a prefix state once, and each digest continues from
+		a copy of that state.
+
+	C{max_key_length} limits the length of C{bytes} and text keys; see
+	L{_HashBackend}.
+	"""
+	name = 'sha1'
+	digest_size = 20
+
+	def __init__(self, secret=None, layout=2, max_key_length=None):
+		self._processSecret = secret is None
+		if secret is None:
+			secret = _securetypes_SECRET
+		self._setMaxKeyLength(max_key_length)
+		self._secret = secret
+		self.layout = layout
+		if layout == 1:
+			self._installDigest()
+		elif layout == 2:
+			self._setPrefixes(_PrefixStates(sha1(secret)))
+		else:
+			raise ValueError("unknown sha1 layout %r" % (layout,))
+
+
+	def _unprefixedDigest(self, obj):
+		# Layout 1
+		h = _securehash_hasher(obj, self)
+		h.update(self._secret)
+		return h.digest()
+
+
+	def _renewed(self):
+		return type(self)(None, self.layout, self.max_key_length)
+
+
+	def __repr__(self):
+		return '<%s layout=%d>' % (self.__class__.__name__, self.layout)
+
+
+
+class Blake2bBackend(_HashBackend):
+	"""
+	A hash backend that computes a keyed BLAKE2b of tag + key, with
+	C{secret} as the BLAKE2b key.  BLAKE2b's keyed mode is a PRF, and it is
+	much faster than sha1 for the short keys typically stored in a dict.
+
+	C{digest_size} may be anything from 8 to 64 bytes; smaller digests are
+	faster to compute and compare, larger digests have a wider collision
+	margin.  C{max_key_length} limits the length of C{bytes} and text keys;
+	see L{_HashBackend}.
+	"""
+	name = 'blake2b'
+	# Absorbing the key block up front doesn't change BLAKE2b's output, so
+	# there has only been one layout.
+	layout = 1
+
+	def __init__(self, secret=None, digest_size=16, max_key_length=None):
+		if blake2b is None:
+			raise RuntimeError("blake2b is not available; "
+				"install pyblake2 or use Python 3.6+")
+		if not 8 <= digest_size <= 64:
+			raise ValueError("digest_size must be between 8 and 64, "
+				"got %r" % (digest_size,))
+		self._processSecret = secret is None
+		if secret is None:
+			secret = _securetypes_SECRET
+		self._setMaxKeyLength(max_key_length)
+		self._setPrefixes(_PrefixStates(
+			blake2b(key=secret, digest_size=digest_size)))
+		self.digest_size = digest_size
+
+
+	def _renewed(self):
+		return type(self)(None, self.digest_size, self.max_key_length)
+
+
+	def __repr__(self):
+		return '<%s digest_size=%d>' % (
+			self.__class__.__name__, self.digest_size)
+
+
+
+def _makeDefaultBackend():
+	if blake2b is not None:
+		return Blake2bBackend()
+	return Sha1Backend()
+
+
+# The backend used by every securedict whose class doesn't set hash_backend
+_defaultBackend = _makeDefaultBackend()
+
+
+def default_hash_backend():
+	"""
+	Return the hash backend used by securedicts that don't select their own.
+	This is a L{Blake2bBackend} if blake2b is available, else a
+	L{Sha1Backend}.
+	"""
+	return _defaultBackend
+
+
+def _newestBackend(backend):
+	"""
+	Return the newest successor of C{backend} if L{rotate_secret} has
+	retired it, or else C{backend}.
+	"""
+	while getattr(backend, '_successor', None) is not None:
+		backend = backend._successor
+	return backend
+
+
 _NO_ARG = object()
 
+# The header of the format written by securedict.dump: the magic, and the
+# length of the marshal data after it, so that a truncated dump is noticed
+# even where marshal would read past its end
+_DUMP_MAGIC = b'SDD\x01'
+_DUMP_HEADER = Struct('<4sQ')
+
+_dictiteritems = getattr(dict, 'iteritems', dict.items)
+_dictitervalues = getattr(dict, 'itervalues', dict.values)
+
+def _dictItems(d):
+	"""
+	Return an iterator over the C{(key, value)} pairs in dict C{d}, which
+	may be a securedict.  Overridden methods are ignored, like CPython's
+	C{dict} comparisons ignore them.
+	"""
+	if isinstance(d, securedict):
+		return d._backend.iter_items(d)
+	return _dictiteritems(d)
+
+
+def _dictGetter(d):
+	"""
+	Return a C{get(key, default)} function for dict C{d}, which may be a
+	securedict.  It doesn't call C{__missing__}.
+	"""
+	if isinstance(d, securedict):
+		if d._rehash is not None:
+			return lambda key, default: dict.get(
+				d, d._heldWrapper(key), default)
+		wrap = d._backend.wrap
+		return lambda key, default: dict.get(d, wrap(key), default)
+	return partial(dict.get, d)
+
+
+def _defaultCompare(v, w):
+	"""
+	Compare objects C{v} and C{w} of different types like CPython 2's
+	C{object.c:default_3way_compare}: C{None} is smallest, then numbers,
+	then everything else ordered by type name.  (Returning C{NotImplemented}
+	from C{__cmp__} would make CPython compare addresses instead.)
+	"""
+	if w is None:
+		return 1
+	if v is None:
+		return -1
+	vname = ('', type(v).__name__)[not isNumberType(v)]
+	wname = ('', type(w).__name__)[not isNumberType(w)]
+	return cmp(vname, wname) or cmp(id(type(v)), id(type(w)))
+
+
+def _characterize(a, b):
+	"""
+	Return C{(key, value)} for the smallest key in dict C{a} that is missing
+	from dict C{b} or has a different value in C{b}, or C{(None, None)} if
+	there is no such key.  This is CPython 2's C{dictobject.c:characterize}.
+	"""
+	get = _dictGetter(b)
+	diff = diffV = None
+	found = False
+	for k, v in _dictItems(a):
+		if found and not k < diff:
+			continue
+		otherV = get(k, _NO_ARG)
+		if otherV is _NO_ARG or not (otherV is v or otherV == v):
+			diff, diffV, found = k, v, True
+	return diff, diffV
+
+
+
+class _Rehash(object):
+	"""
+	The state of a securedict that is moving its keys to wrappers made by
+	the successor of its retired hash backend, after L{rotate_secret}.
+	"""
+	__slots__ = ('retired', 'pending')
+
+	def __init__(self):
+		# The retired backends that may have made wrappers in the securedict,
+		# newest first
+		self.retired = []
+		# The wrappers that were in the securedict when rehashing started,
+		# and haven't been visited yet.  Some may have been deleted since.
+		self.pending = []
+
+
+
 class securedict(dict):
 	"""
 	A `dict` that is safe against algorithmic complexity attacks.  Internally,
-	for each key, it stores a key wrapper like this:
+	for each key, it stores a key wrapper that holds the key and a word taken
+	from `H(key, secret)`; the `hash()` of the wrapper is derived from that
+	word.
+
+	`H` is a keyed hash (by default keyed BLAKE2b, or sha1 where BLAKE2b is
+	unavailable) that protects against collisions, and `secret` makes the
+	`hash()` of the wrapper unknowable to adversaries.
 
-		("_securedictmarker", sha1(key + secret), key)
+	To use a different hash backend for all instances of a subclass, set
+	`hash_backend` on the subclass:
 
-	`sha1` protects against collisions, and `secret` makes the `hash()` of the
-	wrapper unknowable to adversaries.
+		class mydict(securedict):
+			hash_backend = Blake2bBackend(digest_size=8)
+
+	To use a different hash backend for one instance, call
+	`.set_hash_backend(backend)` on it.
 
 	The fine print:
 
-	*	A `securedict` supports only these types for keys: `str`, `unicode`,
-		`int`, `long`, `float`, `bool`, and `NoneType`.  Future versions will
-		support `tuple` and any object with a `__securehash__`.
+	*	A `securedict` supports only these types for keys: `str`, `unicode`
+		(`bytes` and `str` on Python 3), `int`, `long`, `float`, `bool`,
+		`NoneType`, `tuple`s of supported keys, and any object with a
+		`__securehash__` method.  `__securehash__()` must return a supported
+		key, and two objects that are `==` must return `==` keys.
 
 	*	A `securedict` is even less thread-safe than a `dict`.  Don't use the same
 		`securedict` object in multiple threads.  Doing this may result in strange
-		exceptions.
+		exceptions.  Use L{concurrentsecuredict} instead.
 
 	*	A `securedict` is `==` to a normal `dict` (if the contents are the same).
 
@@ -129,13 +963,20 @@ class securedict(dict):
 	*	`.popitem()` may pop a different item than an equal dict would; see the
 		unit tests.
 
-	*	A `securedict`'s `<` and `>` compares the `securedict`'s id instead of using
-		Python's complicated algorithm.  This may change in the future to work
-		like Python's algorithm (see CPython `dictobject.c:dict_compare`).  Don't
-		rely on the current "compares id" behavior.
+	*	On Python 2, a `securedict` orders like a `dict` (see CPython
+		`dictobject.c:dict_compare`), with `<`, `>`, and `cmp`.  On Python 3,
+		it can't be ordered, like a `dict`.
+
+	*	`.keys()` and `.items()` on Python 3, and `.viewkeys()` and
+		`.viewitems()` on Python 2.7, return lazy views like a `dict`'s.  Set
+		operations on a keys view return another keys view (of a new
+		`securedict`); set operations on an items view return a `set`, so
+		don't do them on views of untrusted keys.
 
-	*	In Python 2.7+, calling `.viewitems()` or `.viewkeys()` raises
-		`NotImplementedError`, while `.viewvalues()` works as usual.
+	*	After `rotate_secret()`, a `securedict` moves its keys to wrappers
+		made with the new secret a batch at a time, on writes (see
+		`rotate_secret`).  Moving a key may change where it is in the
+		iteration order of a `securedict` (but not a `secureordereddict`).
 
 	*	`sys.setdefaultencoding` may affect a `securedict` differently than it
 		affects `dict`.  (No one should ever use `setdefaultencoding`, but pygtk
@@ -146,11 +987,20 @@ class securedict(dict):
 	Don't use `nan`s as dictionary keys.  `securedict` can't help you here.
 	All `nan`s have the same `hash()` and are not equal to any object.
 	"""
-	__slots__ = ('_inMyRepr',)
+	__slots__ = ('_inMyRepr', '_backend', '_rehash')
+
+	# A hash backend, or None to use the default hash backend
+	hash_backend = None
 
 	def __new__(cls, *args, **kwargs):
 		obj = dict.__new__(cls)
 		obj._inMyRepr = False
+		backend = cls.hash_backend
+		if backend is None:
+			backend = _defaultBackend
+		obj._backend = backend
+		# A _Rehash while moving keys to a new hash backend's wrappers
+		obj._rehash = None
 		return obj
 
 
@@ -161,33 +1011,281 @@ class securedict(dict):
 			x = args[0]
 			# Update like the documented update algorithm and like pypy,
 			# not like CPython.
-			if hasattr(x, 'keys'):
-				for k in x.keys():
-					self[k] = x[k]
+			if self._sharesWrappersWith(x):
+				# Copy the key wrappers as-is, without rehashing anything
+				self._ingestWrapped(x._wrappedItems())
+			elif hasattr(x, 'keys'):
+				keys = list(x.keys())
+				self._ingest(keys, imap(x.__getitem__, keys))
 			else:
-				for k, v in x:
-					self[k] = v
+				self._ingestItems(x)
 		elif len(args) > 1:
 			raise TypeError("update expected at most 1 arguments, "
 				"got %d" % (len(args),))
 
-		for k, v in kwargs.iteritems():
-			self[k] = v
+		if kwargs:
+			self._ingestItems(kwargs.items())
 
 	__init__ = update
 
 
+	def _sharesWrappersWith(self, other):
+		"""
+		Return C{True} if C{other} is a securedict whose key wrappers can be
+		inserted into C{self} as-is: both hash with the same backend (and
+		therefore the same secret), and neither class overrides the methods
+		that C{update} would otherwise call.  While either one is rehashing,
+		its wrappers may have been made by different backends.
+		"""
+		return (isinstance(other, securedict) and
+			other._backend is self._backend and
+			self._rehash is None and other._rehash is None and
+			type(self).__setitem__ == securedict.__setitem__ and
+			type(other).keys == securedict.keys and
+			type(other).__getitem__ == securedict.__getitem__)
+
+
+	# Hooks for subclasses that keep track of their key wrappers, like
+	# secureordereddict: iterate over the (wrapper, value) pairs, and insert
+	# (wrapper, value) pairs made by the same backend.
+	_wrappedItems = _dictiteritems
+	_ingestWrapped = dict.update
+
+	def _ingest(self, keys, values):
+		"""
+		Insert C{keys} with the corresponding C{values}.  All of the keys are
+		hashed in one pass, and all of the key wrappers are inserted with one
+		C{dict.update}, which is much faster than doing C{self[k] = v} for
+		each key.
+		"""
+		if type(self).__setitem__ != securedict.__setitem__:
+			# A subclass wants to see every key
+			for k, v in izip(keys, values):
+				self[k] = v
+		else:
+			if _rotation.retired and self._mustRehash():
+				keys = list(keys)
+				self._rehashKeys(keys)
+			dict.update(self, izip(self._backend.wrap_many(keys), values))
+
+
+	def _ingestItems(self, items):
+		"""
+		Like L{_ingest}, but for an iterable of C{(key, value)} pairs.
+		"""
+		if type(self).__setitem__ != securedict.__setitem__:
+			for k, v in items:
+				self[k] = v
+		else:
+			if _rotation.retired and self._mustRehash():
+				items = list(items)
+				self._rehashKeys([pair[0] for pair in items])
+			dict.update(self, self._backend.wrap_items(items))
+
+
 	def _getSecureHash(self, key):
-		h = _securehash_hasher(key)
-		h.update(_securetypes_SECRET)
-		return h.digest()
+		return self._backend.digest(key)
+
+
+	def get_hash_backend(self):
+		return self._backend
+
+
+	def set_hash_backend(self, backend):
+		"""
+		Make this securedict hash its keys with C{backend} instead of the
+		backend selected by its class.  Existing keys are rehashed.
+		"""
+		items = list(self.iteritems())
+		dict.clear(self)
+		if self._rehash is not None:
+			self._finishRehash()
+		self._backend = backend
+		self.update(items)
+
+
+	def _retiredWrapper(self, key):
+		"""
+		Return the wrapper made by a retired hash backend that holds C{key}
+		in this securedict, or C{None}.  Until rehashing starts, the only
+		retired backend is this securedict's own.
+		"""
+		rehash = self._rehash
+		if rehash is None:
+			retired = (self._backend,)
+		else:
+			retired = rehash.retired
+		for backend in retired:
+			wrapper = backend.wrap(key)
+			if dict.__contains__(self, wrapper):
+				return wrapper
+		return None
+
+
+	def _heldWrapper(self, key):
+		"""
+		Return the wrapper that holds C{key} in this securedict, or the
+		wrapper that would hold it if it were inserted.
+		"""
+		wrapper = None
+		if self._rehash is not None:
+			wrapper = self._retiredWrapper(key)
+		if wrapper is None:
+			wrapper = self._backend.wrap(key)
+		return wrapper
+
+
+	def _mustRehash(self):
+		"""
+		Return C{True} if this securedict's hash backend has been retired,
+		or it hasn't finished moving its keys, so that its writes must
+		rehash keys.  Methods only ask while L{rotate_secret} has retired
+		backends that are still alive, so other securedicts pay nothing.
+		"""
+		return self._rehash is not None or \
+			getattr(self._backend, '_successor', None) is not None
+
+
+	def _insertionWrapper(self, key):
+		"""
+		Return the wrapper to insert C{key} with while this securedict
+		L{_mustRehash}: the wrapper that already holds C{key}, wherever it
+		is, or else a wrapper made by the newest backend, after rehashing a
+		batch of keys.  Like replacing a value in a dict doesn't change its
+		size, no keys are moved if C{key} is already there.
+		"""
+		wrapper = self._retiredWrapper(key)
+		if wrapper is None:
+			backend = self._backend
+			wrapper = backend.wrap(key)
+			if not dict.__contains__(self, wrapper):
+				self._rehashBatch(_rotation.batch_size)
+				if self._backend is not backend:
+					wrapper = self._backend.wrap(key)
+		return wrapper
+
+
+	def _removalWrapper(self, key):
+		"""
+		Rehash a batch of keys, and return the wrapper that holds C{key}, to
+		delete or move it while this securedict L{_mustRehash}.
+		"""
+		self._rehashBatch(_rotation.batch_size)
+		return self._heldWrapper(key)
+
+
+	def _startRehash(self):
+		"""
+		Switch to the newest successor of this securedict's retired hash
+		backend, and take the wrappers to visit.  A securedict that was
+		already rehashing starts over with all of its wrappers.
+		"""
+		backend = self._backend
+		retired = []
+		while getattr(backend, '_successor', None) is not None:
+			retired.append(backend)
+			backend = backend._successor
+		rehash = self._rehash
+		if rehash is None:
+			rehash = self._rehash = _Rehash()
+			_rotation.dicts_started += 1
+		else:
+			_rotation.keys_pending -= len(rehash.pending)
+		retired.reverse()
+		rehash.retired = retired + rehash.retired
+		self._backend = backend
+		# A plain list copy, about 5ns per key, is the only step that isn't
+		# incremental; nothing is hashed until the batches visit them.
+		rehash.pending = list(dict.__iter__(self))
+		_rotation.keys_pending += len(rehash.pending)
+
+
+	def _finishRehash(self):
+		_rotation.keys_pending -= len(self._rehash.pending)
+		_rotation.dicts_finished += 1
+		self._rehash = None
+
+
+	def _rehashBatch(self, size):
+		"""
+		Start rehashing if this securedict's hash backend has been retired,
+		and move the keys in the next C{size} wrappers to visit to wrappers
+		made by the new backend.
+		"""
+		if getattr(self._backend, '_successor', None) is not None:
+			self._startRehash()
+		rehash = self._rehash
+		if rehash is None:
+			return
+		pending = rehash.pending
+		size = min(size, len(pending))
+		for i in xrange(size):
+			self._moveKey(pending.pop())
+		_rotation.keys_pending -= size
+		if not pending:
+			self._finishRehash()
+
+
+	def _rehashKeys(self, keys):
+		"""
+		Rehash a batch, then move the ones of C{keys} that are still held by
+		retired wrappers, so that inserting them doesn't duplicate them.
+		"""
+		self._rehashBatch(_rotation.batch_size)
+		if self._rehash is not None:
+			for key in keys:
+				wrapper = self._retiredWrapper(key)
+				if wrapper is not None:
+					self._moveKey(wrapper)
+
+
+	def _moveKey(self, wrapper):
+		"""
+		Move the key in C{wrapper} to a wrapper made by the current hash
+		backend, if C{wrapper} is still in this securedict.  A wrapper whose
+		key was deleted since it was taken to visit is skipped.
+		"""
+		if dict.__contains__(self, wrapper):
+			self._rewrap(wrapper, self._backend.wrap(wrapper.key))
+			_rotation.keys_rehashed += 1
+
+
+	def _rewrap(self, old, new):
+		"""
+		Replace key wrapper C{old} with C{new}, keeping its value.  A hook
+		for subclasses that keep track of their key wrappers.
+		"""
+		dict.__setitem__(self, new, dict.pop(self, old))
+
+
+	def rehash(self, max_keys=None):
+		"""
+		If L{rotate_secret} has retired this securedict's hash backend, move
+		up to C{max_keys} of its keys (all of them if C{None}) to wrappers
+		made with the new secret, and return the number still to visit.
+		Writes do this a batch at a time; call this to finish the job on a
+		securedict that is rarely written.
+		"""
+		if self._rehash is None and \
+		getattr(self._backend, '_successor', None) is None:
+			return 0
+		self._rehashBatch(maxsize if max_keys is None else max_keys)
+		if self._rehash is None:
+			return 0
+		return len(self._rehash.pending)
 
 
 	def __getitem__(self, key):
-		if key in self:
-			return dict.__getitem__(self,
-				(_securedictmarker, self._getSecureHash(key), key))
-		else:
+		# dict.get, unlike dict.__getitem__, won't call our subclass's
+		# __missing__ with the key wrapper.
+		value = dict.get(self, self._backend.wrap(key), _NO_ARG)
+		if value is _NO_ARG:
+			# Lookups find keys that retired wrappers still hold, but don't
+			# move them, so that they are safe while iterating.
+			if self._rehash is not None:
+				wrapper = self._retiredWrapper(key)
+				if wrapper is not None:
+					return dict.__getitem__(self, wrapper)
 			# "__missing__ must be a method; it cannot be an instance variable."
 			# See test_missing.
 			missing = getattr(self.__class__, '__missing__', None)
@@ -195,77 +1293,109 @@ class securedict(dict):
 				return missing(self, key)
 			else:
 				raise KeyError(key)
+		return value
 
 
 	def __setitem__(self, key, value):
-		return dict.__setitem__(self,
-			(_securedictmarker, self._getSecureHash(key), key), value)
+		if _rotation.retired and self._mustRehash():
+			return dict.__setitem__(self, self._insertionWrapper(key), value)
+		return dict.__setitem__(self, self._backend.wrap(key), value)
 
 
 	def __delitem__(self, key):
+		if _rotation.retired and self._mustRehash():
+			wrapper = self._removalWrapper(key)
+		else:
+			wrapper = self._backend.wrap(key)
 		try:
-			return dict.__delitem__(self,
-				(_securedictmarker, self._getSecureHash(key), key))
+			return dict.__delitem__(self, wrapper)
 		except KeyError:
 			raise KeyError(key)
 
 
 	def __contains__(self, key):
-		return dict.__contains__(self,
-			(_securedictmarker, self._getSecureHash(key), key))
+		return dict.__contains__(self, self._backend.wrap(key)) or (
+			self._rehash is not None and
+			self._retiredWrapper(key) is not None)
 	has_key = __contains__
 
 
 	def __eq__(self, other):
-		return self.__cmp__(other) == 0
+		if not isinstance(other, dict):
+			return NotImplemented
+		if len(self) != len(other):
+			return False
+		if isinstance(other, securedict) and \
+		other._backend is self._backend and \
+		self._rehash is None and other._rehash is None:
+			# Compare the key wrappers directly, without rehashing anything
+			return dict.__eq__(self, other)
+		get = _dictGetter(other)
+		for k, v in self._backend.iter_items(self):
+			otherV = get(k, _NO_ARG)
+			if otherV is _NO_ARG or not (otherV is v or otherV == v):
+				return False
+		return True
 
 
 	def __ne__(self, other):
-		return self.__cmp__(other) != 0
-
-
-	def __lt__(self, other):
-		return id(self) < id(other)
-
-
-	def __gt__(self, other):
-		return id(self) > id(other)
-
-
-	def __le__(self, other):
-		# Object id comparison is faster, so try that first.
-		if id(self) < id(other):
-			return True
-		return self.__cmp__(other) == 0
-
-
-	def __ge__(self, other):
-		# Object id comparison is faster, so try that first.
-		if id(self) > id(other):
-			return True
-		return self.__cmp__(other) == 0
-
-
-	# Note that we must have a __cmp__ so that dict.__cmp__ is not used
-	# by cmp()
-	def __cmp__(self, other):
-		if not isinstance(other, dict) or len(self) != len(other):
-			return (-1, 1)[id(self) > id(other)]
-		for k in self.__dictiter__():
-			mykey = k[2]
-			if mykey not in other or self[mykey] != other[mykey]:
-				return (-1, 1)[id(self) > id(other)]
-		for k in other:
-			if k not in self:
-				return (-1, 1)[id(self) > id(other)]
-		return 0
+		eq = self.__eq__(other)
+		if eq is NotImplemented:
+			return eq
+		return not eq
+
+
+	# Python 3 dicts can't be ordered
+	if not _PY3:
+		def __lt__(self, other):
+			if not isinstance(other, dict):
+				return NotImplemented
+			return self.__cmp__(other) < 0
+
+
+		def __gt__(self, other):
+			if not isinstance(other, dict):
+				return NotImplemented
+			return self.__cmp__(other) > 0
+
+
+		def __le__(self, other):
+			if not isinstance(other, dict):
+				return NotImplemented
+			return self.__cmp__(other) <= 0
+
+
+		def __ge__(self, other):
+			if not isinstance(other, dict):
+				return NotImplemented
+			return self.__cmp__(other) >= 0
+
+
+		# Note that we must have a __cmp__ so that dict.__cmp__ is not used
+		# by cmp()
+		def __cmp__(self, other):
+			"""
+			Compare like CPython 2's C{dictobject.c:dict_compare}: a shorter
+			dict is smaller; otherwise compare the smallest key whose value
+			differs (or that is missing) in each dict, then the values for
+			those keys.
+			"""
+			if not isinstance(other, dict):
+				return _defaultCompare(self, other)
+			if len(self) != len(other):
+				return cmp(len(self), len(other))
+			if self == other:
+				return 0
+			selfDiff, selfV = _characterize(self, other)
+			otherDiff, otherV = _characterize(other, self)
+			return cmp(selfDiff, otherDiff) or cmp(selfV, otherV)
 
 
 	__dictiter__ = dict.__iter__
 
 	def __iter__(self):
-		for k in self.__dictiter__():
-			yield k[2]
+		return self._backend.iter_keys(self)
+	iterkeys = __iter__
 
 
 	def _repr(self, withSecureDictString):
@@ -282,9 +1412,9 @@ class securedict(dict):
 			for k in self.__dictiter__():
 				buf.append(comma)
 				comma = ', '
-				buf.append(repr(k[2]))
+				buf.append(repr(k.key))
 				buf.append(': ')
-				v = self[k[2]]
+				v = self[k.key]
 				buf.append(repr(v))
 			buf.append(('}', '})')[withSecureDictString])
 			return ''.join(buf)
@@ -302,59 +1432,2470 @@ class securedict(dict):
 
 
 	def get(self, key, default=None):
-		return dict.get(self,
-			(_securedictmarker, self._getSecureHash(key), key), default)
+		value = dict.get(self, self._backend.wrap(key), _NO_ARG)
+		if value is _NO_ARG:
+			if self._rehash is not None:
+				wrapper = self._retiredWrapper(key)
+				if wrapper is not None:
+					return dict.__getitem__(self, wrapper)
+			return default
+		return value
 
 
 	def pop(self, key, d=_NO_ARG):
-		try:
-			v = self[key]
-			del self[key]
-			return v
-		except KeyError:
+		cls = type(self)
+		if cls.__getitem__ != securedict.__getitem__ or \
+		cls.__delitem__ != securedict.__delitem__:
+			# A subclass wants to see the lookup and the deletion
+			try:
+				v = self[key]
+				del self[key]
+				return v
+			except KeyError:
+				if d is _NO_ARG:
+					raise
+				return d
+		if _rotation.retired and self._mustRehash():
+			wrapper = self._removalWrapper(key)
+		else:
+			wrapper = self._backend.wrap(key)
+		v = dict.pop(self, wrapper, _NO_ARG)
+		if v is _NO_ARG:
 			if d is _NO_ARG:
-				raise
+				raise KeyError(key)
 			return d
+		return v
 
 
 	def popitem(self):
 		pair = dict.popitem(self)
-		return (pair[0][2], pair[1])
+		return (pair[0].key, pair[1])
 
 
-	def setdefault(self, key, d=None):
-		if key not in self:
-			self[key] = d
-		return self[key]
+	def clear(self):
+		dict.clear(self)
+		# There is nothing left to rehash, so switch to the newest hash
+		# backend now, like rehashing every key would.
+		if getattr(self._backend, '_successor', None) is not None:
+			self._startRehash()
+		if self._rehash is not None:
+			self._finishRehash()
 
 
-	def keys(self):
-		return list(k[2] for k in self.__dictiter__())
+	def setdefault(self, key, d=None):
+		cls = type(self)
+		if cls.__getitem__ != securedict.__getitem__ or \
+		cls.__setitem__ != securedict.__setitem__:
+			# A subclass wants to see the lookup and the insertion
+			if key not in self:
+				self[key] = d
+			return self[key]
+		if _rotation.retired and self._mustRehash():
+			return dict.setdefault(self, self._insertionWrapper(key), d)
+		return dict.setdefault(self, self._backend.wrap(key), d)
 
 
 	def iteritems(self):
-		for k, v in dict.iteritems(self):
-			yield k[2], v
+		return self._backend.iter_items(self)
 
 
-	def items(self):
-		return list((k[2], v) for k, v in dict.iteritems(self))
+	def itervalues(self):
+		return _dictitervalues(self)
+
+
+	if _PY3:
+		def keys(self):
+			return SecureKeysView(self)
+
+
+		def items(self):
+			return SecureItemsView(self)
+
+		# dict.values is okay
+	else:
+		def keys(self):
+			return list(self._backend.iter_keys(self))
+
+
+		def items(self):
+			return list(self._backend.iter_items(self))
 
 
 	def copy(self):
-		return securedict(self)
+		c = securedict()
+		c._backend = self._backend
+		c.update(self)
+		return c
+
+
+	if hasattr(dict, '__reversed__'):
+		# Python 3.8+
+		def __reversed__(self):
+			return imap(self._backend.unwrap, dict.__reversed__(self))
+
+
+	if hasattr(dict, '__or__'):
+		# Python 3.9+.  dict's own operators would copy the key wrappers
+		# into a plain dict, or insert the keys without wrapping them.
+		def __or__(self, other):
+			if not isinstance(other, dict):
+				return NotImplemented
+			c = self.copy()
+			c.update(other)
+			return c
+
+
+		def __ror__(self, other):
+			if not isinstance(other, dict):
+				return NotImplemented
+			c = self.copy()
+			c.clear()
+			c.update(other)
+			c.update(self)
+			return c
+
+
+		def __ior__(self, other):
+			self.update(other)
+			return self
+
+
+	@classmethod
+	def fromkeys(cls, iterable, value=None):
+		"""
+		Return a new C{cls} with keys from C{iterable}, each mapped to
+		C{value}.  All of the keys are hashed in one pass and inserted with
+		one C{dict.update}, unless C{cls} overrides C{__setitem__}.  If
+		C{iterable} is a securedict with the same hash backend, its key
+		wrappers are reused without rehashing.
+		"""
+		d = cls()
+		if not isinstance(d, securedict):
+			# A subclass's __new__ returned something else
+			for k in iterable:
+				d[k] = value
+		elif (isinstance(iterable, securedict) and
+		iterable._backend is d._backend and iterable._rehash is None and
+		type(d).__setitem__ == securedict.__setitem__ and
+		type(iterable).__iter__ == securedict.__iter__):
+			dict.update(d, izip(iterable.__dictiter__(), repeat(value)))
+		else:
+			d._ingest(list(iterable), repeat(value))
+		return d
+
+
+	def __getstate__(self):
+		"""
+		Return the keys, the values in the same order, and the instance
+		C{__dict__} (of a subclass without C{__slots__}) or C{None}.  The
+		key wrappers and the hash backend, which are derived from the
+		secret, are left out.
+		"""
+		return (list(self), list(self.itervalues()),
+			getattr(self, '__dict__', None))
+
+
+	def __setstate__(self, state):
+		"""
+		Insert the keys and values from L{__getstate__}, all hashed in one
+		pass with this securedict's hash backend.
+		"""
+		keys, values, attributes = state
+		self._ingest(keys, values)
+		if attributes:
+			self.__dict__.update(attributes)
+
+
+	def __reduce__(self):
+		# Make an empty instance without calling __init__, like protocol 2
+		# does for other objects, and fill it with __setstate__.
+		return (__newobj__, (self.__class__,), self.__getstate__())
+
+
+	def dumps(self):
+		"""
+		Return the keys and values as compact C{bytes}, which L{loads}
+		reads back.  Only the keys and values are written, not their digests
+		or anything else derived from the secret.  The values must be
+		C{marshal}able (built-in types, but not securedicts).
+		"""
+		try:
+			data = marshal.dumps((list(self), list(self.itervalues())), 2)
+		except ValueError:
+			raise TypeError("securedict.dumps can only write keys and values "
+				"that marshal supports")
+		return _DUMP_HEADER.pack(_DUMP_MAGIC, len(data)) + data
+
+
+	def dump(self, fp):
+		"""
+		Write L{dumps} to file-like object C{fp}.
+		"""
+		fp.write(self.dumps())
+
+
+	@classmethod
+	def loads(cls, s):
+		"""
+		Return a new C{cls} with the keys and values in C{s}, which
+		L{dumps} wrote.  The keys are all hashed in one pass, with
+		C{cls}'s hash backend.  Raise C{ValueError} if C{s} is truncated or
+		doesn't hold the same number of keys and values.
+
+		Only load dumps that you trust, written by the same version of
+		Python: the format is C{marshal}'s, which changes between versions
+		and isn't safe against maliciously constructed data.
+		"""
+		if s[:len(_DUMP_MAGIC)] != _DUMP_MAGIC:
+			raise ValueError("not a securedict dump")
+		start = _DUMP_HEADER.size
+		if len(s) < start or \
+		len(s) != start + _DUMP_HEADER.unpack_from(s)[1]:
+			raise ValueError("truncated securedict dump")
+		try:
+			snapshot = marshal.loads(s[start:])
+		except (EOFError, TypeError, ValueError):
+			raise ValueError("corrupt securedict dump")
+		if type(snapshot) is not tuple or len(snapshot) != 2 or \
+		type(snapshot[0]) is not list or type(snapshot[1]) is not list or \
+		len(snapshot[0]) != len(snapshot[1]):
+			raise ValueError("a securedict dump must hold a list of keys "
+				"and a list of as many values")
+		keys, values = snapshot
+		d = cls()
+		d._ingest(keys, values)
+		return d
+
+
+	@classmethod
+	def load(cls, fp):
+		"""
+		Like L{loads}, but read from file-like object C{fp}.
+		"""
+		return cls.loads(fp.read())
 
 
 	if hasattr({}, 'viewitems'): # Python 2.7+
-		def viewitems(self):
-			raise NotImplementedError("no viewitems on securedict")
+		def viewkeys(self):
+			return SecureKeysView(self)
 
 
-		def viewkeys(self):
-			raise NotImplementedError("no viewkeys on securedict")
+		def viewitems(self):
+			return SecureItemsView(self)
 
 		# viewvalues is okay
 
 
 
-__all__ = ['__version__', 'is_dict_update_broken', 'securedict']
+if KeysView is not None:
+	class SecureKeysView(KeysView):
+		"""
+		A lazy view of a securedict's keys, like a C{dict}'s C{viewkeys()}.
+		Iterating, C{len}, and C{in} go straight to the securedict, without
+		copying its keys.  Set operations return another L{SecureKeysView}
+		(of a new securedict), so their results are safe to fill with
+		untrusted keys too.
+		"""
+		__slots__ = ()
+
+		def __iter__(self):
+			return self._mapping.__iter__()
+
+
+		def __len__(self):
+			return len(self._mapping)
+
+
+		def __contains__(self, key):
+			return key in self._mapping
+
+
+		def _from_iterable(self, it):
+			return SecureKeysView(securedict.fromkeys(it))
+
+
+		def __rsub__(self, other):
+			return self._from_iterable(k for k in other if k not in self)
+
+		# Like dict views, accept any iterable on either side of & | ^
+		__rand__ = KeysView.__and__
+		__ror__ = KeysView.__or__
+		__rxor__ = KeysView.__xor__
+
+
+		def __repr__(self):
+			return 'securedict_keys(%r)' % (list(self),)
+
+
+
+	class SecureItemsView(ItemsView):
+		"""
+		A lazy view of a securedict's C{(key, value)} pairs, like a C{dict}'s
+		C{viewitems()}.  Iterating, C{len}, and C{in} go straight to the
+		securedict, without copying its items.
+
+		Set operations return a C{set} of C{(key, value)} tuples, like a
+		C{dict}'s items view.  Don't do set operations on items views of
+		untrusted keys.
+		"""
+		__slots__ = ()
+
+		def __iter__(self):
+			return self._mapping.iteritems()
+
+
+		def __len__(self):
+			return len(self._mapping)
+
+
+		def __contains__(self, item):
+			key, value = item
+			# Don't call __missing__
+			v = _dictGetter(self._mapping)(key, _NO_ARG)
+			return v is not _NO_ARG and (v is value or v == value)
+
+
+		def _from_iterable(self, it):
+			return set(it)
+
+
+		def __rsub__(self, other):
+			return self._from_iterable(i for i in other if i not in self)
+
+		__rand__ = ItemsView.__and__
+		__ror__ = ItemsView.__or__
+		__rxor__ = ItemsView.__xor__
+
+
+		def __repr__(self):
+			return 'securedict_items(%r)' % (list(self),)
+
+
+
+class _PendingCompute(object):
+	"""
+	A value that one thread is computing for L{securecache.get_or_compute}
+	while other threads wait for it.
+	"""
+	def __init__(self):
+		self.done = Event()
+		self.value = None
+		self.error = None
+
+
+
+class securecache(object):
+	"""
+	A bounded least-recently-used cache that is safe against algorithmic
+	complexity attacks, for caching things keyed by untrusted strings.  Like
+	a securedict, it stores a key wrapper for each key, and it supports the
+	same key types.
+
+	It holds at most C{max_entries} entries, and evicts the least recently
+	used one to make room for a new one.  If C{ttl} is not C{None}, an
+	entry expires C{ttl} seconds after it is put (C{put} can override this
+	for one entry).  Expired entries are dropped when they are looked up or
+	evicted, so C{len()} may count some.  C{get}, C{put}, and eviction take
+	O(1) time.
+
+	C{hits}, C{misses}, C{evictions}, and C{expirations} count what the
+	cache has done.  A lookup of an expired entry counts as a miss and an
+	expiration.
+
+	A securecache is thread-safe.
+	"""
+	# The clock for TTLs, in seconds.  It is monotonic where it can be, so
+	# that setting the system clock doesn't expire entries or revive them.
+	_clock = staticmethod(_monotonic)
+
+	def __init__(self, max_entries, ttl=None, hash_backend=None):
+		if max_entries < 1:
+			raise ValueError("max_entries must be at least 1, "
+				"got %r" % (max_entries,))
+		self.max_entries = max_entries
+		self.ttl = ttl
+		# key -> (value, expiry time or None), least recently used first
+		self._entries = secureordereddict()
+		if hash_backend is not None:
+			self._entries.set_hash_backend(hash_backend)
+		# key wrapper -> _PendingCompute, for get_or_compute
+		self._pending = {}
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.expirations = 0
+		self._lock = Lock()
+
+
+	def get_hash_backend(self):
+		return self._entries.get_hash_backend()
+
+
+	def _wrap(self, key):
+		"""
+		Return the wrapper for C{key}.  If L{rotate_secret} has retired this
+		cache's hash backend, every entry (and every key being computed) is
+		moved to the newest one first.  Call with the lock held.
+		"""
+		entries = self._entries
+		if _rotation.retired and \
+		getattr(entries._backend, '_successor', None) is not None:
+			backend = _newestBackend(entries._backend)
+			entries.set_hash_backend(backend)
+			pending = self._pending
+			for wrapper in list(pending):
+				pending[backend.wrap(wrapper.key)] = pending.pop(wrapper)
+		return entries._backend.wrap(key)
+
+
+	def _lookup(self, wrapper):
+		"""
+		Return the value for C{wrapper}, or C{_NO_ARG} if it is missing or
+		has expired, and count a hit or a miss.  Call with the lock held.
+		"""
+		entries = self._entries
+		entry = dict.get(entries, wrapper, _NO_ARG)
+		if entry is _NO_ARG:
+			self.misses += 1
+			return _NO_ARG
+		expires = entry[1]
+		if expires is not None and expires <= self._clock():
+			dict.__delitem__(entries, wrapper)
+			entries._forget(wrapper)
+			self.expirations += 1
+			self.misses += 1
+			return _NO_ARG
+		entries._moveToEnd(wrapper)
+		self.hits += 1
+		return entry[0]
+
+
+	def _put(self, wrapper, value, ttl):
+		"""
+		Store C{value} for C{wrapper} as the most recently used entry,
+		evicting the least recently used entry if the cache is full.  Call
+		with the lock held.
+		"""
+		if ttl is _NO_ARG:
+			ttl = self.ttl
+		expires = None
+		if ttl is not None:
+			expires = self._clock() + ttl
+		entries = self._entries
+		if dict.__contains__(entries, wrapper):
+			dict.__setitem__(entries, wrapper, (value, expires))
+			entries._moveToEnd(wrapper)
+			return
+		entries._appendWrapped(((wrapper, (value, expires)),))
+		if len(entries) > self.max_entries:
+			entries.popitem(last=False)
+			self.evictions += 1
+
+
+	def get(self, key, default=None):
+		"""
+		Return the value for C{key} and mark it most recently used, or
+		return C{default} if it is missing or has expired.
+		"""
+		with self._lock:
+			value = self._lookup(self._wrap(key))
+		if value is _NO_ARG:
+			return default
+		return value
+
+
+	def put(self, key, value, ttl=_NO_ARG):
+		"""
+		Store C{value} for C{key}.  It expires after C{ttl} seconds (C{None}
+		for never), or after the cache's C{ttl} if C{ttl} is not given.
+		"""
+		with self._lock:
+			self._put(self._wrap(key), value, ttl)
+
+
+	def get_or_compute(self, key, compute, ttl=_NO_ARG):
+		"""
+		Return the value for C{key}.  On a miss, call C{compute()} to make
+		the value, store it (with C{ttl}, like L{put}), and return it.
+
+		If other threads miss on C{key} while C{compute()} is running, they
+		wait for its result instead of calling C{compute()} themselves.  If
+		C{compute()} raises an exception, nothing is stored, and every
+		waiting thread raises the same exception.
+		"""
+		pending = self._pending
+		with self._lock:
+			wrapper = self._wrap(key)
+			value = self._lookup(wrapper)
+			if value is not _NO_ARG:
+				return value
+			computing = pending.get(wrapper)
+			if computing is None:
+				computing = pending[wrapper] = _PendingCompute()
+				mine = True
+			else:
+				mine = False
+
+		if not mine:
+			computing.done.wait()
+			if computing.error is not None:
+				raise computing.error
+			return computing.value
+
+		try:
+			try:
+				value = compute()
+			except BaseException as e:
+				computing.error = e
+				raise
+			computing.value = value
+			# Wrap the key again, in case the entries have moved to a new
+			# hash backend while compute() ran
+			with self._lock:
+				self._put(self._wrap(key), value, ttl)
+		finally:
+			with self._lock:
+				del pending[self._wrap(key)]
+			computing.done.set()
+		return value
+
+
+	def pop(self, key, default=None):
+		"""
+		Remove C{key} and return its value (even if it has expired), or
+		return C{default} if it is missing.
+		"""
+		entries = self._entries
+		with self._lock:
+			wrapper = self._wrap(key)
+			entry = dict.pop(entries, wrapper, None)
+			if entry is not None:
+				entries._forget(wrapper)
+		if entry is None:
+			return default
+		return entry[0]
+
+
+	def __contains__(self, key):
+		"""
+		Return C{True} if C{key} is cached and hasn't expired.  This doesn't
+		count as a hit or miss, or mark C{key} used.
+		"""
+		with self._lock:
+			entry = dict.get(self._entries, self._wrap(key))
+		return entry is not None and (
+			entry[1] is None or entry[1] > self._clock())
+
+
+	def clear(self):
+		"""
+		Remove every entry.  The counters are not reset.
+		"""
+		with self._lock:
+			self._entries.clear()
+
+
+	def __len__(self):
+		return len(self._entries)
+
+
+	def __repr__(self):
+		return '<%s %d/%d entries, %d hits, %d misses, %d evictions>' % (
+			self.__class__.__name__, len(self), self.max_entries,
+			self.hits, self.misses, self.evictions)
+
+
+
+# The stripe of a concurrentsecuredict key comes from the high half of its
+# wrapper's hash.  The stripe's dict indexes its slots by the low bits, so
+# using those would crowd each stripe's keys into a fraction of its slots.
+_STRIPE_SHIFT = (16, 32)[maxsize > 2**32]
+
+
+class concurrentsecuredict(object):
+	"""
+	A thread-safe mapping that is safe against algorithmic complexity
+	attacks.  Like a securedict, it stores a key wrapper for each key, and
+	it supports the same key types.
+
+	Its keys are split into C{stripes} stripes by the high bits of their
+	wrappers' hashes (which are derived from the keys' keyed digests), and
+	each stripe is a dict with its own lock, so threads working on keys in
+	different stripes don't wait for each other.  Keys are hashed before
+	any lock is taken.
+
+	Each single-key operation (including C{setdefault}, C{pop}, and
+	L{get_or_insert}) is atomic.  C{update} is atomic for each stripe, but
+	not as a whole.  Iterating, C{keys()}, C{items()}, C{copy()}, C{==},
+	and C{repr()} work on a L{snapshot}, which is taken with every stripe
+	locked, so it is a state that the mapping was really in, and it doesn't
+	change while you iterate over it.
+
+	To change the number of stripes or the hash backend for all instances
+	of a subclass, set C{stripes} or C{hash_backend} on the subclass.
+	"""
+	# The number of stripes
+	stripes = 16
+
+	# A hash backend, or None to use the default hash backend
+	hash_backend = None
+
+	__hash__ = None
+
+	def __init__(self, *args, **kwargs):
+		backend = self.hash_backend
+		if backend is None:
+			backend = _defaultBackend
+		self._backend = backend
+		self._shards = [{} for i in xrange(self.stripes)]
+		self._locks = [Lock() for i in xrange(self.stripes)]
+		self.update(*args, **kwargs)
+
+
+	def _stripe(self, wrapper):
+		return (hash(wrapper) >> _STRIPE_SHIFT) % self.stripes
+
+
+	def _lockAll(self):
+		# Always in the same order, so that two threads can't deadlock
+		for lock in self._locks:
+			lock.acquire()
+
+
+	def _unlockAll(self):
+		for lock in self._locks:
+			lock.release()
+
+
+	def _lockKey(self, key):
+		"""
+		Wrap C{key}, lock its stripe, and return the wrapper and the index
+		of the stripe.  If another thread moved the keys to a new hash
+		backend (see L{_renew}) before the stripe was locked, C{key} is
+		wrapped again.
+		"""
+		while True:
+			backend = self._backend
+			wrapper = backend.wrap(key)
+			i = self._stripe(wrapper)
+			lock = self._locks[i]
+			lock.acquire()
+			if self._backend is backend:
+				return wrapper, i
+			lock.release()
+
+
+	def _renew(self):
+		"""
+		If L{rotate_secret} has retired this mapping's hash backend, move
+		every key to the newest one, with every stripe locked.  Writes call
+		this while any retired backend is alive.
+		"""
+		if getattr(self._backend, '_successor', None) is None:
+			return
+		self._lockAll()
+		try:
+			# Another thread may have moved them while this one waited
+			backend = self._backend
+			if getattr(backend, '_successor', None) is not None:
+				self._rehashLocked(_newestBackend(backend))
+		finally:
+			self._unlockAll()
+
+
+	def _ingestWrapped(self, pairs, backend):
+		"""
+		Insert C{(wrapper, value)} pairs made by C{backend}, with one
+		C{dict.update} for each stripe.  If another thread has moved the
+		keys to a new hash backend, the rest are inserted one at a time.
+		"""
+		stripe = self._stripe
+		buckets = [[] for i in xrange(self.stripes)]
+		for pair in pairs:
+			buckets[stripe(pair[0])].append(pair)
+		for shard, lock, bucket in izip(self._shards, self._locks, buckets):
+			if bucket:
+				with lock:
+					if self._backend is backend:
+						dict.update(shard, bucket)
+						continue
+				for wrapper, value in bucket:
+					self[wrapper.key] = value
+
+
+	def _snapshotWrapped(self):
+		"""
+		Return the hash backend and a list of the C{(wrapper, value)} pairs
+		in every stripe, all taken at the same time.
+		"""
+		pairs = []
+		self._lockAll()
+		try:
+			backend = self._backend
+			for shard in self._shards:
+				pairs.extend(_dictiteritems(shard))
+		finally:
+			self._unlockAll()
+		return backend, pairs
+
+
+	def update(self, *args, **kwargs):
+		"""
+		Insert the keys and values from a mapping or an iterable of
+		C{(key, value)} pairs, and from C{kwargs}, like C{dict.update}.  All
+		of the keys are hashed before any stripe is locked.  A securedict or
+		concurrentsecuredict that uses the same hash backend isn't rehashed.
+		"""
+		if len(args) > 1:
+			raise TypeError("update expected at most 1 arguments, "
+				"got %d" % (len(args),))
+		if _rotation.retired:
+			self._renew()
+		backend = self._backend
+		pairs = []
+		if args:
+			x = args[0]
+			if isinstance(x, concurrentsecuredict) and \
+			x._backend is backend:
+				snapshotBackend, pairs = x._snapshotWrapped()
+				if snapshotBackend is not backend:
+					pairs = list(backend.wrap_items(
+						(pair[0].key, pair[1]) for pair in pairs))
+			elif isinstance(x, securedict) and x._backend is backend and \
+			x._rehash is None and type(x).keys == securedict.keys and \
+			type(x).__getitem__ == securedict.__getitem__:
+				pairs = list(x._wrappedItems())
+			elif hasattr(x, 'keys'):
+				keys = list(x.keys())
+				pairs = list(
+					izip(backend.wrap_many(keys), imap(x.__getitem__, keys)))
+			else:
+				pairs = list(backend.wrap_items(x))
+		if kwargs:
+			pairs.extend(backend.wrap_items(kwargs.items()))
+		self._ingestWrapped(pairs, backend)
+
+
+	def get_hash_backend(self):
+		return self._backend
+
+
+	def set_hash_backend(self, backend):
+		"""
+		Make this mapping hash its keys with C{backend} instead of the
+		backend selected by its class.  Existing keys are rehashed, with
+		every stripe locked.
+		"""
+		self._lockAll()
+		try:
+			self._rehashLocked(backend)
+		finally:
+			self._unlockAll()
+
+
+	def _rehashLocked(self, backend):
+		items = []
+		for shard in self._shards:
+			items.extend(self._backend.iter_items(shard))
+			shard.clear()
+		self._backend = backend
+		stripe = self._stripe
+		shards = self._shards
+		for pair in backend.wrap_items(items):
+			dict.__setitem__(shards[stripe(pair[0])], *pair)
+
+
+	def __getitem__(self, key):
+		wrapper, i = self._lockKey(key)
+		try:
+			value = self._shards[i].get(wrapper, _NO_ARG)
+		finally:
+			self._locks[i].release()
+		if value is _NO_ARG:
+			raise KeyError(key)
+		return value
+
+
+	def get(self, key, default=None):
+		wrapper, i = self._lockKey(key)
+		try:
+			return self._shards[i].get(wrapper, default)
+		finally:
+			self._locks[i].release()
+
+
+	def __setitem__(self, key, value):
+		if _rotation.retired:
+			self._renew()
+		wrapper, i = self._lockKey(key)
+		try:
+			self._shards[i][wrapper] = value
+		finally:
+			self._locks[i].release()
+
+
+	def __delitem__(self, key):
+		if _rotation.retired:
+			self._renew()
+		wrapper, i = self._lockKey(key)
+		try:
+			value = self._shards[i].pop(wrapper, _NO_ARG)
+		finally:
+			self._locks[i].release()
+		if value is _NO_ARG:
+			raise KeyError(key)
+
+
+	def __contains__(self, key):
+		wrapper, i = self._lockKey(key)
+		try:
+			return wrapper in self._shards[i]
+		finally:
+			self._locks[i].release()
+	has_key = __contains__
+
+
+	def pop(self, key, d=_NO_ARG):
+		if _rotation.retired:
+			self._renew()
+		wrapper, i = self._lockKey(key)
+		try:
+			value = self._shards[i].pop(wrapper, _NO_ARG)
+		finally:
+			self._locks[i].release()
+		if value is _NO_ARG:
+			if d is _NO_ARG:
+				raise KeyError(key)
+			return d
+		return value
+
+
+	def setdefault(self, key, d=None):
+		if _rotation.retired:
+			self._renew()
+		wrapper, i = self._lockKey(key)
+		try:
+			return self._shards[i].setdefault(wrapper, d)
+		finally:
+			self._locks[i].release()
+
+
+	def get_or_insert(self, key, factory):
+		"""
+		Return the value for C{key}.  If C{key} is missing, call
+		C{factory()}, insert what it returns, and return that.
+
+		C{factory()} is called with C{key}'s stripe locked, so when several
+		threads call this at once for a missing key, C{factory()} is called
+		only once, and they all get the same value.  C{factory()} must not
+		use this mapping.
+		"""
+		if _rotation.retired:
+			self._renew()
+		wrapper, i = self._lockKey(key)
+		try:
+			shard = self._shards[i]
+			value = shard.get(wrapper, _NO_ARG)
+			if value is _NO_ARG:
+				value = shard[wrapper] = factory()
+			return value
+		finally:
+			self._locks[i].release()
+
+
+	def popitem(self):
+		for shard, lock in izip(self._shards, self._locks):
+			with lock:
+				if shard:
+					pair = shard.popitem()
+					return (pair[0].key, pair[1])
+		raise KeyError('popitem(): dictionary is empty')
+
+
+	def clear(self):
+		self._lockAll()
+		try:
+			for shard in self._shards:
+				shard.clear()
+		finally:
+			self._unlockAll()
+
+
+	def __len__(self):
+		return sum(imap(len, self._shards))
+
+
+	def snapshot(self):
+		"""
+		Return a securedict of everything in this mapping, taken with every
+		stripe locked.
+		"""
+		s = securedict()
+		s._backend, pairs = self._snapshotWrapped()
+		dict.update(s, pairs)
+		return s
+
+
+	def copy(self):
+		c = self.__class__()
+		c._backend, pairs = self._snapshotWrapped()
+		c._ingestWrapped(pairs, c._backend)
+		return c
+
+
+	def keys(self):
+		return [pair[0].key for pair in self._snapshotWrapped()[1]]
+
+
+	def values(self):
+		return [pair[1] for pair in self._snapshotWrapped()[1]]
+
+
+	def items(self):
+		return [(pair[0].key, pair[1])
+			for pair in self._snapshotWrapped()[1]]
+
+
+	def __iter__(self):
+		return iter(self.keys())
+	iterkeys = __iter__
+
+
+	def itervalues(self):
+		return iter(self.values())
+
+
+	def iteritems(self):
+		return iter(self.items())
+
+
+	def __eq__(self, other):
+		if isinstance(other, concurrentsecuredict):
+			other = other.snapshot()
+		elif not isinstance(other, dict):
+			return NotImplemented
+		return self.snapshot() == other
+
+
+	def __ne__(self, other):
+		eq = self.__eq__(other)
+		if eq is NotImplemented:
+			return eq
+		return not eq
+
+
+	def __repr__(self):
+		return '%s(%s)' % (
+			self.__class__.__name__, self.snapshot().repr_like_dict())
+
+
+	def __getstate__(self):
+		"""
+		Return the items of a L{snapshot}, and the instance attributes
+		other than the stripes, their locks, and the hash backend (which
+		can't be pickled), or C{None}.
+		"""
+		attributes = dict(self.__dict__)
+		for name in ('_backend', '_shards', '_locks'):
+			attributes.pop(name, None)
+		return (self.items(), attributes or None)
+
+
+	def __setstate__(self, state):
+		"""
+		Insert the items from L{__getstate__}, hashed with this mapping's
+		hash backend.
+		"""
+		items, attributes = state
+		if attributes:
+			self.__dict__.update(attributes)
+		self.update(items)
+
+
+	def __reduce__(self):
+		# Make an empty mapping (with new stripes and locks) and fill it
+		# with __setstate__, so that a mapping that contains itself works.
+		return (self.__class__, (), self.__getstate__())
+
+
+
+# The layout of a frozensecuredict buffer, all little-endian:
+#
+#	header: magic, hash backend name, backend parameter (digest_size or
+#	layout), unused, number of keys, number of slots (a power of 2), and
+#	the first 8 bytes of the digest of _FROZEN_CHECK_KEY, which tells a
+#	reader whether it has the right secret.
+#
+#	slots: for each slot, the first 8 bytes of its key's digest as a word,
+#	and the offset of its entry in the buffer (0 for an empty slot).
+#
+#	entries: for each key, the encoded key followed by the encoded value.
+#
+# The last byte of the magic is the format version.  Version 2 hashes
+# numbers with their binary encodings.
+_FROZEN_MAGIC = b'SFD\x02'
+_FROZEN_HEADER = Struct('<4s8sHHQQ8s')
+_FROZEN_SLOT = Struct('<QQ')
+_FROZEN_WORD = Struct('<Q')
+_FROZEN_CHECK_KEY = b'securetypes.frozensecuredict'
+_SLOTS_START = _FROZEN_HEADER.size
+_SLOT_SIZE = _FROZEN_SLOT.size
+_unpackWord = _FROZEN_WORD.unpack_from
+_unpackSlot = _FROZEN_SLOT.unpack_from
+
+# Backend name -> (backend class, the constructor argument stored in the
+# header)
+_frozenBackends = {
+	'sha1': (Sha1Backend, 'layout'),
+	'blake2b': (Blake2bBackend, 'digest_size'),
+}
+
+_first = itemgetter(0)
+_second = itemgetter(1)
+_INT64 = Struct('<q')
+_FLOAT = Struct('<d')
+_LENGTH = Struct('<I')
+
+
+def _packFrozen(obj, out):
+	"""
+	Append the encoding of C{obj}, which must be C{bytes}, C{unicode},
+	C{int}, C{long}, C{float}, C{bool}, C{None}, or a C{tuple} of those, to
+	list C{out}.
+	"""
+	t = type(obj)
+	if t == bytes:
+		out.append(b's' + _LENGTH.pack(len(obj)))
+		out.append(obj)
+	elif t == unicode:
+		encoded = obj.encode('utf-8', _SURROGATES)
+		out.append(b'u' + _LENGTH.pack(len(encoded)))
+		out.append(encoded)
+	elif t == bool:
+		out.append((b'F', b'T')[obj])
+	elif t in (int, long):
+		if -2**63 <= obj < 2**63:
+			out.append(b'i' + _INT64.pack(obj))
+		else:
+			digits = b'%d' % (obj,)
+			out.append(b'l' + _LENGTH.pack(len(digits)))
+			out.append(digits)
+	elif t == float:
+		out.append(b'f' + _FLOAT.pack(obj))
+	elif t == NoneType:
+		out.append(b'N')
+	elif t == tuple:
+		out.append(b't' + _LENGTH.pack(len(obj)))
+		for element in obj:
+			_packFrozen(element, out)
+	else:
+		raise TypeError("Can't store a %r object in a frozensecuredict" % (
+			t,))
+
+
+def _unpackFrozen(buf, pos):
+	"""
+	Decode the object encoded at C{buf[pos:]}, and return it and the
+	position after it.
+	"""
+	tag = buf[pos:pos + 1]
+	pos += 1
+	if tag == b's' or tag == b'u' or tag == b'l':
+		end = pos + 4 + _LENGTH.unpack_from(buf, pos)[0]
+		data = buf[pos + 4:end]
+		if tag == b'u':
+			return data.decode('utf-8', _SURROGATES), end
+		elif tag == b'l':
+			return long(data), end
+		return data, end
+	elif tag == b'i':
+		return _INT64.unpack_from(buf, pos)[0], pos + 8
+	elif tag == b'f':
+		return _FLOAT.unpack_from(buf, pos)[0], pos + 8
+	elif tag == b'N':
+		return None, pos
+	elif tag == b'T':
+		return True, pos
+	elif tag == b'F':
+		return False, pos
+	elif tag == b't':
+		n = _LENGTH.unpack_from(buf, pos)[0]
+		pos += 4
+		elements = []
+		for i in xrange(n):
+			element, pos = _unpackFrozen(buf, pos)
+			elements.append(element)
+		return tuple(elements), pos
+	raise ValueError("corrupt frozensecuredict entry at %d" % (pos - 1,))
+
+
+def _frozenBackend(name, parameter, secret):
+	"""
+	Return the hash backend named C{name} with C{secret} and its header
+	C{parameter}.
+	"""
+	if secret is None:
+		raise ValueError("a frozensecuredict needs an explicit secret")
+	try:
+		cls, option = _frozenBackends[name]
+	except KeyError:
+		raise ValueError("unknown frozensecuredict hash backend %r" % (name,))
+	return cls(secret, **{option: parameter})
+
+
+
+class frozensecuredict(object):
+	"""
+	A read-only mapping that is safe against algorithmic complexity
+	attacks, stored in one flat buffer that can be written to a file and
+	C{mmap}ed by many processes at once.
+
+	Build the buffer once with L{build}, write it to a file, and open it
+	in every worker with L{open}.  Looking up a key hashes it, reads the
+	slots that it probes and the one entry that matches, and decodes just
+	that key and value, so the buffer's pages are never written to and stay
+	shared between the processes.
+
+	Keys are hashed with a keyed digest, like a securedict's, but the
+	secret is never the process-wide one: every process that reads the
+	buffer needs the secret that it was built with, so the secret must be
+	given explicitly.  A buffer records which hash backend built it, and
+	opening it with the wrong secret raises C{ValueError}.
+
+	Keys and values must be C{bytes}, C{unicode}, C{int}, C{long},
+	C{float}, C{bool}, C{None}, or C{tuple}s of those.
+	"""
+	__hash__ = None
+
+	def __init__(self, buffer, secret):
+		"""
+		Read the frozensecuredict in C{buffer} (C{bytes}, a C{buffer}, or an
+		C{mmap}), which was built with C{secret}.
+		"""
+		if len(buffer) < _FROZEN_HEADER.size:
+			raise ValueError("not a frozensecuredict buffer")
+		(magic, name, parameter, unused, self._count, slots,
+			check) = _FROZEN_HEADER.unpack_from(buffer, 0)
+		if magic != _FROZEN_MAGIC:
+			if magic[:3] == _FROZEN_MAGIC[:3]:
+				raise ValueError("frozensecuredict buffer has format version "
+					"%d; this version of securetypes reads only version %d" % (
+					bytearray(magic)[3], bytearray(_FROZEN_MAGIC)[3]))
+			raise ValueError("not a frozensecuredict buffer")
+		if len(buffer) < _FROZEN_HEADER.size + slots * _FROZEN_SLOT.size:
+			raise ValueError("truncated frozensecuredict buffer")
+		self._backend = _frozenBackend(
+			name.rstrip(b'\x00').decode('ascii'), parameter, secret)
+		if self._backend.digest(_FROZEN_CHECK_KEY)[:8] != check:
+			raise ValueError("frozensecuredict buffer was built with a "
+				"different secret")
+		self._buffer = buffer
+		self._mask = slots - 1
+
+
+	@classmethod
+	def build(cls, items, secret, hash_backend_class=None, **options):
+		"""
+		Return a C{bytes} buffer holding the keys and values in C{items} (a
+		mapping or an iterable of C{(key, value)} pairs), hashed with
+		C{secret}.
+
+		The keys are hashed with C{hash_backend_class(secret, **options)},
+		which must be L{Blake2bBackend} (the default when blake2b is
+		available) or L{Sha1Backend}.
+		"""
+		if secret is None:
+			raise ValueError("a frozensecuredict needs an explicit secret")
+		if hash_backend_class is None:
+			hash_backend_class = (Sha1Backend, Blake2bBackend)[
+				blake2b is not None]
+		for name, (backendClass, option) in _frozenBackends.items():
+			if backendClass is hash_backend_class:
+				break
+		else:
+			raise ValueError("can't build a frozensecuredict with %r" % (
+				hash_backend_class,))
+		backend = hash_backend_class(secret, **options)
+
+		# Let a securedict drop the duplicate keys
+		d = securedict()
+		d._backend = backend
+		d.update(items)
+
+		slots = 2
+		while slots < 2 * len(d):
+			slots *= 2
+		mask = slots - 1
+		table = [(0, 0)] * slots
+		entries = []
+		offset = _FROZEN_HEADER.size + slots * _FROZEN_SLOT.size
+		digest = backend.digest
+		for k, v in backend.iter_items(d):
+			word = _FROZEN_WORD.unpack_from(digest(k))[0]
+			i = word & mask
+			while table[i][1]:
+				i = (i + 1) & mask
+			table[i] = (word, offset)
+			entry = []
+			_packFrozen(k, entry)
+			_packFrozen(v, entry)
+			entry = b''.join(entry)
+			entries.append(entry)
+			offset += len(entry)
+
+		header = _FROZEN_HEADER.pack(_FROZEN_MAGIC, name.encode('ascii'),
+			getattr(backend, option), 0, len(d), slots,
+			digest(_FROZEN_CHECK_KEY)[:8])
+		return b''.join([header] +
+			[_FROZEN_SLOT.pack(*slot) for slot in table] + entries)
+
+
+	@classmethod
+	def open(cls, path, secret):
+		"""
+		C{mmap} the file at C{path}, which holds a buffer made by L{build}
+		with C{secret}, read-only, and return a frozensecuredict that reads
+		it.
+		"""
+		f = open(path, 'rb')
+		try:
+			buffer = mmap(f.fileno(), 0, access=ACCESS_READ)
+		finally:
+			f.close()
+		return cls(buffer, secret)
+
+
+	def close(self):
+		"""
+		Unmap the buffer, if it was opened with L{open}.  The
+		frozensecuredict can't be used afterward.
+		"""
+		close = getattr(self._buffer, 'close', None)
+		if close is not None:
+			close()
+
+
+	def get_hash_backend(self):
+		return self._backend
+
+
+	def _find(self, key):
+		"""
+		Return the position of the value for C{key} in the buffer, or
+		C{None} if C{key} is missing.
+		"""
+		buf = self._buffer
+		mask = self._mask
+		word = _unpackWord(self._backend.digest(key))[0]
+		i = word & mask
+		while True:
+			slotWord, offset = _unpackSlot(buf, _SLOTS_START + _SLOT_SIZE * i)
+			if not offset:
+				return None
+			if slotWord == word:
+				k, pos = _unpackFrozen(buf, offset)
+				if k == key:
+					return pos
+			i = (i + 1) & mask
+
+
+	def __getitem__(self, key):
+		pos = self._find(key)
+		if pos is None:
+			raise KeyError(key)
+		return _unpackFrozen(self._buffer, pos)[0]
+
+
+	def get(self, key, default=None):
+		pos = self._find(key)
+		if pos is None:
+			return default
+		return _unpackFrozen(self._buffer, pos)[0]
+
+
+	def __contains__(self, key):
+		return self._find(key) is not None
+	has_key = __contains__
+
+
+	def __len__(self):
+		return self._count
+
+
+	def iteritems(self):
+		buf = self._buffer
+		pos = _FROZEN_HEADER.size + (self._mask + 1) * _FROZEN_SLOT.size
+		for i in xrange(self._count):
+			k, pos = _unpackFrozen(buf, pos)
+			v, pos = _unpackFrozen(buf, pos)
+			yield k, v
+
+
+	def __iter__(self):
+		return imap(_first, self.iteritems())
+	iterkeys = __iter__
+
+
+	def itervalues(self):
+		return imap(_second, self.iteritems())
+
+
+	def keys(self):
+		return list(self.iterkeys())
+
+
+	def values(self):
+		return list(self.itervalues())
+
+
+	def items(self):
+		return list(self.iteritems())
+
+
+	def copy(self):
+		"""
+		Return a securedict (with the default hash backend) of the keys and
+		values.
+		"""
+		return securedict(self.iteritems())
+
+
+	def __eq__(self, other):
+		if isinstance(other, frozensecuredict):
+			if len(self) != len(other):
+				return False
+			other = other.copy()
+		elif not isinstance(other, dict):
+			return NotImplemented
+		return self.copy() == other
+
+
+	def __ne__(self, other):
+		eq = self.__eq__(other)
+		if eq is NotImplemented:
+			return eq
+		return not eq
+
+
+	def __repr__(self):
+		return '%s(%s)' % (
+			self.__class__.__name__, self.copy().repr_like_dict())
+
+
+
+def _wrappersOf(backend, iterable):
+	"""
+	Return the key wrappers that C{backend} makes for the keys in
+	C{iterable}, either as a list or as a set.  A secureset,
+	frozensecureset, or securedict that uses C{backend} already holds them,
+	so it isn't rehashed.
+	"""
+	if isinstance(iterable, _SecureSetMixin):
+		if iterable._backend is backend:
+			# Set methods read another set's table directly, not through
+			# __iter__, so this is a set of wrappers to them.
+			return iterable
+	elif isinstance(iterable, securedict):
+		if iterable._backend is backend and iterable._rehash is None:
+			return dict.keys(iterable)
+	return backend.wrap_many(iterable)
+
+
+def _iterWrappersOf(backend, iterable):
+	"""
+	Like L{_wrappersOf}, but return an iterable that yields the wrappers even
+	if it is iterated over.
+	"""
+	wrappers = _wrappersOf(backend, iterable)
+	if wrappers is iterable:
+		return iterable._base.__iter__(iterable)
+	return wrappers
+
+
+def _wrapperSet(backend, other):
+	"""
+	Like L{_wrappersOf}, but always return a set or frozenset.
+	"""
+	wrappers = _wrappersOf(backend, other)
+	if not isinstance(wrappers, (set, frozenset)):
+		wrappers = set(wrappers)
+	return wrappers
+
+
+
+class _SecureSetMixin(object):
+	"""
+	The operations shared by L{secureset} and L{frozensecureset}.  Their
+	underlying C{set} or C{frozenset} (C{_base}) holds the key wrapper for
+	each key, like a securedict does.
+
+	Operations between two secure sets that use the same hash backend
+	compare their key wrappers directly, without rehashing any keys.
+	"""
+	__slots__ = ()
+
+	# A hash backend, or None to use the default hash backend
+	hash_backend = None
+
+	def get_hash_backend(self):
+		return self._backend
+
+
+	def __contains__(self, key):
+		return self._base.__contains__(self, self._backend.wrap(key))
+
+
+	def __iter__(self):
+		return imap(self._backend.unwrap, self._base.__iter__(self))
+
+
+	def _repr(self, name):
+		return '%s(%r)' % (name, list(self))
+
+
+	def __repr__(self):
+		return self._repr(type(self).__name__)
+
+
+	def repr_like_set(self):
+		return self._repr(self._base.__name__)
+
+
+	def __reduce__(self):
+		# Like set's and frozenset's own, but with the keys instead of
+		# their wrappers, and without the hash backend.
+		return (self.__class__, (list(self),), getattr(self, '__dict__', None))
+
+
+	def union(self, *others):
+		base = self._base
+		wrappers = base.union(self,
+			*[_wrappersOf(self._backend, o) for o in others])
+		return self._fromWrappers(wrappers)
+
+
+	def intersection(self, *others):
+		base = self._base
+		wrappers = base.intersection(self,
+			*[_wrappersOf(self._backend, o) for o in others])
+		return self._fromWrappers(wrappers)
+
+
+	def difference(self, *others):
+		base = self._base
+		wrappers = base.difference(self,
+			*[_wrappersOf(self._backend, o) for o in others])
+		return self._fromWrappers(wrappers)
+
+
+	def symmetric_difference(self, other):
+		wrappers = self._base.symmetric_difference(
+			self, _wrappersOf(self._backend, other))
+		return self._fromWrappers(wrappers)
+
+
+	def issubset(self, other):
+		return self._base.issubset(self, _wrappersOf(self._backend, other))
+
+
+	def issuperset(self, other):
+		return self._base.issuperset(self, _wrappersOf(self._backend, other))
+
+
+	def isdisjoint(self, other):
+		# isdisjoint iterates over a set subclass instead of reading its table
+		return self._base.isdisjoint(
+			self, _iterWrappersOf(self._backend, other))
+
+
+	def __or__(self, other):
+		if not isinstance(other, (set, frozenset)):
+			return NotImplemented
+		return self.union(other)
+	__ror__ = __or__
+
+
+	def __and__(self, other):
+		if not isinstance(other, (set, frozenset)):
+			return NotImplemented
+		return self.intersection(other)
+	__rand__ = __and__
+
+
+	def __sub__(self, other):
+		if not isinstance(other, (set, frozenset)):
+			return NotImplemented
+		return self.difference(other)
+
+
+	def __rsub__(self, other):
+		if not isinstance(other, (set, frozenset)):
+			return NotImplemented
+		contains = self._base.__contains__
+		return self._fromWrappers([w for w in
+			_iterWrappersOf(self._backend, other) if not contains(self, w)])
+
+
+	def __xor__(self, other):
+		if not isinstance(other, (set, frozenset)):
+			return NotImplemented
+		return self.symmetric_difference(other)
+	__rxor__ = __xor__
+
+
+	def __eq__(self, other):
+		if not isinstance(other, (set, frozenset)):
+			return NotImplemented
+		if len(self) != len(other):
+			return False
+		return self._base.__eq__(self, _wrapperSet(self._backend, other))
+
+
+	def __ne__(self, other):
+		eq = self.__eq__(other)
+		if eq is NotImplemented:
+			return eq
+		return not eq
+
+
+	def __le__(self, other):
+		if not isinstance(other, (set, frozenset)):
+			raise TypeError("can only compare to a set")
+		return self._base.__le__(self, _wrapperSet(self._backend, other))
+
+
+	def __lt__(self, other):
+		if not isinstance(other, (set, frozenset)):
+			raise TypeError("can only compare to a set")
+		return self._base.__lt__(self, _wrapperSet(self._backend, other))
+
+
+	def __ge__(self, other):
+		if not isinstance(other, (set, frozenset)):
+			raise TypeError("can only compare to a set")
+		return self._base.__ge__(self, _wrapperSet(self._backend, other))
+
+
+	def __gt__(self, other):
+		if not isinstance(other, (set, frozenset)):
+			raise TypeError("can only compare to a set")
+		return self._base.__gt__(self, _wrapperSet(self._backend, other))
+
+
+
+class secureset(_SecureSetMixin, set):
+	"""
+	A `set` that is safe against algorithmic complexity attacks, for
+	membership tests and deduplication of untrusted keys.  Like a
+	`securedict`, it stores a key wrapper for each key, and it supports the
+	same key types.
+
+	`update`, the constructor, and the set operations wrap every key in one
+	pass; between securesets (or frozensecuresets, or securedicts) that use
+	the same hash backend, they reuse the key wrappers without rehashing.
+	Set operations return an instance of the left-hand operand's class
+	(of the secure one, if only one is).
+
+	To use a different hash backend for all instances of a subclass, set
+	`hash_backend` on the subclass.
+
+	The fine print is like `securedict`'s: a `secureset` is `==` to a `set`
+	with the same keys, and it is a subclass of `set`, but never `set()` a
+	`secureset` or put it on the right side of an operator (including `==`)
+	whose left side is a `frozenset`.
+	"""
+	__slots__ = ('_backend',)
+
+	_base = set
+
+	def __new__(cls, *args, **kwargs):
+		obj = set.__new__(cls)
+		backend = cls.hash_backend
+		if backend is None:
+			backend = _defaultBackend
+		obj._backend = backend
+		return obj
+
+
+	def __init__(self, iterable=()):
+		set.clear(self)
+		self.update(iterable)
+
+
+	def _fromWrappers(self, wrappers):
+		s = set.__new__(type(self))
+		s._backend = self._backend
+		set.update(s, wrappers)
+		return s
+
+
+	def set_hash_backend(self, backend):
+		"""
+		Make this secureset hash its keys with C{backend} instead of the
+		backend selected by its class.  Existing keys are rehashed.
+		"""
+		keys = list(self)
+		set.clear(self)
+		self._backend = backend
+		self.update(keys)
+
+
+	def _renew(self):
+		"""
+		If L{rotate_secret} has retired this secureset's hash backend,
+		rehash every key with the newest one.  Writes call this while any
+		retired backend is alive.
+		"""
+		if getattr(self._backend, '_successor', None) is not None:
+			self.set_hash_backend(_newestBackend(self._backend))
+
+
+	def add(self, key):
+		if _rotation.retired:
+			self._renew()
+		set.add(self, self._backend.wrap(key))
+
+
+	def remove(self, key):
+		if _rotation.retired:
+			self._renew()
+		try:
+			set.remove(self, self._backend.wrap(key))
+		except KeyError:
+			raise KeyError(key)
+
+
+	def discard(self, key):
+		if _rotation.retired:
+			self._renew()
+		set.discard(self, self._backend.wrap(key))
+
+
+	def pop(self):
+		return self._backend.unwrap(set.pop(self))
+
+
+	def copy(self):
+		return self._fromWrappers(self)
+
+
+	def update(self, *others):
+		if type(self).add != secureset.add:
+			# A subclass wants to see every key
+			for other in others:
+				for k in other:
+					self.add(k)
+			return
+		if _rotation.retired:
+			self._renew()
+		set.update(self, *[_wrappersOf(self._backend, o) for o in others])
+
+
+	def intersection_update(self, *others):
+		if _rotation.retired:
+			self._renew()
+		set.intersection_update(self,
+			*[_wrappersOf(self._backend, o) for o in others])
+
+
+	def difference_update(self, *others):
+		if _rotation.retired:
+			self._renew()
+		set.difference_update(self,
+			*[_wrappersOf(self._backend, o) for o in others])
+
+
+	def symmetric_difference_update(self, other):
+		if _rotation.retired:
+			self._renew()
+		set.symmetric_difference_update(self,
+			_wrapperSet(self._backend, other))
+
+
+	def __ior__(self, other):
+		if not isinstance(other, (set, frozenset)):
+			return NotImplemented
+		self.update(other)
+		return self
+
+
+	def __iand__(self, other):
+		if not isinstance(other, (set, frozenset)):
+			return NotImplemented
+		self.intersection_update(other)
+		return self
+
+
+	def __isub__(self, other):
+		if not isinstance(other, (set, frozenset)):
+			return NotImplemented
+		self.difference_update(other)
+		return self
+
+
+	def __ixor__(self, other):
+		if not isinstance(other, (set, frozenset)):
+			return NotImplemented
+		self.symmetric_difference_update(other)
+		return self
+
+
+
+class frozensecureset(_SecureSetMixin, frozenset):
+	"""
+	An immutable L{secureset}, like a `frozenset`.  It is hashable, and its
+	hash is computed from its key wrappers (so it is unknowable to
+	adversaries) the first time it is needed, and then cached.
+
+	Because the hash comes from the key wrappers, two frozensecuresets
+	with the same keys have the same hash only if they use the same hash
+	backend, and a frozensecureset doesn't have the same hash as a
+	`frozenset` that it is `==` to.  Don't mix them in one set or dict.
+
+	A frozensecureset is a subclass of `frozenset`, so never `frozenset()`
+	one or put it on the right side of an operator (including `==`) whose
+	left side is a `set`.
+	"""
+	__slots__ = ('_backend', '_hash')
+
+	_base = frozenset
+
+	def __new__(cls, iterable=()):
+		backend = cls.hash_backend
+		if backend is None:
+			backend = _defaultBackend
+		obj = frozenset.__new__(cls, _wrappersOf(backend, iterable))
+		obj._backend = backend
+		obj._hash = None
+		return obj
+
+
+	def _fromWrappers(self, wrappers):
+		s = frozenset.__new__(type(self), wrappers)
+		s._backend = self._backend
+		s._hash = None
+		return s
+
+
+	def copy(self):
+		return self
+
+
+	def __hash__(self):
+		h = self._hash
+		if h is None:
+			h = self._hash = frozenset.__hash__(self)
+		return h
+
+
+
+class secureordereddict(securedict):
+	"""
+	A `securedict` that remembers the order in which its keys were first
+	inserted, like `collections.OrderedDict`, for things like LRU caches of
+	untrusted keys.  `popitem(last=True)` and `move_to_end(key, last=True)`
+	take amortized O(1) time, at either end.
+
+	The order is a flat list of the key wrappers (with `None` in the slots
+	of deleted keys) and an index of each wrapper's slot, instead of a
+	linked list of Python objects.  Deleting a key leaves a hole, and the
+	list is compacted once holes outnumber keys, so every operation stays
+	amortized O(1).
+
+	Two `secureordereddict`s are `==` only if their keys are in the same
+	order; a `secureordereddict` is `==` to any other dict with the same
+	contents.
+	"""
+	__slots__ = ('_order', '_index', '_head')
+
+	def __new__(cls, *args, **kwargs):
+		obj = securedict.__new__(cls)
+		# The key wrappers in order, and None for deleted keys.  Slots before
+		# _head are always None.
+		obj._order = []
+		# wrapper -> its slot in _order
+		obj._index = {}
+		obj._head = 0
+		return obj
+
+
+	def _sharesWrappersWith(self, other):
+		return (isinstance(other, securedict) and
+			other._backend is self._backend and
+			self._rehash is None and other._rehash is None and
+			type(self).__setitem__ == secureordereddict.__setitem__ and
+			type(other).keys in (securedict.keys, secureordereddict.keys) and
+			type(other).__getitem__ == securedict.__getitem__)
+
+
+	def _appendWrapped(self, pairs):
+		pairs = list(pairs)
+		index = self._index
+		order = self._order
+		for wrapper, value in pairs:
+			if wrapper not in index:
+				index[wrapper] = len(order)
+				order.append(wrapper)
+		dict.update(self, pairs)
+
+	# The hook that update calls.  _ingest, _ingestItems and securecache
+	# call _appendWrapped, so that instrumentation counts them only once.
+	_ingestWrapped = _appendWrapped
+
+
+	def _ingest(self, keys, values):
+		if type(self).__setitem__ != secureordereddict.__setitem__:
+			for k, v in izip(keys, values):
+				self[k] = v
+		else:
+			if _rotation.retired and self._mustRehash():
+				keys = list(keys)
+				self._rehashKeys(keys)
+			self._appendWrapped(izip(self._backend.wrap_many(keys), values))
+
+
+	def _ingestItems(self, items):
+		if type(self).__setitem__ != secureordereddict.__setitem__:
+			for k, v in items:
+				self[k] = v
+		else:
+			if _rotation.retired and self._mustRehash():
+				items = list(items)
+				self._rehashKeys([pair[0] for pair in items])
+			self._appendWrapped(self._backend.wrap_items(items))
+
+
+	def _rewrap(self, old, new):
+		securedict._rewrap(self, old, new)
+		i = self._index.pop(old)
+		self._index[new] = i
+		self._order[i] = new
+
+
+	def _compact(self, slack=0):
+		"""
+		Drop the holes from the order, leaving C{slack} empty slots at the
+		front for keys moved there.
+		"""
+		live = list(ifilter(None, islice(self._order, self._head, None)))
+		self._order = [None] * slack + live
+		self._index = dict(izip(live, count(slack)))
+		self._head = slack
+
+
+	def _forget(self, wrapper):
+		"""
+		Remove C{wrapper} from the order, and compact it if it has become
+		mostly holes.
+		"""
+		self._order[self._index.pop(wrapper)] = None
+		self._maybeCompact()
+
+
+	def _maybeCompact(self):
+		live = len(self._index)
+		head = self._head
+		if len(self._order) - head - live > live + 8 or head > 2 * live + 8:
+			self._compact()
+
+
+	def _liveWrappers(self):
+		order = self._order
+		return ifilter(None, islice(order, self._head, len(order)))
+
+
+	def _wrappedItems(self):
+		wrappers, lookup = tee(self._liveWrappers())
+		return izip(wrappers, imap(partial(dict.__getitem__, self), lookup))
+
+
+	def __setitem__(self, key, value):
+		if _rotation.retired and self._mustRehash():
+			wrapper = self._insertionWrapper(key)
+		else:
+			wrapper = self._backend.wrap(key)
+		index = self._index
+		if wrapper not in index:
+			index[wrapper] = len(self._order)
+			self._order.append(wrapper)
+		dict.__setitem__(self, wrapper, value)
+
+
+	def __delitem__(self, key):
+		if _rotation.retired and self._mustRehash():
+			wrapper = self._removalWrapper(key)
+		else:
+			wrapper = self._backend.wrap(key)
+		try:
+			dict.__delitem__(self, wrapper)
+		except KeyError:
+			raise KeyError(key)
+		self._forget(wrapper)
+
+
+	def pop(self, key, d=_NO_ARG):
+		if _rotation.retired and self._mustRehash():
+			wrapper = self._removalWrapper(key)
+		else:
+			wrapper = self._backend.wrap(key)
+		v = dict.pop(self, wrapper, _NO_ARG)
+		if v is _NO_ARG:
+			if d is _NO_ARG:
+				raise KeyError(key)
+			return d
+		self._forget(wrapper)
+		return v
+
+
+	def setdefault(self, key, d=None):
+		if _rotation.retired and self._mustRehash():
+			wrapper = self._insertionWrapper(key)
+		else:
+			wrapper = self._backend.wrap(key)
+		v = dict.get(self, wrapper, _NO_ARG)
+		if v is _NO_ARG:
+			self._index[wrapper] = len(self._order)
+			self._order.append(wrapper)
+			dict.__setitem__(self, wrapper, d)
+			return d
+		return v
+
+
+	def popitem(self, last=True):
+		"""
+		Remove and return the C{(key, value)} pair that was inserted last,
+		or first if C{last} is false.
+		"""
+		if not self:
+			raise KeyError('popitem(): dictionary is empty')
+		order = self._order
+		if last:
+			wrapper = order.pop()
+			while wrapper is None:
+				wrapper = order.pop()
+		else:
+			head = self._head
+			wrapper = order[head]
+			while wrapper is None:
+				head += 1
+				wrapper = order[head]
+			order[head] = None
+			self._head = head + 1
+		del self._index[wrapper]
+		value = dict.pop(self, wrapper)
+		self._maybeCompact()
+		return (wrapper.key, value)
+
+
+	def move_to_end(self, key, last=True):
+		"""
+		Move C{key} to the end of the order, or to the beginning if C{last}
+		is false.  Raise C{KeyError} if C{key} is missing.
+		"""
+		if _rotation.retired and self._mustRehash():
+			wrapper = self._removalWrapper(key)
+		else:
+			wrapper = self._backend.wrap(key)
+		if not self._moveToEnd(wrapper, last):
+			raise KeyError(key)
+
+
+	def _moveToEnd(self, wrapper, last=True):
+		"""
+		Like L{move_to_end}, but for a key wrapper that has already been
+		made.  Return C{False} if it is missing.
+		"""
+		index = self._index
+		i = index.get(wrapper)
+		if i is None:
+			return False
+		order = self._order
+		wrapper = order[i]
+		if last:
+			if i != len(order) - 1:
+				order[i] = None
+				index[wrapper] = len(order)
+				order.append(wrapper)
+				self._maybeCompact()
+		elif i != self._head:
+			order[i] = None
+			if self._head == 0:
+				self._compact(slack=len(index) + 8)
+				order = self._order
+				index = self._index
+			head = self._head - 1
+			order[head] = wrapper
+			index[wrapper] = head
+			self._head = head
+		return True
+
+
+	def clear(self):
+		securedict.clear(self)
+		self._order = []
+		self._index = {}
+		self._head = 0
+
+
+	def set_hash_backend(self, backend):
+		items = list(self.iteritems())
+		self.clear()
+		self._backend = backend
+		self.update(items)
+
+
+	def __iter__(self):
+		return imap(self._backend.unwrap, self._liveWrappers())
+	iterkeys = __iter__
+
+
+	def __reversed__(self):
+		return imap(self._backend.unwrap, ifilter(None, reversed(self._order)))
+
+
+	def itervalues(self):
+		return imap(partial(dict.__getitem__, self), self._liveWrappers())
+
+
+	def iteritems(self):
+		keys, values = tee(self._liveWrappers())
+		return izip(imap(self._backend.unwrap, keys),
+			imap(partial(dict.__getitem__, self), values))
+
+
+	if _PY3:
+		# securedict's keys and items views go through __iter__ and
+		# iteritems, so they are in order already.
+		def values(self):
+			return _OrderedValuesView(self)
+	else:
+		def keys(self):
+			return list(self)
+
+
+		def values(self):
+			return list(self.itervalues())
+
+
+		def items(self):
+			return list(self.iteritems())
+
+
+	def copy(self):
+		c = secureordereddict()
+		c._backend = self._backend
+		c.update(self)
+		return c
+
+
+	def __eq__(self, other):
+		eq = securedict.__eq__(self, other)
+		if eq is True and isinstance(other, secureordereddict):
+			return list(self) == list(other)
+		return eq
+
+
+	def _repr(self, withSecureDictString):
+		if not withSecureDictString:
+			return securedict._repr(self, False)
+		if self._inMyRepr:
+			return 'secureordereddict([...])'
+		self._inMyRepr = True
+		try:
+			return 'secureordereddict(%r)' % (list(self.iteritems()),)
+		finally:
+			self._inMyRepr = False
+
+
+	__dictiter__ = _liveWrappers
+
+	if hasattr({}, 'viewvalues'): # Python 2.7
+		def viewvalues(self):
+			return _OrderedValuesView(self)
+
+
+
+if ValuesView is not None:
+	class _OrderedValuesView(ValuesView):
+		__slots__ = ()
+
+		def __iter__(self):
+			return self._mapping.itervalues()
+
+
+
+# The methods of the secure types whose calls instrumentation counts, and
+# the counter for each.  A subclass that overrides one of these is only
+# counted if its method calls the one it overrides.
+_COUNTED_METHODS = [
+	('__getitem__', 'gets'), ('get', 'gets'),
+	('get_or_insert', 'gets'), ('get_or_compute', 'gets'),
+	('__setitem__', 'sets'), ('add', 'sets'), ('put', 'sets'),
+	('__delitem__', 'deletes'), ('pop', 'deletes'),
+	('remove', 'deletes'), ('discard', 'deletes'),
+	('__contains__', 'contains'), ('has_key', 'contains'),
+	('_ingest', 'ingests'), ('_ingestItems', 'ingests'),
+	('_ingestWrapped', 'ingests'),
+]
+
+# The hash backend methods that instrumentation counts and times, and
+# whether each one hashes many keys
+_TIMED_METHODS = [
+	('digest', False), ('wrap', False),
+	('wrap_many', True), ('wrap_items', True),
+]
+
+_COUNTERS = ['hashes', 'gets', 'sets', 'deletes', 'contains', 'ingests']
+
+
+class _Stats(object):
+	"""
+	The counters collected while instrumentation is enabled.
+	"""
+	def __init__(self, sample_every):
+		self.sample_every = sample_every
+		# Time the first hashing call, and every sample_every'th after it
+		self.countdown = 1
+		self.counts = dict.fromkeys(_COUNTERS, 0)
+		self.hash_seconds = 0.0
+		self.started = time()
+		# id(cache) -> (cache, its hits, its misses) when it was first seen
+		self._caches = {}
+		# (class, name) -> the hash backend method that the class defined
+		self._methods = {}
+
+
+	def _counted(self, method, counter):
+		counts = self.counts
+		def counted(*args, **kwargs):
+			counts[counter] += 1
+			return method(*args, **kwargs)
+		return counted
+
+
+	def _instrumentBackend(self, backend):
+		for name, many in _TIMED_METHODS:
+			function = getattr(backend, name)
+			if getattr(function, '__self__', None) is backend:
+				# A method of the backend's class.  Time it in the class
+				# that defines it, because an instance attribute holding a
+				# bound method would make the backend refer to itself.
+				self._instrumentMethod(type(backend), name, many)
+			else:
+				setattr(backend, name, self._timed(function, many))
+		cache = backend.digest_cache
+		if cache is not None and id(cache) not in self._caches:
+			self._caches[id(cache)] = (cache, cache.hits, cache.misses)
+
+
+	def _instrumentMethod(self, backendClass, name, many):
+		for cls in backendClass.__mro__:
+			if name in cls.__dict__:
+				break
+		if (cls, name) not in self._methods:
+			method = cls.__dict__[name]
+			self._methods[(cls, name)] = method
+			setattr(cls, name, self._timed(method, many))
+
+
+	def _uninstrumentMethods(self):
+		for (cls, name), method in self._methods.items():
+			setattr(cls, name, method)
+		self._methods.clear()
+
+
+	def _timed(self, function, many):
+		counts = self.counts
+		def timed(*args):
+			self.countdown -= 1
+			if self.countdown:
+				result = function(*args)
+			else:
+				self.countdown = self.sample_every
+				start = _clock()
+				result = function(*args)
+				self.hash_seconds += (_clock() - start) * self.sample_every
+			counts['hashes'] += len(result) if many else 1
+			return result
+		return timed
+
+
+	def snapshot(self, enabled):
+		snapshot = dict(self.counts)
+		hits = misses = 0
+		for cache, startHits, startMisses in self._caches.values():
+			# Clearing a cache resets its counters
+			hits += max(0, cache.hits - startHits)
+			misses += max(0, cache.misses - startMisses)
+		snapshot.update(
+			enabled=enabled, sample_every=self.sample_every,
+			elapsed_seconds=time() - self.started,
+			hash_seconds=self.hash_seconds,
+			cache_hits=hits, cache_misses=misses)
+		return snapshot
+
+
+# The last snapshot taken by disable_stats
+_finalStats = None
+
+
+def enable_stats(sample_every=1):
+	"""
+	Start collecting the counters returned by L{stats}, from zero.  Until
+	L{disable_stats} is called, every key hashed by a hash backend is
+	counted, and so is every call to the get, set, contains and delete
+	methods of a securedict, secureordereddict, secureset,
+	frozensecureset, securecache or concurrentsecuredict, and every bulk
+	insertion of keys into a securedict or concurrentsecuredict (by
+	C{__init__}, C{update}, C{fromkeys} and so on).  The time spent hashing
+	is measured.
+
+	Timing a call costs about as much as hashing a short key, so with
+	C{sample_every} greater than 1 only one in that many calls to a
+	backend's hashing methods is timed, and C{hash_seconds} is estimated
+	from those.  Everything is still counted.
+
+	While instrumentation is disabled (the default), the secure types and
+	hash backends run exactly the code they would without it.  The counters are
+	updated without locking, so under concurrent use they are approximate.
+	"""
+	global _stats
+	if sample_every < 1:
+		raise ValueError("sample_every must be at least 1, "
+			"got %r" % (sample_every,))
+	disable_stats()
+	_stats = _Stats(sample_every)
+	_installCountedMethods()
+	for backend in list(_backends):
+		backend._installDigest()
+
+
+def disable_stats():
+	"""
+	Stop collecting counters, and put back the uninstrumented methods of
+	the secure types and hash backends.  L{stats} keeps returning the final counts
+	until instrumentation is enabled again.
+	"""
+	global _stats, _finalStats
+	if _stats is None:
+		return
+	stats, _stats = _stats, None
+	stats._uninstrumentMethods()
+	_installCountedMethods()
+	for backend in list(_backends):
+		backend._installDigest()
+	_finalStats = stats.snapshot(False)
+
+
+def stats():
+	"""
+	Return a C{dict} snapshot of the instrumentation counters, suitable for
+	exporting to a metrics system:
+
+	C{enabled}: whether the counters are still being collected.
+
+	C{sample_every}: see L{enable_stats}.
+
+	C{elapsed_seconds}: how long the counters have been (or were) collected.
+
+	C{hashes}: the number of keys hashed by hash backends, counting a tuple
+	as one key.
+
+	C{hash_seconds}: the time spent hashing them, estimated if sampling.
+
+	C{cache_hits}, C{cache_misses}: lookups in the L{DigestCache}s of hash
+	backends.
+
+	C{gets}, C{sets}, C{deletes}, C{contains}: calls to C{__getitem__},
+	C{get}, C{get_or_insert} and C{get_or_compute}; C{__setitem__}, C{add}
+	and C{put}; C{__delitem__}, C{pop}, C{remove} and C{discard}; and
+	C{__contains__}, on the secure types other than frozensecuredict.
+
+	C{ingests}: bulk insertions of keys into securedicts and
+	concurrentsecuredicts.
+	"""
+	if _stats is not None:
+		return _stats.snapshot(True)
+	if _finalStats is not None:
+		return dict(_finalStats)
+	snapshot = _Stats(1).snapshot(False)
+	snapshot['elapsed_seconds'] = 0.0
+	return snapshot
+
+
+
+# (class, name) -> the method as the class defines it, for every method that
+# instrumentation replaces
+_definedMethods = dict(
+	((cls, name), cls.__dict__[name])
+	for cls in (securedict, secureordereddict, _SecureSetMixin, secureset,
+		securecache, concurrentsecuredict)
+	for name, _ in _COUNTED_METHODS
+	if name in cls.__dict__)
+
+
+def _installCountedMethods():
+	"""
+	Install the methods that the secure types define, wrapped to count
+	calls if instrumentation is enabled.
+	"""
+	counters = dict(_COUNTED_METHODS)
+	for (cls, name), method in _definedMethods.items():
+		if _stats is not None:
+			method = _stats._counted(method, counters[name])
+		setattr(cls, name, method)
+
+
+
+class _Rotation(object):
+	"""
+	The progress of every secret rotation so far.  C{retired} maps the id
+	of each retired hash backend that is still alive to a weak reference to
+	it.
+	"""
+	def __init__(self):
+		self.rotations = 0
+		self.batch_size = 32
+		self.dicts_started = 0
+		self.dicts_finished = 0
+		self.keys_rehashed = 0
+		self.keys_pending = 0
+		self.retired = {}
+
+
+	def _retire(self, backend):
+		retired = self.retired
+		key = id(backend)
+		def collected(r):
+			if retired.get(key) is r:
+				del retired[key]
+		retired[key] = ref(backend, collected)
+
+
+	def snapshot(self):
+		return dict(
+			rotations=self.rotations,
+			retired_backends=len(self.retired),
+			dicts_started=self.dicts_started,
+			dicts_finished=self.dicts_finished,
+			keys_rehashed=self.keys_rehashed,
+			keys_pending=self.keys_pending,
+			finished=not self.retired)
+
+
+_rotation = _Rotation()
+
+
+def _renewBackend(backend):
+	"""
+	Return a successor for C{backend} made with the current process-wide
+	secret.  A digest cache holds digests made with the old secret, so the
+	successor gets an empty one with the same limits.
+	"""
+	successor = backend._renewed()
+	# Make the same kind of key wrappers (C or Python) as the old backend,
+	# so that they can be mixed in one securedict
+	successor._speedups = backend._speedups
+	cache = backend.digest_cache
+	if cache is not None:
+		cache = DigestCache(cache.max_entries, cache.max_key_length)
+	successor.set_digest_cache(cache)
+	return successor
+
+
+def _subclasses(cls):
+	"""
+	Return C{cls} and all of its subclasses.
+	"""
+	classes = [cls]
+	for c in classes:
+		for sub in type.__subclasses__(c):
+			if sub not in classes:
+				classes.append(sub)
+	return classes
+
+
+def rotate_secret(secret=None, batch_size=32):
+	"""
+	Replace the process-wide secret with C{secret} (or new random bytes),
+	and retire every hash backend made with the old one, including the
+	default hash backend.  Each retired backend gets a successor with the
+	same options and the new secret, which replaces it as the default and
+	as the C{hash_backend} of any class that selected it.
+
+	A securedict or secureordereddict whose backend was retired keeps
+	working, and starts moving its keys to wrappers made by the successor
+	the next time it is written to: every insertion or deletion moves the
+	keys in up to C{batch_size} more wrappers, so the work is spread across
+	operations instead of done in one pass.  Lookups find keys wherever
+	they are, but never move them.  Starting costs a copy of the
+	securedict's wrappers (a few nanoseconds per key); after that, a
+	lookup that misses with the successor hashes its key once more for
+	each retired backend until the securedict has finished.  C{securedict.rehash()} moves keys without
+	waiting for writes.
+
+	A secureset or concurrentsecuredict whose backend was retired rehashes
+	all of its keys the next time it is written to, and a securecache the
+	next time it is used.  A frozensecureset can't change its backend;
+	make a new one to let the rotation finish.
+
+	L{rotation_progress} tells when every retired backend has been dropped.
+	"""
+	global _securetypes_SECRET, _defaultBackend
+	if batch_size < 1:
+		raise ValueError("batch_size must be at least 1, "
+			"got %r" % (batch_size,))
+	if secret is None:
+		secret = urandom(20)
+	_securetypes_SECRET = secret
+	_rotation.batch_size = batch_size
+	_rotation.rotations += 1
+	retiring = [backend for backend in list(_backends)
+		if backend._processSecret and backend._successor is None]
+	for backend in retiring:
+		backend._successor = _renewBackend(backend)
+		_rotation._retire(backend)
+	if _defaultBackend._successor is not None:
+		_defaultBackend = _defaultBackend._successor
+	for cls in (_subclasses(securedict) + _subclasses(concurrentsecuredict) +
+	_subclasses(_SecureSetMixin)):
+		backend = cls.__dict__.get('hash_backend')
+		if getattr(backend, '_successor', None) is not None:
+			cls.hash_backend = backend._successor
+
+
+def rotation_progress():
+	"""
+	Return a C{dict} snapshot of the progress of every L{rotate_secret} so
+	far:
+
+	C{rotations}: the number of rotations.
+
+	C{retired_backends}: the retired hash backends that are still alive.
+	Secure types that were made with them, and securedicts that haven't
+	finished moving their keys, keep them alive; a backend is freed as soon
+	as nothing uses it, without waiting for the garbage collector.
+
+	C{finished}: whether C{retired_backends} is 0, so that nothing hashes
+	with an old secret any more.
+
+	C{dicts_started}, C{dicts_finished}: the securedicts that have started
+	and finished moving their keys.
+
+	C{keys_rehashed}: the keys moved to wrappers made with a new secret.
+
+	C{keys_pending}: the wrappers that started securedicts have yet to
+	visit, including those of keys deleted since, which are skipped.
+	"""
+	return _rotation.snapshot()
+
+
+
+__all__ = [
+	'__version__', 'is_dict_update_broken', 'securedict', 'secureordereddict',
+	'securecache', 'concurrentsecuredict', 'frozensecuredict', 'secureset',
+	'frozensecureset', 'Sha1Backend', 'Blake2bBackend', 'default_hash_backend', 'DigestCache',
+	'register_encoder', 'enable_stats', 'disable_stats', 'stats',
+	'rotate_secret', 'rotation_progress']
+if KeysView is not None:
+	__all__ += ['SecureKeysView', 'SecureItemsView']
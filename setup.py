@@ -1,9 +1,48 @@
 #!/usr/bin/env python
 
-from distutils.core import setup
+import sys
+
+from distutils.core import setup, Extension
+from distutils.command.build_ext import build_ext
+from distutils.errors import (
+	CCompilerError, DistutilsExecError, DistutilsPlatformError)
 
 import securetypes
 
+
+class optional_build_ext(build_ext):
+	"""
+	Build the C accelerator if possible, but still install the pure-Python
+	securetypes if it can't be compiled.
+	"""
+	def run(self):
+		try:
+			build_ext.run(self)
+		except DistutilsPlatformError as e:
+			self._warn(e)
+
+
+	def build_extension(self, ext):
+		try:
+			build_ext.build_extension(self, ext)
+		except (CCompilerError, DistutilsExecError, DistutilsPlatformError,
+		IOError) as e:
+			self._warn(e)
+
+
+	def _warn(self, e):
+		sys.stderr.write("WARNING: The C accelerator for securetypes could "
+			"not be compiled (%s); securetypes will work, but more "
+			"slowly.\n" % (e,))
+
+
+
+ext_modules = []
+# pypy can't build CPython extensions, and doesn't need them to be fast.
+if not hasattr(sys, 'pypy_version_info'):
+	ext_modules.append(
+		Extension('_securetypes_speedups', ['_securetypes_speedups.c']))
+
 setup(
 	name='Securetypes',
 	version=securetypes.__version__,
@@ -14,10 +53,13 @@ setup(
 	author_email="ivan@ludios.org",
 	classifiers=[
 		'Programming Language :: Python :: 2',
+		'Programming Language :: Python :: 3',
 		'Development Status :: 3 - Alpha',
 		'Operating System :: OS Independent',
 		'Intended Audience :: Developers',
 		'License :: OSI Approved :: MIT License',
 	],
-	py_modules=['securetypes', 'test_securetypes'],
+	py_modules=['securetypes', 'test_securetypes', 'securejson', 'test_securejson'],
+	ext_modules=ext_modules,
+	cmdclass={'build_ext': optional_build_ext},
 )
@@ -0,0 +1,230 @@
+import sys
+
+from io import BytesIO
+
+try:
+	from StringIO import StringIO
+except ImportError:
+	from io import StringIO
+
+from twisted.trial import unittest
+
+import securejson
+from securetypes import securedict
+from securejson import (
+	LimitExceeded, SecureJSONDecoder, loads, load, iterload)
+
+if sys.version_info[0] >= 3:
+	xrange = range
+
+
+class LoadsTests(unittest.TestCase):
+	"""
+	Tests for L{securejson.loads} and L{securejson.load}.
+	"""
+	def test_objects(self):
+		obj = loads('{"b": ["bee", {}], "a": {"c": null}}')
+		self.assertEqual(obj, {'b': ['bee', {}], 'a': {'c': None}})
+		self.assertIsInstance(obj, securedict)
+		self.assertIsInstance(obj['b'][1], securedict)
+		self.assertIsInstance(obj['a'], securedict)
+
+
+	def test_notObjects(self):
+		self.assertEqual([1, 2.5, "x", True, None], loads('[1, 2.5, "x", true, null]'))
+		self.assertEqual(3, loads(' 3 '))
+
+
+	def test_duplicateKeys(self):
+		"""
+		Like the stdlib decoder, the last value for a duplicated key wins.
+		"""
+		self.assertEqual({'a': 2}, loads('{"a": 1, "a": 2}'))
+
+
+	def test_objectClass(self):
+		class mydict(securedict):
+			pass
+
+		obj = loads('{"a": {}}', object_class=mydict)
+		self.assertIsInstance(obj, mydict)
+		self.assertIsInstance(obj['a'], mydict)
+
+
+	def test_load(self):
+		self.assertEqual({'a': [1]}, load(StringIO('{"a": [1]}')))
+
+
+	def test_invalid(self):
+		self.assertRaises(ValueError, loads, '{"a": }')
+		self.assertRaises(ValueError, loads, '[1, 2')
+
+
+
+class LimitTests(unittest.TestCase):
+	"""
+	Tests for the limits enforced by L{securejson.SecureJSONDecoder}.
+	"""
+	def test_maxDepth(self):
+		self.assertEqual([[[1]]], loads('[[[1]]]', max_depth=3))
+		self.assertEqual({'a': [{}]}, loads('{"a": [{}]}', max_depth=3))
+		self.assertRaises(LimitExceeded, loads, '[[[[1]]]]', max_depth=3)
+		self.assertRaises(LimitExceeded, loads, '{"a": [{"b": []}]}', max_depth=3)
+		self.assertEqual(1, loads('1', max_depth=0))
+		self.assertRaises(LimitExceeded, loads, '[]', max_depth=0)
+
+
+	def test_maxDepthIgnoresStrings(self):
+		"""
+		Brackets inside strings don't count toward the nesting depth.
+		"""
+		self.assertEqual(["[[[{{{", '\\"[['], loads(r'["[[[{{{", "\\\"[["]', max_depth=1))
+
+
+	def test_maxDepthSiblings(self):
+		"""
+		Sibling arrays and objects don't add to the nesting depth.
+		"""
+		doc = '[' + ', '.join(['[{}]'] * 1000) + ']'
+		self.assertEqual(1000, len(loads(doc, max_depth=3)))
+
+
+	def test_maxDepthBeforeParsing(self):
+		"""
+		The depth is checked once, before the document is parsed, so a
+		document nested too deep for the recursive scanner raises
+		L{LimitExceeded}.
+		"""
+		calls = []
+		checkDepth = securejson._checkDepth
+		def recordingCheckDepth(*args):
+			calls.append(args)
+			return checkDepth(*args)
+		self.patch(securejson, '_checkDepth', recordingCheckDepth)
+		self.assertEqual([[]], loads(' [[]]'))
+		self.assertEqual(1, len(calls))
+		self.assertRaises(LimitExceeded, loads, '[' * 100000 + ']' * 100000)
+
+
+	def test_maxDepthUnbalanced(self):
+		"""
+		Runs of closing brackets end the document's nesting, and malformed
+		documents are left for the scanner.
+		"""
+		self.assertEqual([[1], [[2]]], loads('[[1], [[2]]]', max_depth=3))
+		self.assertRaises(ValueError, loads, '[[1]]]]]', max_depth=2)
+		self.assertRaises(ValueError, loads, '[[1', max_depth=2)
+
+
+	def test_noMaxDepth(self):
+		self.assertEqual([[[[1]]]], loads('[[[[1]]]]', max_depth=None))
+
+
+	def test_defaultMaxDepth(self):
+		self.assertRaises(LimitExceeded, loads, '[' * 513 + ']' * 513)
+
+
+	def test_maxObjectKeys(self):
+		self.assertEqual({'a': 1, 'b': 2}, loads('{"a": 1, "b": 2}', max_object_keys=2))
+		self.assertRaises(LimitExceeded, loads, '[{"a": 1, "b": 2, "c": 3}]', max_object_keys=2)
+
+
+	def test_maxKeyLength(self):
+		self.assertEqual({'abc': 1}, loads('{"abc": 1}', max_key_length=3))
+		self.assertRaises(LimitExceeded, loads, '{"a": 1, "abcd": 1}', max_key_length=3)
+		self.assertEqual({}, loads('{}', max_key_length=3))
+
+
+	def test_limitExceededIsValueError(self):
+		self.assertTrue(issubclass(LimitExceeded, ValueError))
+
+
+	def test_decoder(self):
+		decoder = SecureJSONDecoder(max_object_keys=1)
+		self.assertEqual({'a': 1}, decoder.decode('{"a": 1}'))
+		self.assertRaises(LimitExceeded, decoder.decode, '{"a": 1, "b": 2}')
+
+
+
+class IterloadTests(unittest.TestCase):
+	"""
+	Tests for L{securejson.iterload}.
+	"""
+	doc = '{"a": 1}\n[1, 2]\n 123 45 "x y"  {"k": {"z": null}}\n'
+
+	def test_stream(self):
+		expected = [{'a': 1}, [1, 2], 123, 45, "x y", {'k': {'z': None}}]
+		for chunk_size in (1, 2, 3, 7, 65536):
+			self.assertEqual(
+				expected, list(iterload(StringIO(self.doc), chunk_size=chunk_size)))
+
+
+	def test_empty(self):
+		self.assertEqual([], list(iterload(StringIO(''))))
+		self.assertEqual([], list(iterload(StringIO(' \n '))))
+
+
+	def test_numberAtChunkBoundary(self):
+		"""
+		A number split across chunks isn't decoded as two numbers.
+		"""
+		self.assertEqual([12345], list(iterload(StringIO('12345'), chunk_size=2)))
+
+
+	def test_largeDocument(self):
+		doc = '[' + ', '.join('{"k%d": %d}' % (i, i) for i in xrange(2000)) + ']'
+		result = list(iterload(StringIO(doc + doc), chunk_size=16))
+		self.assertEqual(2, len(result))
+		self.assertEqual({'k1999': 1999}, result[1][1999])
+
+
+	def test_truncated(self):
+		self.assertRaises(ValueError, list, iterload(StringIO('[1] {"a": '), chunk_size=4))
+
+
+	def test_limits(self):
+		self.assertRaises(LimitExceeded, list,
+			iterload(StringIO('[1] [[2]]'), chunk_size=3, max_depth=1))
+		self.assertEqual([[1], [2]], list(
+			iterload(StringIO('[1] [2] '), chunk_size=3, max_depth=1)))
+		self.assertRaises(LimitExceeded, list,
+			iterload(StringIO('{"abcd": 1}'), max_key_length=3))
+
+
+	def test_deepStream(self):
+		"""
+		A document nested deeper than C{max_depth} raises L{LimitExceeded}
+		before it is parsed.
+		"""
+		doc = '[1]\n' + '[' * 100000 + ']' * 100000
+		self.assertRaises(LimitExceeded, list, iterload(StringIO(doc)))
+
+
+	def test_bytes(self):
+		"""
+		A binary stream is decoded as UTF-8, even where a character is split
+		across chunks.
+		"""
+		doc = u'{"\u00e9\u20ac": "\U0001f600"} [1]'.encode('utf-8')
+		for chunk_size in (1, 2, 3, 65536):
+			self.assertEqual(
+				[{u"\u00e9\u20ac": u"\U0001f600"}, [1]],
+				list(iterload(BytesIO(doc), chunk_size=chunk_size)))
+
+
+
+class ObjectClassTests(unittest.TestCase):
+	"""
+	Tests for L{securejson.SecureJSONDecoder} with a securedict subclass
+	that customizes insertion.
+	"""
+	def test_overriddenSetitem(self):
+		seen = []
+		class recordingdict(securedict):
+			def __setitem__(self, key, value):
+				seen.append(key)
+				securedict.__setitem__(self, key, value)
+
+		obj = loads('{"a": 1, "b": {"c": 2}}', object_class=recordingdict)
+		self.assertEqual({'a': 1, 'b': {'c': 2}}, obj)
+		self.assertEqual(['a', 'b', 'c'], sorted(seen))